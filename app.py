@@ -6,6 +6,7 @@ from sqlalchemy.orm import Session
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional, Annotated, TypedDict
 from datetime import datetime
+import time
 import logging
 import uvicorn
 import os
@@ -28,7 +29,15 @@ async def verify_session(request: Request):
 try:
     from tables import Contact, ContentInfo, get_db, create_tables
     from drip_logic import add_new_contact_and_start_drip, trigger_drip_processing, drip_manager
-    from mail_service import check_and_update_replies
+    from mail_service import check_and_update_replies, close_smtp_connections, mail_service
+    from send_engine import send_engine
+    from idle_listener import ImapIdleListener
+    from llm_pool import llm_pool
+    from caching import industry_cache, sentiment_cache
+    from drip_batch import drip_batch
+    from llm_metrics import llm_metrics
+    from sharding import shard_assignment
+    from send_scheduler import send_rate_scheduler
     from apscheduler.schedulers.background import BackgroundScheduler
     from apscheduler.triggers.interval import IntervalTrigger
     from apscheduler.triggers.cron import CronTrigger
@@ -53,10 +62,14 @@ logging.getLogger('apscheduler.scheduler').setLevel(logging.WARNING)
 async def lifespan(app: FastAPI):
     try:
         if DATABASE_AVAILABLE:
-            create_tables()
+            added_columns = create_tables()
+            if ("first", "next_drip_at") in added_columns:
+                drip_manager.backfill_next_drip_at()
             if scheduler and not scheduler.running:
                 scheduler.start()
                 logger.info("Scheduler started - Agent 1 (daily at 9 AM), Agent 2 (daily at 10 AM), Agent 3 (every 30 min)")
+            if idle_listener:
+                idle_listener.start()
         else:
             logger.info("Running in frontend-only mode")
         logger.info("Application started successfully")
@@ -67,6 +80,12 @@ async def lifespan(app: FastAPI):
     
     try:
         shutdown_scheduler()
+        if idle_listener:
+            idle_listener.stop()
+        if DATABASE_AVAILABLE:
+            close_smtp_connections()
+            llm_pool.shutdown(wait=False)
+            llm_metrics.flush()
         logger.info("Application shutdown completed")
     except Exception as e:
         logger.error(f"Error during shutdown: {str(e)}")
@@ -138,7 +157,8 @@ if DATABASE_AVAILABLE:
     }
     
     executors = {
-        'default': ThreadPoolExecutor(max_workers=3)
+        # A paced drip run can hold one thread for the whole send window
+        'default': ThreadPoolExecutor(max_workers=int(os.getenv("SCHEDULER_MAX_WORKERS", "5")))
     }
     
     job_defaults = {
@@ -154,14 +174,20 @@ if DATABASE_AVAILABLE:
         timezone=pytz.timezone('Asia/Kolkata')
     )
 
+# Push-mode reply listener; the 30-minute reply_checking_job stays as the fallback
+idle_listener = None
+if DATABASE_AVAILABLE and os.getenv("IMAP_IDLE_ENABLED", "true").lower() == "true":
+    idle_listener = ImapIdleListener(on_new_mail=check_and_update_replies)
+
 def scheduled_drip_processing():
     """Background task to process drips - runs daily"""
     if not DATABASE_AVAILABLE:
         return
     try:
         logger.info("Running daily drip processing...")
-        drip_manager.process_drips()
-        logger.info("Daily drip processing completed")
+        started = time.perf_counter()
+        summary = send_engine.run_drips()
+        logger.info(f"Daily drip processing completed in {time.perf_counter() - started:.1f}s: {summary}")
     except Exception as e:
         logger.error(f"Error in drip processing: {str(e)}")
 
@@ -176,14 +202,35 @@ def scheduled_reply_checking():
     except Exception as e:
         logger.error(f"Error checking replies: {str(e)}")
 
+def scheduled_drip_precompute():
+    """Background task to batch-generate tomorrow's drips - runs nightly"""
+    if not DATABASE_AVAILABLE:
+        return
+    try:
+        logger.info("Submitting next-day drip batch...")
+        batch_id = drip_batch.submit_next_day_batch()
+        logger.info(f"Next-day drip batch submitted: {batch_id}")
+    except Exception as e:
+        logger.error(f"Error submitting drip batch: {str(e)}")
+
+def scheduled_drip_batch_collection():
+    """Background task to store finished drip batch results as drafts"""
+    if not DATABASE_AVAILABLE:
+        return
+    try:
+        ready = drip_batch.collect_results()
+        logger.info(f"Drip batch collection completed. {ready} drafts ready.")
+    except Exception as e:
+        logger.error(f"Error collecting drip batch results: {str(e)}")
+
 def scheduled_initial_emails():
     """Background task to send initial emails - runs daily"""
     if not DATABASE_AVAILABLE:
         return
     try:
         logger.info("Processing initial emails...")
-        drip_manager.process_initial_emails()
-        logger.info("Initial email processing completed")
+        summary = send_engine.run_initial_emails()
+        logger.info(f"Initial email processing completed: {summary}")
     except Exception as e:
         logger.error(f"Error processing initial emails: {str(e)}")
 
@@ -200,12 +247,33 @@ if DATABASE_AVAILABLE and scheduler:
 
         scheduler.add_job(
             func=scheduled_drip_processing,
-            trigger=CronTrigger(hour=10, minute=0, timezone=pytz.timezone('Asia/Kolkata')),
+            trigger=CronTrigger(
+                hour=send_rate_scheduler.window_start[0],
+                minute=send_rate_scheduler.window_start[1],
+                timezone=pytz.timezone('Asia/Kolkata')
+            ),
             id='drip_processing_job',
             name='Daily Drip Processing',
             replace_existing=True
         )
 
+        if os.getenv("DRIP_BATCH_ENABLED", "false").lower() == "true":
+            scheduler.add_job(
+                func=scheduled_drip_precompute,
+                trigger=CronTrigger(hour=22, minute=0, timezone=pytz.timezone('Asia/Kolkata')),
+                id='drip_precompute_job',
+                name='Nightly Drip Batch Precompute',
+                replace_existing=True
+            )
+
+            scheduler.add_job(
+                func=scheduled_drip_batch_collection,
+                trigger=CronTrigger(hour='0-9', minute=30, timezone=pytz.timezone('Asia/Kolkata')),
+                id='drip_batch_collection_job',
+                name='Drip Batch Collection',
+                replace_existing=True
+            )
+
         scheduler.add_job(
             func=scheduled_reply_checking,
             trigger=IntervalTrigger(minutes=30, timezone=pytz.timezone('Asia/Kolkata')),
@@ -388,6 +456,63 @@ async def get_stats(db: Session = Depends(get_db)):
         logger.error(f"Error getting stats: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/stats/llm-pool")
+async def get_llm_pool_stats():
+    """Get queue depth, in-flight count and latency of the shared LLM generation pool"""
+    if not DATABASE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Database not available")
+    return llm_pool.stats()
+
+@app.get("/stats/caches")
+async def get_cache_stats():
+    """Get hit rates of the classification caches"""
+    if not DATABASE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Database not available")
+    return {
+        "industry": industry_cache.stats(),
+        "sentiment": sentiment_cache.stats()
+    }
+
+@app.get("/stats/assistant-runs")
+async def get_assistant_run_stats():
+    """Get average tokens and latency of assistant runs by thread length"""
+    if not DATABASE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Database not available")
+    return {"by_thread_length": mail_service.thread_manager.run_stats.stats()}
+
+@app.get("/stats/llm-usage")
+async def get_llm_usage_stats(hours: int = 24):
+    """Get LLM calls, tokens, latency, retries and estimated cost by call site and job"""
+    if not DATABASE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Database not available")
+    try:
+        return llm_metrics.summary(hours=hours)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/shards")
+async def get_shards():
+    """Get the shard key, shard count, this node's shard and active contacts per shard"""
+    if not DATABASE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Database not available")
+    try:
+        return shard_assignment.distribution()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/shards/rebalance")
+async def rebalance_shards(shard_count: int):
+    """Change the shard count for every node; nodes pick it up at the start of their next run"""
+    if not DATABASE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Database not available")
+    try:
+        return shard_assignment.rebalance(shard_count)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error rebalancing shards: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.delete("/contacts/{contact_id}")
 async def delete_contact(contact_id: int, db: Session = Depends(get_db)):
     """Delete a contact and their content info"""
@@ -459,11 +584,22 @@ async def get_scheduler_jobs():
                 "next_run": job.next_run_time.isoformat() if job.next_run_time else None,
                 "trigger": str(job.trigger)
             })
-        return {"jobs": jobs, "scheduler_running": scheduler.running}
+        return {
+            "jobs": jobs,
+            "scheduler_running": scheduler.running,
+            "idle_listener_running": bool(idle_listener and idle_listener.is_running())
+        }
     except Exception as e:
         logger.error(f"Error getting scheduler jobs: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/scheduler/send-plan")
+async def get_send_plan():
+    """Get the drip send window, paced rate, projected completion and daily send budget"""
+    if not DATABASE_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Database not available")
+    return {**send_rate_scheduler.status(), "budget": mail_service.send_budget.status()}
+
 # Include Frontend Routes (always available)
 app.include_router(auth_router)
 app.include_router(client_router)
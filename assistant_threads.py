@@ -0,0 +1,171 @@
+import os
+import threading
+import logging
+from typing import Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from tables import AssistantThread, Contact, get_db_session
+from llm_metrics import llm_metrics
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class RunStatsByThreadLength:
+    """Average prompt tokens, completion tokens and latency of runs, bucketed by thread turn count."""
+
+    def __init__(self, bucket_size: int = 5):
+        self.bucket_size = bucket_size
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def record(self, turn_count: int, prompt_tokens: int, completion_tokens: int, seconds: float):
+        start = (turn_count // self.bucket_size) * self.bucket_size
+        with self._lock:
+            bucket = self._buckets.setdefault(start, {"runs": 0, "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0})
+            bucket["runs"] += 1
+            bucket["prompt_tokens"] += prompt_tokens
+            bucket["completion_tokens"] += completion_tokens
+            bucket["seconds"] += seconds
+
+    def stats(self) -> list:
+        with self._lock:
+            return [
+                {
+                    "thread_turns": f"{start}-{start + self.bucket_size - 1}",
+                    "runs": bucket["runs"],
+                    "avg_prompt_tokens": round(bucket["prompt_tokens"] / bucket["runs"]),
+                    "avg_completion_tokens": round(bucket["completion_tokens"] / bucket["runs"]),
+                    "avg_seconds": round(bucket["seconds"] / bucket["runs"], 2)
+                }
+                for start, bucket in sorted(self._buckets.items())
+            ]
+
+class AssistantThreadManager:
+    """
+    Keeps Assistants threads from growing without bound. It tracks turns per
+    thread, attaches the knowledge file only on a thread's first message, and
+    after THREAD_MAX_TURNS replaces the thread with a fresh one seeded with a
+    rolling summary. Contacts pointing at the old thread are moved across.
+    """
+
+    def __init__(self, openai_client, file_id: str):
+        self.openai_client = openai_client
+        self.file_id = file_id
+        self.max_turns = int(os.getenv("THREAD_MAX_TURNS", "12"))
+        self.context_messages = int(os.getenv("THREAD_CONTEXT_MESSAGES", "10"))
+        self.max_prompt_tokens = int(os.getenv("ASSISTANT_MAX_PROMPT_TOKENS", "20000"))
+        self.run_stats = RunStatsByThreadLength()
+
+    def run_options(self) -> dict:
+        return {
+            "truncation_strategy": {"type": "last_messages", "last_messages": self.context_messages},
+            "max_prompt_tokens": self.max_prompt_tokens
+        }
+
+    def prepare(self, thread_id: str) -> Tuple[str, list, int]:
+        """
+        Returns the thread to use, the attachments for the next message and the
+        thread's turn count. That thread differs from thread_id when it has been
+        compacted, so callers caching thread ids should store the one returned.
+        """
+        with get_db_session() as db:
+            state = self._load_state(db, thread_id)
+            while state.replaced_by:
+                state = self._load_state(db, state.replaced_by)
+            if state.turn_count >= self.max_turns:
+                # End the read transaction before the summary call rather than holding it open
+                db.commit()
+                state = self._load_state(db, self._compact(db, state.thread_id))
+
+            attachments = [] if state.file_attached else [
+                {"file_id": self.file_id, "tools": [{"type": "file_search"}]}
+            ]
+            return state.thread_id, attachments, state.turn_count
+
+    def record_turn(self, thread_id: str):
+        # A single UPDATE, so recording a turn needs no read of its own
+        with get_db_session() as db:
+            db.query(AssistantThread).filter(AssistantThread.thread_id == thread_id).update({
+                AssistantThread.turn_count: func.coalesce(AssistantThread.turn_count, 0) + 1,
+                AssistantThread.file_attached: True
+            }, synchronize_session=False)
+
+    def forget(self, thread_id: str):
+        """Drops the turn-count row of a thread that has been deleted."""
+        try:
+            with get_db_session() as db:
+                db.query(AssistantThread).filter(AssistantThread.thread_id == thread_id).delete(synchronize_session=False)
+        except Exception as e:
+            logger.warning(f"Could not drop state for assistant thread {thread_id}: {e}")
+
+    def _load_state(self, db: Session, thread_id: str) -> AssistantThread:
+        state = db.query(AssistantThread).filter(AssistantThread.thread_id == thread_id).first()
+        if not state:
+            try:
+                # A savepoint, so losing the insert race does not roll back the rest of the session
+                with db.begin_nested():
+                    state = AssistantThread(thread_id=thread_id, turn_count=0, file_attached=False)
+                    db.add(state)
+            except IntegrityError:
+                state = db.query(AssistantThread).filter(AssistantThread.thread_id == thread_id).first()
+        return state
+
+    def _compact(self, db: Session, thread_id: str) -> str:
+        summary = self._summarize(thread_id)
+        if summary is None:
+            return thread_id
+
+        new_thread = self.openai_client.beta.threads.create(messages=[{
+            "role": "user",
+            "content": f"Summary of the conversation so far with this contact, for context on future emails:\n\n{summary}"
+        }])
+        # Conditional update so only one worker's compaction wins a race
+        claimed = db.query(AssistantThread).filter(
+            AssistantThread.thread_id == thread_id,
+            AssistantThread.replaced_by.is_(None)
+        ).update({AssistantThread.replaced_by: new_thread.id}, synchronize_session=False)
+        if not claimed:
+            winner = db.query(AssistantThread.replaced_by).filter(AssistantThread.thread_id == thread_id).scalar()
+            self._delete_thread(new_thread.id)
+            return winner or thread_id
+        db.add(AssistantThread(thread_id=new_thread.id, turn_count=0, file_attached=False))
+        db.query(Contact).filter(Contact.thread_id == thread_id).update(
+            {Contact.thread_id: new_thread.id}, synchronize_session=False
+        )
+        db.commit()
+        logger.info(f"Compacted assistant thread {thread_id} into {new_thread.id}")
+        return new_thread.id
+
+    def _summarize(self, thread_id: str) -> Optional[str]:
+        try:
+            messages = self.openai_client.beta.threads.messages.list(thread_id=thread_id, order="asc", limit=100)
+            transcript = "\n\n".join(
+                f"{message.role.upper()}: {message.content[0].text.value}"
+                for message in messages.data if message.content and hasattr(message.content[0], "text")
+            )
+            response = llm_metrics.chat_completion(
+                self.openai_client,
+                "thread_summary",
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": f"""
+Summarize this email outreach conversation in at most 200 words. Keep every fact needed to write the next email:
+what was sent and when in the sequence, the prospect's replies, questions asked, answers given and any commitments.
+
+{transcript}
+"""}],
+                temperature=0.2
+            )
+            return response.choices[0].message.content.strip()
+        except Exception as e:
+            logger.error(f"Could not summarize assistant thread {thread_id}: {e}")
+            return None
+
+    def _delete_thread(self, thread_id: str):
+        try:
+            self.openai_client.beta.threads.delete(thread_id)
+        except Exception as e:
+            logger.warning(f"Could not delete unused OpenAI thread {thread_id}: {e}")
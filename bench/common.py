@@ -0,0 +1,62 @@
+"""
+Shared setup for the scripts in bench/. Importing this puts the repo root on
+sys.path. use_mock_environment() points the app at local stand-ins, using the
+same placeholder ids as the README's load-testing section, before any app
+module is imported.
+"""
+import os
+import sys
+import time
+import socket
+import threading
+import logging
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+def use_mock_environment(llm_port: int = None, smtp_port: int = None):
+    """Defaults the OpenAI and SMTP settings to the mock LLM server and SMTP sink. Existing env vars win."""
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    os.environ.setdefault("ASSISTANT_ID", "asst_mock")
+    os.environ.setdefault("FILE_ID", "file_mock")
+    os.environ.setdefault("THREAD_ID", "thread_mock")
+    os.environ.setdefault("ASSISTANT_RUN_STREAMING", "false")
+    if llm_port:
+        os.environ.setdefault("OPENAI_BASE_URL", f"http://127.0.0.1:{llm_port}/v1")
+    if smtp_port:
+        os.environ.setdefault("SMTP_HOST", "127.0.0.1")
+        os.environ.setdefault("SMTP_PORT", str(smtp_port))
+        os.environ.setdefault("EMAIL_ADDRESS", "bench@example.com")
+        os.environ.setdefault("EMAIL_PASSWORD", "bench")
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_mock_llm(port: int = None) -> int:
+    """Runs mock_llm_server in a daemon thread and returns its port once it accepts connections."""
+    import uvicorn
+    from mock_llm_server import app
+
+    port = port or free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    wait_for_port(port)
+    return port
+
+def wait_for_port(port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+def quiet_logs():
+    logging.getLogger().setLevel(logging.WARNING)
+    for name in list(logging.root.manager.loggerDict):
+        logging.getLogger(name).setLevel(logging.WARNING)
@@ -0,0 +1,101 @@
+"""
+Wall time of the morning drip run (send_engine.run_drips) with and without
+drafts precomputed overnight by the Batch API.
+
+- "live" generates every drip through an Assistants run during the send.
+- "precomputed" first submits the batch (drip_batch.submit_next_day_batch),
+  waits for collect_results to store the drafts, then times run_drips alone.
+
+Generation, the batch and its files go to the mock LLM server, and sends go
+to the SMTP sink. The latency flags set how slow each mock call is.
+
+Needs DB_* pointing at a scratch MySQL database: it uses the same
+@bench.example contacts as drip_workers_exactly_once.py and deletes their
+drafts between rounds.
+
+    python bench/drip_precompute_morning.py --contacts 200
+"""
+import os
+import time
+import argparse
+
+from common import use_mock_environment, start_mock_llm, quiet_logs
+from smtp_sink import SmtpSink
+from drip_workers_exactly_once import BENCH_DOMAIN, seed_due_drips
+
+def reset(contacts: int):
+    from tables import Contact, DripDraft, SendLogEntry, get_db_session
+
+    seed_due_drips(contacts)
+    with get_db_session() as db:
+        bench_ids = db.query(Contact.id).filter(Contact.email.like(f"%@{BENCH_DOMAIN}"))
+        db.query(DripDraft).filter(DripDraft.contact_id.in_(bench_ids)).delete(synchronize_session=False)
+        db.query(SendLogEntry).filter(SendLogEntry.account == os.environ["EMAIL_ADDRESS"]).delete(synchronize_session=False)
+
+def draft_counts() -> dict:
+    from sqlalchemy import func
+    from tables import Contact, DripDraft, get_db_session
+
+    with get_db_session() as db:
+        rows = db.query(DripDraft.status, func.count(DripDraft.id)).join(Contact, Contact.id == DripDraft.contact_id).filter(
+            Contact.email.like(f"%@{BENCH_DOMAIN}")
+        ).group_by(DripDraft.status).all()
+    return {status: count for status, count in rows}
+
+def precompute(drip_batch, timeout: float) -> float:
+    started = time.perf_counter()
+    if not drip_batch.submit_next_day_batch():
+        raise SystemExit("Nothing was submitted; are the bench contacts due?")
+    deadline = time.monotonic() + timeout
+    while draft_counts().get("pending") and time.monotonic() < deadline:
+        time.sleep(0.5)
+        drip_batch.collect_results()
+    return time.perf_counter() - started
+
+def timed_run(send_engine) -> tuple:
+    started = time.perf_counter()
+    summary = send_engine.run_drips()
+    return time.perf_counter() - started, summary
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--contacts", type=int, default=200)
+    parser.add_argument("--llm-latency", default="lognormal:0.8,0.5")
+    parser.add_argument("--run-latency", default="lognormal:4.0,0.5")
+    parser.add_argument("--batch-latency", default="fixed:2")
+    parser.add_argument("--smtp-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    os.environ.update({
+        "MOCK_LLM_LATENCY": args.llm_latency,
+        "MOCK_LLM_RUN_LATENCY": args.run_latency,
+        "MOCK_LLM_BATCH_LATENCY": args.batch_latency,
+        "SEND_SMOOTHING_ENABLED": "false",
+        "EMAIL_TEMPLATE_MODE": "false",
+        "DAILY_SEND_LIMIT": str(args.contacts * 10),
+        "SHARD_COUNT": "1",
+    })
+    sink = SmtpSink(latency=args.smtp_latency)
+    use_mock_environment(llm_port=start_mock_llm(), smtp_port=sink.start())
+    quiet_logs()
+    from send_engine import send_engine
+    from drip_batch import drip_batch
+    quiet_logs()
+
+    reset(args.contacts)
+    live_seconds, live = timed_run(send_engine)
+
+    reset(args.contacts)
+    batch_seconds = precompute(drip_batch, timeout=600)
+    ready = draft_counts().get("ready", 0)
+    precomputed_seconds, precomputed = timed_run(send_engine)
+    used = draft_counts().get("sent", 0)
+
+    print(f"{args.contacts} due drips, run latency {args.run_latency}, SMTP {args.smtp_latency * 1000:.0f} ms")
+    print(f"live         morning run {live_seconds:8.1f}s  sent {live['sent']}/{live['total']}")
+    print(f"precomputed  morning run {precomputed_seconds:8.1f}s  sent {precomputed['sent']}/{precomputed['total']}  "
+          f"({ready} drafts ready, {used} used; overnight batch took {batch_seconds:.1f}s)")
+    print(f"speedup      {live_seconds / precomputed_seconds:8.1f}x on the morning run")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Runs several drip worker processes against one database at the same time
+and checks that each due drip goes out exactly once. It also reports how
+throughput changes with the number of workers. Every worker runs
+send_engine.run_drips with its own WORKER_ID. They share one mock LLM server
+and one SMTP sink, so the sink sees every recipient from every worker.
+
+--kill-after SECONDS SIGKILLs the first worker mid-run. After DRIP_LEASE_SECONDS
+a recovery worker picks up its expired leases. A killed worker can die after
+a send but before recording it, so in that mode up to
+SEND_ENGINE_SMTP_CONCURRENCY duplicates are expected. Every contact must
+still get its drip.
+
+Needs DB_* pointing at a scratch MySQL database: it inserts contacts whose
+emails end in @bench.example and overwrites their drip state.
+
+    python bench/drip_workers_exactly_once.py --contacts 2000 --workers 1 2 4
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import subprocess
+from collections import Counter
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from common import use_mock_environment, start_mock_llm, quiet_logs
+from smtp_sink import SmtpSink
+
+BENCH_DOMAIN = "bench.example"
+
+def seed_due_drips(contacts: int):
+    """Puts every bench contact one step into the sequence with Drip 1 due now."""
+    from sqlalchemy import func
+    from tables import Contact, ContentInfo, get_db_session
+    from drip_logic import to_wall_clock
+
+    wall_now = to_wall_clock(datetime.now(ZoneInfo("Asia/Kolkata")))
+    with get_db_session() as db:
+        existing = db.query(func.count(Contact.id)).filter(Contact.email.like(f"%@{BENCH_DOMAIN}")).scalar()
+        if existing < contacts:
+            db.execute(Contact.__table__.insert(), [
+                {"name": f"Bench Contact {i}", "email": f"contact{i}@{BENCH_DOMAIN}", "company_name": f"Bench Co {i % 500}",
+                 "company_url": f"https://co{i % 500}.{BENCH_DOMAIN}", "industry": ["Retail", "SaaS", "Logistics"][i % 3]}
+                for i in range(existing, contacts)
+            ])
+        db.query(ContentInfo).filter(ContentInfo.client_email.like(f"%@{BENCH_DOMAIN}")).delete(synchronize_session=False)
+        db.query(Contact).filter(Contact.email.like(f"%@{BENCH_DOMAIN}")).update({
+            Contact.mail_sent_status: "1", Contact.status: None,
+            Contact.first_mail_date: wall_now - timedelta(days=3), Contact.drip1_date: None,
+            Contact.next_drip_at: wall_now - timedelta(minutes=1),
+            Contact.lease_owner: None, Contact.lease_expires_at: None
+        }, synchronize_session=False)
+
+def sent_drip_counts() -> Counter:
+    from sqlalchemy import func
+    from tables import Contact, get_db_session
+
+    with get_db_session() as db:
+        rows = db.query(Contact.mail_sent_status, func.count(Contact.id)).filter(
+            Contact.email.like(f"%@{BENCH_DOMAIN}")
+        ).group_by(Contact.mail_sent_status).all()
+    return Counter({status: count for status, count in rows})
+
+def run_worker():
+    quiet_logs()
+    from send_engine import send_engine
+    quiet_logs()
+    print(json.dumps(send_engine.run_drips()))
+
+def run_round(workers: int, contacts: int, kill_after: float, lease_seconds: int, sink: SmtpSink) -> dict:
+    from tables import SendLogEntry, get_db_session
+
+    seed_due_drips(contacts)
+    with get_db_session() as db:
+        db.query(SendLogEntry).filter(SendLogEntry.account == os.environ["EMAIL_ADDRESS"]).delete(synchronize_session=False)
+    sink.recipients.clear()
+
+    started = time.perf_counter()
+    processes = [
+        subprocess.Popen([sys.executable, __file__, "--worker"], env={**os.environ, "WORKER_ID": f"bench-worker-{index}"},
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        for index in range(workers)
+    ]
+    killed = False
+    if kill_after:
+        time.sleep(kill_after)
+        processes[0].send_signal(signal.SIGKILL)
+        killed = True
+    for process in processes:
+        process.wait()
+    elapsed = time.perf_counter() - started
+
+    if killed:
+        # Leases held by the killed worker become claimable once they expire
+        time.sleep(lease_seconds + 1)
+        subprocess.run([sys.executable, __file__, "--worker"], env={**os.environ, "WORKER_ID": "bench-recovery"},
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    per_recipient = Counter(address for address in sink.recipients if address.endswith(f"@{BENCH_DOMAIN}"))
+    return {
+        "workers": workers,
+        "seconds": round(elapsed, 2),
+        "sent": sum(per_recipient.values()),
+        "missing": contacts - len(per_recipient),
+        "duplicates": sum(count - 1 for count in per_recipient.values() if count > 1),
+        "db_status": dict(sent_drip_counts()),
+        "killed": killed
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--contacts", type=int, default=2000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--kill-after", type=float, default=0.0)
+    parser.add_argument("--llm-latency", default="fixed:0.05")
+    parser.add_argument("--smtp-latency", type=float, default=0.005)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker()
+        return
+
+    lease_seconds = 5 if args.kill_after else 900
+    os.environ.update({
+        "MOCK_LLM_LATENCY": args.llm_latency,
+        "MOCK_LLM_RUN_LATENCY": args.llm_latency,
+        "SEND_SMOOTHING_ENABLED": "false",
+        "DAILY_SEND_LIMIT": str(args.contacts * 10),
+        "DRIP_LEASE_SECONDS": str(lease_seconds),
+        "SHARD_COUNT": "1",
+    })
+    sink = SmtpSink(latency=args.smtp_latency)
+    use_mock_environment(llm_port=start_mock_llm(), smtp_port=sink.start())
+    quiet_logs()
+
+    allowed_duplicates = int(os.getenv("SEND_ENGINE_SMTP_CONCURRENCY", "3")) if args.kill_after else 0
+    failed = False
+    baseline = None
+    for workers in args.workers:
+        result = run_round(workers, args.contacts, args.kill_after, lease_seconds, sink)
+        rate = result["sent"] / result["seconds"] if result["seconds"] else 0.0
+        baseline = baseline or rate
+        ok = result["missing"] == 0 and result["duplicates"] <= allowed_duplicates
+        failed = failed or not ok
+        print(f"{workers} workers: {result['sent']} sends in {result['seconds']}s ({rate:.1f}/s, {rate / baseline:.2f}x), "
+              f"missing {result['missing']}, duplicates {result['duplicates']}, db {result['db_status']} "
+              f"{'OK' if ok else 'FAILED'}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
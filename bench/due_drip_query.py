@@ -0,0 +1,118 @@
+"""
+Time and memory to find today's due drips among a large contact table.
+"python filter" is the old process_drips: load every contact with
+mail_sent_status 1-3 and compare its last send date to drip_intervals in
+Python. "sql" is DripCampaignManager.due_contacts, which selects the ids
+with next_drip_at <= now through ix_first_next_drip_at_status. Every seeded
+contact that is due by date must also be due by next_drip_at.
+
+Contacts are spread over the drip stages with send dates in the last 60
+days, so only a small share is due on any day. Memory is what tracemalloc
+saw allocated during the lookup.
+
+Needs DB_* pointing at a scratch MySQL database: it inserts contacts whose
+emails end in @drips.bench.example. --cleanup deletes them afterwards.
+
+    python bench/due_drip_query.py --contacts 1000000
+"""
+import os
+import time
+import random
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from common import use_mock_environment, quiet_logs
+
+BENCH_DOMAIN = "drips.bench.example"
+DATE_COLUMNS = {"1": "first_mail_date", "2": "drip1_date", "3": "drip2_date"}
+
+def seed(contacts: int, intervals: dict, wall_now: datetime):
+    from sqlalchemy import func
+    from tables import Contact, get_db_session
+
+    with get_db_session() as db:
+        existing = db.query(func.count(Contact.id)).filter(Contact.email.like(f"%@{BENCH_DOMAIN}")).scalar()
+    for start in range(existing, contacts, 10000):
+        rows = []
+        for i in range(start, min(start + 10000, contacts)):
+            rng = random.Random(i)
+            stage = rng.choice(["1", "2", "3", "4"])
+            last_sent = wall_now - timedelta(days=rng.uniform(0, 60))
+            row = {"name": f"Drip Contact {i}", "email": f"contact{i}@{BENCH_DOMAIN}", "company_name": f"Bench Co {i % 500}",
+                   "industry": "Retail", "mail_sent_status": stage, "first_mail_date": last_sent, "next_drip_at": None}
+            if stage in DATE_COLUMNS:
+                row[DATE_COLUMNS[stage]] = last_sent
+                row["next_drip_at"] = last_sent + timedelta(days=intervals[int(stage)])
+            rows.append(row)
+        with get_db_session() as db:
+            db.execute(Contact.__table__.insert(), rows)
+    print(f"Seeded {max(contacts - existing, 0)} contacts ({max(existing, contacts)} in total)")
+
+def python_filter(intervals: dict, wall_now: datetime) -> dict:
+    from sqlalchemy import or_
+    from tables import Contact, get_db_session
+
+    due = {}
+    with get_db_session() as db:
+        contacts = db.query(Contact).filter(
+            or_(Contact.status.is_(None), Contact.status != "do_not_contact"),
+            Contact.mail_sent_status.in_(["1", "2", "3"])
+        ).all()
+        for contact in contacts:
+            last_sent = getattr(contact, DATE_COLUMNS[contact.mail_sent_status])
+            if last_sent and (wall_now - last_sent).days >= intervals[int(contact.mail_sent_status)]:
+                due[contact.id] = contact.email
+    return due
+
+def sql_filter(manager, now: datetime) -> set:
+    from tables import Contact, get_db_session
+
+    with get_db_session() as db:
+        return {row[0] for row in manager.due_contacts(db, now, Contact.id).all()}
+
+def measure(label: str, call):
+    tracemalloc.start()
+    started = time.perf_counter()
+    due = call()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:14s} {elapsed:8.2f}s  peak {peak / 1_048_576:8.1f} MB  {len(due)} due")
+    return due
+
+def cleanup():
+    from tables import Contact, get_db_session
+
+    with get_db_session() as db:
+        db.query(Contact).filter(Contact.email.like(f"%@{BENCH_DOMAIN}")).delete(synchronize_session=False)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--contacts", type=int, default=1000000)
+    parser.add_argument("--cleanup", action="store_true")
+    args = parser.parse_args()
+
+    os.environ.setdefault("SHARD_COUNT", "1")
+    use_mock_environment()
+    quiet_logs()
+    from drip_logic import drip_manager, to_wall_clock
+    quiet_logs()
+
+    now = datetime.now(ZoneInfo("Asia/Kolkata"))
+    wall_now = to_wall_clock(now)
+    seed(args.contacts, drip_manager.drip_intervals, wall_now)
+
+    old = measure("python filter", lambda: python_filter(drip_manager.drip_intervals, wall_now))
+    new = measure("sql", lambda: sql_filter(drip_manager, now))
+    # Compare only the seeded contacts; other rows in the database may predate next_drip_at
+    missed = {contact_id for contact_id, email in old.items() if email.endswith(f"@{BENCH_DOMAIN}")} - new
+    if missed:
+        raise SystemExit(f"{len(missed)} seeded contacts are due by date but not by next_drip_at")
+
+    if args.cleanup:
+        cleanup()
+
+if __name__ == "__main__":
+    main()
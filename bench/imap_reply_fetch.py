@@ -0,0 +1,86 @@
+"""
+Bytes transferred and wall time of one reply check over a large inbox,
+served by the local IMAP stand-in:
+
+- "per-message" is the old loop: SEARCH, then FETCH (RFC822) for every
+  message, one round trip each, keeping those from a contact.
+- "two-phase" is MailService's header scan over batched UID sets
+  (_select_reply_candidates), then full bodies for the candidates only
+  (_fetch_full_messages).
+
+Both keep the same replies. The contact and message-id lookups that
+normally hit the database are answered from the inbox's seeded contacts,
+so this runs without MySQL.
+
+    python bench/imap_reply_fetch.py --messages 20000 --latency 0.005
+"""
+import time
+import email
+import imaplib
+import argparse
+from email.utils import parseaddr
+
+from common import use_mock_environment, quiet_logs
+from imap_standin import GeneratedInbox, ImapStandIn
+
+def per_message(port: int, contacts: set) -> set:
+    kept = set()
+    with imaplib.IMAP4("127.0.0.1", port) as mail:
+        mail.login("bench@example.com", "bench")
+        mail.select("INBOX")
+        _, messages = mail.search(None, '(SINCE "01-Jan-2000")')
+        for email_id in messages[0].split():
+            _, msg_data = mail.fetch(email_id, "(RFC822)")
+            email_message = email.message_from_bytes(msg_data[0][1])
+            if parseaddr(email_message["From"])[1].lower().strip() in contacts:
+                kept.add(email_message.get("Message-ID"))
+    return kept
+
+def two_phase(service, port: int) -> set:
+    with imaplib.IMAP4("127.0.0.1", port) as mail:
+        mail.login("bench@example.com", "bench")
+        mail.select("INBOX")
+        _, uidvalidity_data = mail.response("UIDVALIDITY")
+        uids = service._search_new_uids(mail, None, int(uidvalidity_data[0]))
+        candidates, _ = service._select_reply_candidates(mail, uids, None)
+        return {message.get("Message-ID") for message in service._fetch_full_messages(mail, candidates).values()}
+
+def measure(label: str, standin: ImapStandIn, run) -> set:
+    before = dict(standin.stats)
+    started = time.perf_counter()
+    kept = run()
+    elapsed = time.perf_counter() - started
+    sent = standin.stats["bytes_out"] - before.get("bytes_out", 0)
+    commands = standin.stats["commands"] - before.get("commands", 0)
+    print(f"{label:11s} {elapsed:8.2f}s  {sent / 1_048_576:9.1f} MB  {commands:6d} commands  {len(kept)} replies kept")
+    return kept
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--reply-ratio", type=float, default=0.02)
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds the stand-in waits before each reply")
+    args = parser.parse_args()
+
+    inbox = GeneratedInbox(args.messages, reply_ratio=args.reply_ratio)
+    standin = ImapStandIn(inbox, latency=args.latency)
+    port = standin.start()
+    use_mock_environment()
+    quiet_logs()
+    from mail_service import MailService
+    quiet_logs()
+
+    service = MailService()
+    contacts, sent_ids = inbox.contact_emails(), inbox.sent_message_ids()
+    service._find_contact_emails = lambda db, senders: senders & contacts
+    service._find_known_message_ids = lambda db, message_ids: message_ids & sent_ids
+
+    print(f"{args.messages} messages, {args.latency * 1000:.0f} ms per IMAP reply, "
+          f"IMAP_FETCH_BATCH_SIZE={service.imap_fetch_batch_size}")
+    old = measure("per-message", standin, lambda: per_message(port, contacts))
+    new = measure("two-phase", standin, lambda: two_phase(service, port))
+    if old != new:
+        raise SystemExit(f"The two paths kept different replies: {len(old ^ new)} differ")
+
+if __name__ == "__main__":
+    main()
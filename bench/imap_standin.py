@@ -0,0 +1,224 @@
+"""
+Local IMAP stand-in for benchmarks. It serves one read-only INBOX of
+generated messages and speaks enough IMAP4rev1 for imaplib: CAPABILITY,
+LOGIN, SELECT/EXAMINE, SEARCH, FETCH, UID SEARCH, UID FETCH (RFC822 and
+BODY.PEEK[HEADER.FIELDS (...)]), NOOP and LOGOUT. Sequence numbers equal
+UIDs. --latency delays every command's reply to stand in for the round trip
+to a real server. stats["bytes_out"] counts what was sent to clients.
+
+The inbox is mostly newsletters and internal mail, with --reply-ratio of
+messages being replies from contact{k}@prospect{k}.example to
+<sent-{k}@pulp.example>. Messages are generated from their UID on demand,
+so a large inbox costs no memory.
+
+    python bench/imap_standin.py --port 1143 --messages 20000
+"""
+import re
+import random
+import asyncio
+import argparse
+import threading
+from collections import Counter
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple
+
+FILLER = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore "
+    "et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi. "
+)
+
+class GeneratedInbox:
+    def __init__(self, messages: int, reply_ratio: float = 0.02, contacts: int = 1000, seed: int = 7):
+        self.size = messages
+        self.reply_ratio = reply_ratio
+        self.contacts = contacts
+        self.seed = seed
+        self.received_at = datetime.now(timezone.utc) - timedelta(hours=6)
+
+    def contact_emails(self) -> set:
+        return {f"contact{k}@prospect{k}.example" for k in range(self.contacts)}
+
+    def sent_message_ids(self) -> set:
+        return {f"<sent-{k}@pulp.example>" for k in range(self.contacts)}
+
+    def message(self, uid: int) -> Tuple[bytes, bytes]:
+        """Returns the header block (ending in a blank line) and the body of a message."""
+        rng = random.Random(self.seed * 1_000_003 + uid)
+        roll = rng.random()
+        date = format_datetime(self.received_at + timedelta(seconds=uid))
+        if roll < self.reply_ratio:
+            k = rng.randrange(self.contacts)
+            headers = [
+                f"From: Contact {k} <contact{k}@prospect{k}.example>",
+                f"Subject: Re: Quick idea for Prospect {k}",
+                f"In-Reply-To: <sent-{k}@pulp.example>",
+                f"References: <sent-{k}@pulp.example>",
+                "Content-Type: text/plain; charset=utf-8",
+            ]
+            body = "Thanks for reaching out. Could you share pricing and a case study?\r\n\r\n" + FILLER * rng.randint(2, 8)
+        elif roll < 0.62:
+            sender = rng.randrange(200)
+            headers = [
+                f"From: Newsletter {sender} <news@publisher{sender}.example>",
+                f"Subject: Weekly digest #{uid}",
+                "Precedence: bulk",
+                f"List-Unsubscribe: <mailto:unsubscribe@publisher{sender}.example>",
+                "Content-Type: text/html; charset=utf-8",
+            ]
+            body = "<html><body>" + f"<p>{FILLER}</p>" * rng.randint(60, 220) + "</body></html>"
+        else:
+            colleague = rng.randrange(50)
+            headers = [
+                f"From: Colleague {colleague} <colleague{colleague}@pulp.example>",
+                f"Subject: Internal update {uid}",
+                "Content-Type: text/plain; charset=utf-8",
+            ]
+            body = FILLER * rng.randint(15, 80)
+        headers = headers + [
+            "To: bench@example.com",
+            f"Date: {date}",
+            f"Message-ID: <inbox-{uid}@standin.example>",
+            "MIME-Version: 1.0",
+        ]
+        return ("\r\n".join(headers) + "\r\n\r\n").encode(), body.encode()
+
+def parse_sequence_set(text: str, largest: int) -> List[int]:
+    numbers = []
+    for part in text.split(","):
+        if ":" in part:
+            start, end = (largest if value == "*" else int(value) for value in part.split(":"))
+            numbers.extend(range(min(start, end), min(max(start, end), largest) + 1))
+        else:
+            value = largest if part == "*" else int(part)
+            if value <= largest:
+                numbers.append(value)
+    return numbers
+
+def select_header_fields(header_block: bytes, fields: List[str]) -> bytes:
+    wanted = {field.upper() for field in fields}
+    kept = [line for line in header_block.split(b"\r\n") if line and line.split(b":", 1)[0].decode().upper() in wanted]
+    return b"\r\n".join(kept) + b"\r\n\r\n"
+
+class ImapStandIn:
+    def __init__(self, inbox: GeneratedInbox, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.inbox = inbox
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def start(self) -> int:
+        """Serves on a daemon thread and returns the bound port."""
+        ready = threading.Event()
+
+        def serve():
+            loop = asyncio.new_event_loop()
+            server = loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+            self.port = server.sockets[0].getsockname()[1]
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=serve, daemon=True).start()
+        ready.wait()
+        return self.port
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self.stats[key] += amount
+
+    async def _send(self, writer: asyncio.StreamWriter, chunks: List[bytes]):
+        payload = b"".join(chunks)
+        self._count("bytes_out", len(payload))
+        writer.write(payload)
+        await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._count("connections")
+        await self._send(writer, [b"* OK imap-standin ready\r\n"])
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                tag, _, rest = line.decode(errors="replace").strip().partition(" ")
+                command, _, args = rest.partition(" ")
+                command = command.upper()
+                uid_mode = command == "UID"
+                if uid_mode:
+                    command, _, args = args.partition(" ")
+                    command = command.upper()
+                self._count("commands")
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                if command == "CAPABILITY":
+                    out = [b"* CAPABILITY IMAP4rev1 IDLE UIDPLUS\r\n"]
+                elif command in ("LOGIN", "NOOP"):
+                    out = []
+                elif command in ("SELECT", "EXAMINE"):
+                    out = [f"* {self.inbox.size} EXISTS\r\n* 0 RECENT\r\n".encode(),
+                           b"* OK [UIDVALIDITY 1] UIDs valid\r\n",
+                           f"* OK [UIDNEXT {self.inbox.size + 1}] Predicted next UID\r\n".encode()]
+                elif command == "SEARCH":
+                    out = [self._search(args)]
+                elif command == "FETCH":
+                    out = self._fetch(args, uid_mode)
+                elif command == "LOGOUT":
+                    await self._send(writer, [b"* BYE logging out\r\n", f"{tag} OK LOGOUT completed\r\n".encode()])
+                    break
+                else:
+                    await self._send(writer, [f"{tag} BAD unsupported command\r\n".encode()])
+                    continue
+                await self._send(writer, out + [f"{tag} OK {command} completed\r\n".encode()])
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _search(self, args: str) -> bytes:
+        match = re.search(r"UID (\S+)", args)
+        if match:
+            numbers = parse_sequence_set(match.group(1), self.inbox.size)
+            if match.group(1).endswith(":*") and not numbers:
+                # "n:*" always matches the newest message
+                numbers = [self.inbox.size]
+        else:
+            numbers = range(1, self.inbox.size + 1)
+        return ("* SEARCH " + " ".join(str(number) for number in numbers) + "\r\n").encode()
+
+    def _fetch(self, args: str, uid_mode: bool) -> List[bytes]:
+        sequence_set, _, items = args.partition(" ")
+        header_fields = re.search(r"HEADER\.FIELDS \(([^)]*)\)", items, re.IGNORECASE)
+        out = []
+        for number in parse_sequence_set(sequence_set, self.inbox.size):
+            header_block, body = self.inbox.message(number)
+            if header_fields:
+                fields = header_fields.group(1).split()
+                literal = select_header_fields(header_block, fields)
+                name = f"BODY[HEADER.FIELDS ({' '.join(fields)})]"
+            else:
+                literal = header_block + body
+                name = "RFC822"
+            prefix = f"UID {number} " if uid_mode or "UID" in items.upper() else ""
+            out.append(f"* {number} FETCH ({prefix}{name} {{{len(literal)}}}\r\n".encode())
+            out.append(literal)
+            out.append(b")\r\n")
+        return out
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=1143)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    standin = ImapStandIn(GeneratedInbox(args.messages), port=args.port, latency=args.latency)
+    print(f"IMAP stand-in with {args.messages} messages listening on 127.0.0.1:{standin.start()}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print(dict(standin.stats))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Peak RSS of the scheduled initial-email run (send_engine.run_initial_emails)
+over a seeded backlog of new contacts. Generation goes to the mock LLM server
+and sends go to the local SMTP sink.
+
+"single" sets CONTACT_CHUNK_SIZE above the backlog, which reproduces the old
+one-list run. "chunked" uses --chunk-size. Each mode runs in its own process
+so the peak RSS figures are independent.
+
+Needs DB_* pointing at a scratch MySQL database: it inserts contacts whose
+emails end in @bench.example and resets them between runs.
+
+    python bench/initial_run_memory.py --contacts 50000 --chunk-size 500
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+from common import use_mock_environment, start_mock_llm, quiet_logs
+
+BENCH_DOMAIN = "bench.example"
+
+def seed(contacts: int):
+    from sqlalchemy import func
+    from tables import Contact, get_db_session
+
+    with get_db_session() as db:
+        existing = db.query(func.count(Contact.id)).filter(Contact.email.like(f"%@{BENCH_DOMAIN}")).scalar()
+    rows = [
+        {"name": f"Bench Contact {i}", "email": f"contact{i}@{BENCH_DOMAIN}", "company_name": f"Bench Co {i % 500}",
+         "company_url": f"https://co{i % 500}.{BENCH_DOMAIN}", "industry": ["Retail", "SaaS", "Logistics", "Healthcare"][i % 4]}
+        for i in range(existing, contacts)
+    ]
+    for start in range(0, len(rows), 10000):
+        with get_db_session() as db:
+            db.execute(Contact.__table__.insert(), rows[start:start + 10000])
+    print(f"Seeded {len(rows)} contacts ({max(existing, contacts)} in total)")
+
+def reset():
+    """Makes every bench contact new again and forgets what the last run sent."""
+    from tables import Contact, ContentInfo, SendLogEntry, get_db_session
+
+    with get_db_session() as db:
+        db.query(ContentInfo).filter(ContentInfo.client_email.like(f"%@{BENCH_DOMAIN}")).delete(synchronize_session=False)
+        db.query(SendLogEntry).filter(SendLogEntry.account == os.environ["EMAIL_ADDRESS"]).delete(synchronize_session=False)
+        db.query(Contact).filter(Contact.email.like(f"%@{BENCH_DOMAIN}")).update({
+            Contact.mail_sent_status: None, Contact.first_mail_date: None, Contact.next_drip_at: None,
+            Contact.lease_owner: None, Contact.lease_expires_at: None
+        }, synchronize_session=False)
+
+def run_once(mode: str, contacts: int, chunk_size: int):
+    from smtp_sink import SmtpSink
+
+    os.environ["CONTACT_CHUNK_SIZE"] = str(contacts + 1 if mode == "single" else chunk_size)
+    os.environ.setdefault("MOCK_LLM_LATENCY", "fixed:0")
+    os.environ.setdefault("MOCK_LLM_RUN_LATENCY", "fixed:0")
+    os.environ["DAILY_SEND_LIMIT"] = str(contacts * 2)
+    sink = SmtpSink()
+    use_mock_environment(llm_port=start_mock_llm(), smtp_port=sink.start())
+    quiet_logs()
+    from drip_logic import peak_rss_mb
+    from send_engine import send_engine
+    quiet_logs()
+
+    reset()
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    summary = send_engine.run_initial_emails()
+    print(json.dumps({
+        "mode": mode,
+        "chunk_size": int(os.environ["CONTACT_CHUNK_SIZE"]),
+        "seconds": round(time.perf_counter() - started, 1),
+        "peak_rss_mb_before": baseline,
+        "peak_rss_mb": peak_rss_mb(),
+        "smtp_messages": sink.stats["messages"],
+        **summary
+    }))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--contacts", type=int, default=50000)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--mode", choices=("single", "chunked"))
+    args = parser.parse_args()
+
+    if args.mode:
+        run_once(args.mode, args.contacts, args.chunk_size)
+        return
+
+    use_mock_environment()
+    seed(args.contacts)
+    results = []
+    for mode in ("single", "chunked"):
+        output = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, "--contacts", str(args.contacts), "--chunk-size", str(args.chunk_size)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    for result in results:
+        growth = result["peak_rss_mb"] - result["peak_rss_mb_before"]
+        print(f"{result['mode']:8s} chunk {result['chunk_size']:>7d}  peak RSS {result['peak_rss_mb']:7.1f} MB "
+              f"(+{growth:.1f} during the run)  sent {result['sent']}/{result['total']} in {result['seconds']}s")
+
+if __name__ == "__main__":
+    main()
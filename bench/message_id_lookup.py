@@ -0,0 +1,120 @@
+"""
+Cost of recognising already-processed Message-IDs as history grows. "load
+all" is the old approach: every ContentInfo.message_id pulled into a Python
+set on each reply check. "window" is MailService._find_known_message_ids:
+one IN query for the Message-IDs seen in the current fetch batch, answered
+by the unique index on content.message_id.
+
+Rows are stored up to each --stored level in turn, and both approaches are
+timed at every level, so the growth is visible. Memory is what tracemalloc
+saw allocated during the lookup.
+
+Needs DB_* pointing at a scratch MySQL database: it adds one contact at
+@bench.example and content rows with <bench-N@pulp.example> Message-IDs.
+--cleanup deletes them afterwards.
+
+    python bench/message_id_lookup.py --stored 10000 100000 1000000 --window 500
+"""
+import time
+import random
+import argparse
+import tracemalloc
+import statistics
+
+from common import use_mock_environment, quiet_logs
+
+BENCH_EMAIL = "history@bench.example"
+
+def bench_contact_id() -> int:
+    from tables import Contact, get_db_session
+
+    with get_db_session() as db:
+        contact = db.query(Contact).filter(Contact.email == BENCH_EMAIL).first()
+        if not contact:
+            contact = Contact(name="Bench History", email=BENCH_EMAIL, company_name="Bench Co")
+            db.add(contact)
+            db.flush()
+        return contact.id
+
+def stored_count() -> int:
+    from sqlalchemy import func
+    from tables import ContentInfo, get_db_session
+
+    with get_db_session() as db:
+        return db.query(func.count(ContentInfo.id)).filter(ContentInfo.client_email == BENCH_EMAIL).scalar()
+
+def seed(contact_id: int, start: int, end: int):
+    from tables import ContentInfo, get_db_session
+
+    for offset in range(start, end, 10000):
+        with get_db_session() as db:
+            db.execute(ContentInfo.__table__.insert(), [
+                {"contact_id": contact_id, "client_email": BENCH_EMAIL, "email_type": "drip1",
+                 "subject": "Bench", "message_id": f"<bench-{i}@pulp.example>"}
+                for i in range(offset, min(offset + 10000, end))
+            ])
+
+def load_all() -> int:
+    from tables import ContentInfo, get_db_session
+
+    with get_db_session() as db:
+        processed_ids = {row[0] for row in db.query(ContentInfo.message_id).filter(ContentInfo.message_id.isnot(None)).all()}
+    return len(processed_ids)
+
+def window_lookup(service, stored: int, window: int) -> int:
+    from tables import get_db_session
+
+    # Half of a fetch window is already known, half is new mail
+    rng = random.Random(stored)
+    message_ids = {f"<bench-{rng.randrange(stored)}@pulp.example>" for _ in range(window // 2)}
+    message_ids |= {f"<new-{rng.random()}@elsewhere.example>" for _ in range(window - len(message_ids))}
+    with get_db_session() as db:
+        return len(service._find_known_message_ids(db, message_ids))
+
+def measure(call, repeats: int) -> tuple:
+    seconds, peaks = [], []
+    for _ in range(repeats):
+        tracemalloc.start()
+        started = time.perf_counter()
+        call()
+        seconds.append(time.perf_counter() - started)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return statistics.median(seconds), max(peaks) / 1_048_576
+
+def cleanup():
+    from tables import Contact, ContentInfo, get_db_session
+
+    with get_db_session() as db:
+        db.query(ContentInfo).filter(ContentInfo.client_email == BENCH_EMAIL).delete(synchronize_session=False)
+        db.query(Contact).filter(Contact.email == BENCH_EMAIL).delete(synchronize_session=False)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stored", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--window", type=int, default=500, help="Message-IDs seen in one fetch batch")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--cleanup", action="store_true")
+    args = parser.parse_args()
+
+    use_mock_environment()
+    quiet_logs()
+    from mail_service import MailService
+    quiet_logs()
+    service = MailService()
+
+    contact_id = bench_contact_id()
+    print(f"{'stored':>9s}  {'load all':>20s}  {'window of ' + str(args.window):>20s}")
+    for level in sorted(args.stored):
+        existing = stored_count()
+        if existing < level:
+            seed(contact_id, existing, level)
+        all_seconds, all_mb = measure(load_all, args.repeats)
+        window_seconds, window_mb = measure(lambda: window_lookup(service, level, args.window), args.repeats)
+        print(f"{level:9d}  {all_seconds * 1000:9.1f} ms {all_mb:6.1f} MB  {window_seconds * 1000:9.1f} ms {window_mb:6.1f} MB")
+
+    if args.cleanup:
+        cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Precision and throughput of the local reply pre-classifier against the
+labelled corpus in reply_corpus.jsonl. A row labelled "llm" must not be
+decided locally; any other label is the category the classifier should return.
+
+    python bench/reply_classifier_precision.py --rounds 2000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import email.message
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from reply_classifier import reply_pre_classifier
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reply_corpus.jsonl")
+
+def load_corpus(path: str) -> list:
+    rows = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            msg = email.message.Message()
+            msg["From"] = row["headers"].get("From", "prospect@example.com")
+            msg["Subject"] = row["subject"]
+            for name, value in row["headers"].items():
+                if name != "From":
+                    msg[name] = value
+            msg.set_payload(row["body"])
+            rows.append((msg, row["body"], row["label"]))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--rounds", type=int, default=1000)
+    args = parser.parse_args()
+
+    rows = load_corpus(args.corpus)
+    predicted, correct, mistakes = Counter(), Counter(), []
+    for msg, body, label in rows:
+        result = reply_pre_classifier.classify(msg, body)
+        category = result.category if result else "llm"
+        predicted[category] += 1
+        if category == label:
+            correct[category] += 1
+        else:
+            mistakes.append((label, category, body))
+
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        for msg, body, _ in rows:
+            reply_pre_classifier.classify(msg, body)
+    elapsed = time.perf_counter() - started
+    calls = args.rounds * len(rows)
+
+    print(f"{len(rows)} labelled replies")
+    for category in sorted(predicted):
+        print(f"  {category:12s} predicted {predicted[category]:3d}  precision {correct[category] / predicted[category]:.2%}")
+    local = sum(count for category, count in predicted.items() if category != "llm")
+    print(f"  decided locally: {local}/{len(rows)}")
+    print(f"throughput: {calls / elapsed:,.0f} replies/s ({elapsed / calls * 1e6:.1f} us per reply)")
+    for label, category, body in mistakes:
+        print(f"  MISS expected {label}, got {category}: {body!r}")
+    sys.exit(1 if any(category != "llm" for _, category, _ in mistakes) else 0)
+
+if __name__ == "__main__":
+    main()
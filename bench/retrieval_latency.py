@@ -0,0 +1,119 @@
+"""
+Side-by-side latency of generating a contact's email through the Assistants
+path (thread, message, run with file_search, poll, read the reply) and through
+local BM25 retrieval plus one chat completion. Both talk to the mock LLM
+server, so the numbers reflect round trips and polling rather than model time.
+
+It also counts how many different passage sets local retrieval picks across
+the contacts, searching with the shared prompt versus the contact's own query.
+
+Without --doc and with no KNOWLEDGE_DOC_PATH on disk, it writes a small
+synthetic .docx. The Assistants path tracks threads in the database, so DB_*
+must point at a scratch MySQL database.
+
+    python bench/retrieval_latency.py --contacts 20
+"""
+import os
+import time
+import zipfile
+import argparse
+import tempfile
+import statistics
+from xml.sax.saxutils import escape
+
+from common import use_mock_environment, start_mock_llm, quiet_logs
+
+INDUSTRIES = ["Retail", "SaaS", "Logistics", "Healthcare", "Fintech", "Hospitality", "Manufacturing", "Education"]
+PROMPT = """
+Write the prompt for initial mail in your own way.
+Final Output Format:
+
+Provide your final, complete email in the following exact format:
+Your Actual Subject Line|||Your Full Email Body Here, Including the Signature
+"""
+
+def write_synthetic_docx(path: str):
+    paragraphs = []
+    for industry in INDUSTRIES:
+        paragraphs.append(f"{industry} practice")
+        paragraphs.append(
+            f"For {industry.lower()} clients we run growth strategy, performance marketing and brand programmes. "
+            f"Recent {industry.lower()} work cut acquisition cost and lifted repeat purchase through lifecycle email and search."
+        )
+        paragraphs.append(f"Case study: a {industry.lower()} company grew qualified pipeline after a 90-day engagement with our team.")
+    paragraphs.append("Writing guidelines: keep outreach short, specific to the prospect, and close with a soft call to action.")
+    body = "".join(f"<w:p><w:r><w:t>{escape(text)}</w:t></w:r></w:p>" for text in paragraphs)
+    document = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{body}</w:body></w:document>"
+    )
+    with zipfile.ZipFile(path, "w") as docx:
+        docx.writestr("word/document.xml", document)
+
+def timed(call) -> float:
+    started = time.perf_counter()
+    call()
+    return time.perf_counter() - started
+
+def report(label: str, seconds: list):
+    ordered = sorted(seconds)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{label:10s} mean {statistics.mean(seconds):6.2f}s  p50 {statistics.median(seconds):6.2f}s  p95 {p95:6.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--contacts", type=int, default=20)
+    parser.add_argument("--doc", default=None)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="retrieval-bench-")
+    doc = args.doc or os.getenv("KNOWLEDGE_DOC_PATH", "pulp_strategy.docx")
+    if not os.path.exists(doc):
+        doc = os.path.join(workdir, "knowledge.docx")
+        write_synthetic_docx(doc)
+    os.environ["KNOWLEDGE_DOC_PATH"] = doc
+    os.environ["KNOWLEDGE_INDEX_PATH"] = os.path.join(workdir, "knowledge_index.json")
+    os.environ.setdefault("EMAIL_TEMPLATE_MODE", "false")
+    use_mock_environment(llm_port=start_mock_llm())
+    quiet_logs()
+    from tables import Contact
+    from mail_service import MailService
+    quiet_logs()
+
+    os.environ["KNOWLEDGE_RETRIEVAL_MODE"] = "assistant"
+    assistant_service = MailService()
+    os.environ["KNOWLEDGE_RETRIEVAL_MODE"] = "local"
+    local_service = MailService()
+    local_service.knowledge_index.ensure_loaded()
+
+    # Ids far above real rows, so no history or stored thread is found for them
+    contacts = [
+        Contact(id=2_000_000_000 + i, name=f"Bench Contact {i}", email=f"contact{i}@bench.example",
+                company_name=f"Bench Co {i}", industry=INDUSTRIES[i % len(INDUSTRIES)])
+        for i in range(args.contacts)
+    ]
+
+    assistant_seconds, local_seconds = [], []
+    for contact in contacts:
+        assistant_seconds.append(timed(lambda: assistant_service._get_assistant_response(
+            PROMPT, assistant_service.get_or_create_thread_for_contact(contact), call_site="bench",
+            contact=contact, context="initial outreach email"
+        )))
+        local_seconds.append(timed(lambda: local_service._get_assistant_response(
+            PROMPT, None, call_site="bench", contact=contact, context="initial outreach email"
+        )))
+
+    print(f"{args.contacts} initial emails against the mock LLM server")
+    report("assistant", assistant_seconds)
+    report("local", local_seconds)
+    print(f"speedup    {statistics.mean(assistant_seconds) / statistics.mean(local_seconds):6.1f}x on the mean")
+
+    index, top_k = local_service.knowledge_index, local_service.retrieval_top_k
+    by_prompt = {tuple(index.search(PROMPT, top_k=top_k)) for _ in contacts}
+    by_contact = {tuple(index.search(local_service._retrieval_query(PROMPT, contact, "initial outreach email"), top_k=top_k))
+                  for contact in contacts}
+    print(f"distinct top-{top_k} passage sets: {len(by_prompt)} searching the prompt, {len(by_contact)} searching per contact")
+
+if __name__ == "__main__":
+    main()
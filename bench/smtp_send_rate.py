@@ -0,0 +1,74 @@
+"""
+Messages per second through a fresh STARTTLS+LOGIN connection per message
+(the old send_email) against the pooled sessions of SMTPConnectionPool,
+both sending to the local SMTP sink.
+
+    python bench/smtp_send_rate.py --messages 300 --latency 0.01 --threads 3
+"""
+import time
+import smtplib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+
+from common import use_mock_environment, quiet_logs
+from smtp_sink import SmtpSink
+
+def build_message(index: int) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = "bench@example.com"
+    msg["To"] = f"contact{index}@example.com"
+    msg["Subject"] = f"Benchmark message {index}"
+    msg.set_content("Hi there,\n\nThis is a benchmark message.\n")
+    return msg
+
+def send_unpooled(port: int, index: int):
+    server = smtplib.SMTP("127.0.0.1", port, timeout=30)
+    server.starttls()
+    server.login("bench@example.com", "bench")
+    server.send_message(build_message(index))
+    server.quit()
+
+def run(label: str, send, messages: int, threads: int, sink: SmtpSink) -> float:
+    before = dict(sink.stats)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(send, range(messages)))
+    elapsed = time.perf_counter() - started
+    handshakes = sink.stats["tls_handshakes"] - before.get("tls_handshakes", 0)
+    print(f"{label:9s} {messages / elapsed:8.1f} msg/s  ({elapsed:.2f}s, {handshakes} STARTTLS+LOGIN handshakes)")
+    return messages / elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--threads", type=int, default=3, help="concurrent senders, like SEND_ENGINE_SMTP_CONCURRENCY")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds the sink waits before each reply")
+    args = parser.parse_args()
+
+    sink = SmtpSink(latency=args.latency)
+    port = sink.start()
+    use_mock_environment(smtp_port=port)
+    quiet_logs()
+    from mail_service import SMTPConnectionPool
+    quiet_logs()
+
+    pool = SMTPConnectionPool("127.0.0.1", port, "bench@example.com", "bench", max_size=args.threads)
+
+    def send_pooled(index: int):
+        server = pool.acquire()
+        try:
+            server.send_message(build_message(index))
+        except Exception:
+            pool.discard(server)
+            raise
+        pool.release(server)
+
+    print(f"{args.messages} messages, {args.threads} threads, {args.latency * 1000:.0f} ms per SMTP reply")
+    before = run("unpooled", lambda index: send_unpooled(port, index), args.messages, args.threads, sink)
+    after = run("pooled", send_pooled, args.messages, args.threads, sink)
+    pool.close_all()
+    print(f"speedup   {after / before:8.1f}x")
+
+if __name__ == "__main__":
+    main()
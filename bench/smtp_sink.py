@@ -0,0 +1,136 @@
+"""
+Local SMTP stand-in for benchmarks. It speaks enough SMTP for smtplib:
+EHLO, STARTTLS with a throwaway self-signed certificate, AUTH PLAIN/LOGIN,
+MAIL, RCPT, DATA, NOOP, RSET and QUIT. It accepts and counts every message.
+--latency adds a delay before each reply to stand in for the network round
+trip to a real provider.
+
+    python bench/smtp_sink.py --port 2525 --latency 0.02
+"""
+import ssl
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+from typing import Optional
+
+def _self_signed_context(directory: str) -> ssl.SSLContext:
+    key, cert = f"{directory}/sink.key", f"{directory}/sink.crt"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", cert,
+         "-days", "1", "-subj", "/CN=localhost"],
+        check=True, capture_output=True
+    )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+class SmtpSink:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, quota: Optional[int] = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        # After this many accepted messages, DATA is refused the way Gmail refuses an account over its daily limit
+        self.quota = quota
+        self.stats = Counter()
+        self.recipients = []
+        self._tmp = tempfile.TemporaryDirectory()
+        self._tls = _self_signed_context(self._tmp.name)
+        self._lock = threading.Lock()
+
+    def start(self) -> int:
+        """Serves on a daemon thread and returns the bound port."""
+        ready = threading.Event()
+
+        def serve():
+            loop = asyncio.new_event_loop()
+            server = loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+            self.port = server.sockets[0].getsockname()[1]
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=serve, daemon=True).start()
+        ready.wait()
+        return self.port
+
+    async def _reply(self, writer: asyncio.StreamWriter, line: str):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        writer.write(line.encode() + b"\r\n")
+        await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._count("connections")
+        tls = False
+        await self._reply(writer, "220 smtp-sink ready")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode(errors="replace").strip()
+                verb = command.split(" ", 1)[0].upper()
+                if verb in ("EHLO", "HELO"):
+                    extensions = ["250-smtp-sink", "250-AUTH PLAIN LOGIN", "250-SIZE 35882577"]
+                    if not tls:
+                        extensions.append("250-STARTTLS")
+                    await self._reply(writer, "\r\n".join(extensions + ["250 8BITMIME"]))
+                elif verb == "STARTTLS":
+                    await self._reply(writer, "220 ready to start TLS")
+                    await writer.start_tls(self._tls)
+                    tls = True
+                    self._count("tls_handshakes")
+                elif verb == "AUTH":
+                    if command.upper().startswith("AUTH LOGIN"):
+                        await self._reply(writer, "334 VXNlcm5hbWU6")
+                        await reader.readline()
+                        await self._reply(writer, "334 UGFzc3dvcmQ6")
+                        await reader.readline()
+                    self._count("logins")
+                    await self._reply(writer, "235 authenticated")
+                elif verb == "RCPT":
+                    with self._lock:
+                        self.recipients.append(command.split(":", 1)[-1].strip().strip("<>"))
+                    await self._reply(writer, "250 ok")
+                elif verb == "DATA":
+                    if self.quota is not None and self.stats["messages"] >= self.quota:
+                        await self._reply(writer, "550 5.4.5 Daily user sending limit exceeded")
+                        continue
+                    await self._reply(writer, "354 end data with <CR><LF>.<CR><LF>")
+                    while (await reader.readline()) not in (b".\r\n", b".\n", b""):
+                        pass
+                    self._count("messages")
+                    await self._reply(writer, "250 queued")
+                elif verb == "QUIT":
+                    await self._reply(writer, "221 bye")
+                    break
+                elif verb in ("MAIL", "NOOP", "RSET"):
+                    await self._reply(writer, "250 ok")
+                else:
+                    await self._reply(writer, "502 not implemented")
+        except (ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--quota", type=int, default=None)
+    args = parser.parse_args()
+    sink = SmtpSink(port=args.port, latency=args.latency, quota=args.quota)
+    print(f"SMTP sink listening on 127.0.0.1:{sink.start()}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print(dict(sink.stats))
+
+if __name__ == "__main__":
+    main()
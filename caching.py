@@ -0,0 +1,245 @@
+import os
+import re
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Optional, Tuple
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+from tables import IndustryCacheEntry, SentimentCacheEntry, get_db_session
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class LRUCache:
+    """Small thread-safe LRU map with hit/miss counters."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def discard(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+def normalize_company_key(company_url: Optional[str], company_name: Optional[str]) -> Optional[str]:
+    """Prefers the bare company domain; falls back to a normalised company name."""
+    if company_url:
+        url = company_url.strip().lower()
+        if "://" not in url:
+            url = f"http://{url}"
+        host = (urlparse(url).hostname or "").strip(".")
+        if host.startswith("www."):
+            host = host[4:]
+        if host:
+            return f"domain:{host}"
+    if company_name:
+        name = re.sub(r"[^a-z0-9]+", " ", company_name.lower()).strip()
+        if name:
+            return f"name:{name}"
+    return None
+
+class IndustryCache:
+    """
+    Industry classification cache keyed on company domain or name.
+    An in-process LRU sits in front of the industry_cache table, and entries
+    older than the TTL are treated as misses so they get reclassified.
+    """
+
+    def __init__(self):
+        self.ttl = timedelta(days=int(os.getenv("INDUSTRY_CACHE_TTL_DAYS", "90")))
+        self.memory = LRUCache(int(os.getenv("INDUSTRY_CACHE_SIZE", "10000")))
+        self._lock = threading.Lock()
+        self.db_hits = 0
+        self.misses = 0
+
+    def _is_fresh(self, classified_at: Optional[datetime]) -> bool:
+        return classified_at is not None and datetime.utcnow() - classified_at < self.ttl
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        found = {}
+        remaining = set()
+        for key in set(keys):
+            cached = self.memory.get(key)
+            if cached and self._is_fresh(cached[1]):
+                found[key] = cached[0]
+            else:
+                remaining.add(key)
+
+        if remaining:
+            try:
+                with get_db_session() as db:
+                    rows = db.query(IndustryCacheEntry).filter(IndustryCacheEntry.cache_key.in_(remaining)).all()
+                    for row in rows:
+                        if not self._is_fresh(row.classified_at):
+                            continue
+                        row.hit_count = (row.hit_count or 0) + 1
+                        self.memory.put(row.cache_key, (row.industry, row.classified_at))
+                        found[row.cache_key] = row.industry
+            except Exception as e:
+                logger.error(f"Industry cache lookup failed: {e}")
+
+        with self._lock:
+            self.db_hits += len([key for key in remaining if key in found])
+            self.misses += len([key for key in remaining if key not in found])
+        return found
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        if not key:
+            return None
+        return self.get_many([key]).get(key)
+
+    def put_many(self, industries: Dict[str, str]):
+        if not industries:
+            return
+        now = datetime.utcnow()
+        try:
+            with get_db_session() as db:
+                rows = db.query(IndustryCacheEntry).filter(IndustryCacheEntry.cache_key.in_(industries.keys())).all()
+                existing = {row.cache_key: row for row in rows}
+                for key, industry in industries.items():
+                    row = existing.get(key)
+                    if row:
+                        row.industry = industry
+                        row.classified_at = now
+                    else:
+                        db.add(IndustryCacheEntry(cache_key=key, industry=industry, classified_at=now))
+        except Exception as e:
+            logger.error(f"Industry cache write failed: {e}")
+        for key, industry in industries.items():
+            self.memory.put(key, (industry, now))
+
+    def put(self, key: Optional[str], industry: str):
+        if key and industry:
+            self.put_many({key: industry})
+
+    def stats(self) -> dict:
+        lookups = self.memory.hits + self.db_hits + self.misses
+        return {
+            "lookups": lookups,
+            "memory_hits": self.memory.hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory.hits + self.db_hits) / lookups, 4) if lookups else 0,
+            "memory_entries": len(self.memory)
+        }
+
+industry_cache = IndustryCache()
+
+# Bump when the normalisation changes, so rows cached under the old keys are not matched
+REPLY_HASH_VERSION = "v2"
+
+def reply_body_hash(body: str) -> str:
+    """
+    Hash of the reply with case, punctuation and whitespace differences removed.
+    Question marks are kept, since they decide hasQuery.
+    """
+    spaced = re.sub(r"\?", " ? ", (body or "").lower())
+    normalized = " ".join(re.sub(r"[^\w\s?]", " ", spaced).split())
+    return hashlib.sha256(f"{REPLY_HASH_VERSION}:{normalized}".encode("utf-8")).hexdigest()
+
+class SentimentCache:
+    """
+    Reply sentiment analysis cache keyed on a normalised hash of the cleaned
+    reply body, with an in-process LRU in front of the sentiment_cache table.
+    """
+
+    def __init__(self):
+        self.memory = LRUCache(int(os.getenv("SENTIMENT_CACHE_SIZE", "5000")))
+        self._lock = threading.Lock()
+        self.db_hits = 0
+        self.misses = 0
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+
+    def get(self, body_hash: str) -> Optional[Tuple[str, dict]]:
+        cached = self.memory.get(body_hash)
+        if cached:
+            return cached
+
+        result = None
+        try:
+            with get_db_session() as db:
+                row = db.query(SentimentCacheEntry).filter(SentimentCacheEntry.body_hash == body_hash).first()
+                if row:
+                    row.hit_count = (row.hit_count or 0) + 1
+                    result = (row.sentiment, {
+                        'has_query': bool(row.has_query),
+                        'queries': row.queries,
+                        'stop_contact': bool(row.stop_contact)
+                    })
+        except Exception as e:
+            logger.error(f"Sentiment cache lookup failed: {e}")
+
+        with self._lock:
+            if result:
+                self.db_hits += 1
+            else:
+                self.misses += 1
+        if result:
+            self.memory.put(body_hash, result)
+        return result
+
+    def put(self, body_hash: str, sentiment: str, analysis: dict):
+        self.memory.put(body_hash, (sentiment, analysis))
+        try:
+            with get_db_session() as db:
+                exists = db.query(SentimentCacheEntry.id).filter(SentimentCacheEntry.body_hash == body_hash).first()
+                if not exists:
+                    db.add(SentimentCacheEntry(
+                        body_hash=body_hash,
+                        sentiment=sentiment,
+                        has_query=bool(analysis.get('has_query')),
+                        queries=analysis.get('queries'),
+                        stop_contact=bool(analysis.get('stop_contact'))
+                    ))
+        except Exception as e:
+            logger.error(f"Sentiment cache write failed: {e}")
+
+    def record_llm_call(self, seconds: float):
+        with self._lock:
+            self.llm_calls += 1
+            self.llm_seconds += seconds
+
+    def stats(self) -> dict:
+        hits = self.memory.hits + self.db_hits
+        lookups = hits + self.misses
+        avg_llm_seconds = self.llm_seconds / self.llm_calls if self.llm_calls else 0
+        return {
+            "lookups": lookups,
+            "memory_hits": self.memory.hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0,
+            "avg_llm_seconds": round(avg_llm_seconds, 3),
+            "estimated_seconds_saved": round(hits * avg_llm_seconds, 1),
+            "memory_entries": len(self.memory)
+        }
+
+sentiment_cache = SentimentCache()
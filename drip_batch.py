@@ -0,0 +1,176 @@
+import io
+import os
+import json
+import logging
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from tables import Contact, DripDraft, get_db_session
+from drip_logic import drip_manager
+from llm_pool import get_openai_client
+from llm_metrics import llm_metrics, usage_counts
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+class OpenAIBatchBackend:
+    """Submits chat completion requests through the OpenAI Batch API."""
+
+    def __init__(self):
+        self.client = get_openai_client()
+
+    def submit(self, requests: List[dict]) -> str:
+        payload = "\n".join(json.dumps(request) for request in requests).encode("utf-8")
+        input_file = self.client.files.create(file=("drip_batch.jsonl", io.BytesIO(payload)), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h"
+        )
+        return batch.id
+
+    def poll(self, batch_id: str) -> Optional[Dict[str, Optional[str]]]:
+        """Returns custom_id -> message content once the batch has finished, or None while it is running."""
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status in ("validating", "in_progress", "finalizing"):
+            return None
+
+        results = {}
+        if batch.output_file_id:
+            output = self.client.files.content(batch.output_file_id).text
+            for line in output.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get("response") or {}
+                body = response.get("body") or {}
+                prompt_tokens, completion_tokens, cached_tokens = usage_counts(body.get("usage"))
+                # Batch jobs have no per-request wall time; they are recorded for tokens and cost only
+                llm_metrics.record(
+                    "drip_batch", body.get("model"),
+                    prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cached_tokens=cached_tokens,
+                    success=response.get("status_code") == 200
+                )
+                try:
+                    results[item["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+                except (KeyError, IndexError, TypeError):
+                    results[item["custom_id"]] = None
+        if batch.status != "completed":
+            logger.error(f"Drip batch {batch_id} ended with status {batch.status}")
+        return results
+
+class DripBatchPrecomputer:
+    """
+    Overnight stage for the drip campaign: finds contacts whose drip falls due
+    tomorrow, generates their emails as one asynchronous batch job and stores
+    the results in drip_drafts, so the morning run only renders and sends.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or OpenAIBatchBackend()
+        self.model = os.getenv("DRIP_BATCH_MODEL", "gpt-4o-mini")
+        self.retention_days = int(os.getenv("DRIP_DRAFT_RETENTION_DAYS", "7"))
+
+    @llm_metrics.job("drip_batch_precompute")
+    def submit_next_day_batch(self) -> Optional[str]:
+        tomorrow = datetime.now(ZoneInfo("Asia/Kolkata")) + timedelta(days=1)
+        requests = []
+        drafts = []
+        with get_db_session() as db:
+            self._prune_old_drafts(db)
+            contacts = drip_manager.due_contacts(db, tomorrow).all()
+            # One draft row per contact and drip; a failed one is reused so its drip is submitted again
+            existing = {(draft.contact_id, draft.drip_number): draft for draft in db.query(DripDraft).all()}
+
+            for contact in contacts:
+                try:
+                    drip_number = drip_manager.get_due_drip_number(contact, tomorrow)
+                except Exception as e:
+                    logger.error(f"Could not evaluate drip schedule for {contact.email}: {str(e)}")
+                    continue
+                if drip_number == 0:
+                    continue
+                draft = existing.get((contact.id, drip_number))
+                if draft and draft.status != "failed":
+                    continue
+                requests.append(self._build_request(contact, drip_number))
+                if draft:
+                    draft.status, draft.subject, draft.body, draft.scheduled_for = "pending", None, None, tomorrow.date()
+                else:
+                    draft = DripDraft(contact_id=contact.id, drip_number=drip_number, scheduled_for=tomorrow.date())
+                drafts.append(draft)
+
+            if not requests:
+                logger.info("No drips due tomorrow; nothing to precompute.")
+                return None
+
+            batch_id = self.backend.submit(requests)
+            for draft in drafts:
+                draft.batch_id = batch_id
+            db.add_all(drafts)
+
+        logger.info(f"Submitted drip batch {batch_id} with {len(requests)} requests.")
+        return batch_id
+
+    @llm_metrics.job("drip_batch_collect")
+    def collect_results(self) -> int:
+        ready = 0
+        with get_db_session() as db:
+            batch_ids = [
+                row[0] for row in db.query(DripDraft.batch_id).filter(
+                    DripDraft.status == "pending",
+                    DripDraft.batch_id.isnot(None)
+                ).distinct().all()
+            ]
+            for batch_id in batch_ids:
+                try:
+                    results = self.backend.poll(batch_id)
+                except Exception as e:
+                    logger.error(f"Could not poll drip batch {batch_id}: {e}")
+                    continue
+                if results is None:
+                    continue
+
+                drafts = db.query(DripDraft).filter(DripDraft.batch_id == batch_id, DripDraft.status == "pending").all()
+                for draft in drafts:
+                    content = results.get(f"drip-{draft.contact_id}-{draft.drip_number}")
+                    if content and '|||' in content:
+                        subject, body = (part.strip() for part in content.split('|||', 1))
+                        if subject and body:
+                            draft.subject, draft.body, draft.status = subject, body, "ready"
+                            ready += 1
+                            continue
+                    draft.status = "failed"
+                db.commit()
+        logger.info(f"Collected {ready} ready drip drafts.")
+        return ready
+
+    def _build_request(self, contact: Contact, drip_number: int) -> dict:
+        prompt = f"""
+Write follow-up drip email number {drip_number} for {contact.name} at {contact.company_name} ({contact.industry or 'industry unknown'}).
+It follows up on our earlier outreach and should be value-driven, short and non-pushy.
+
+Output Format: Provide your final, complete email output in this exact format, using "|||" as a separator. Do not include any other text before or after this structure. Do NOT include the word "Subject:" or any prefixes before the subject line.
+Your Actual Subject Line|||Your Full Email Body Here, Including the Signature
+"""
+        return {
+            "custom_id": f"drip-{contact.id}-{drip_number}",
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                "model": self.model,
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": 0.7
+            }
+        }
+
+    def _prune_old_drafts(self, db):
+        cutoff = (datetime.now(ZoneInfo("Asia/Kolkata")) - timedelta(days=self.retention_days)).date()
+        db.query(DripDraft).filter(DripDraft.scheduled_for < cutoff).delete(synchronize_session=False)
+
+drip_batch = DripBatchPrecomputer()
@@ -1,11 +1,18 @@
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-from tables import Contact, ContentInfo, SessionLocal
-from sqlalchemy import and_,or_
-from mail_service import send_drip_email, send_initial_email
+from sqlalchemy.orm import Session, object_session
+from tables import Contact, ContentInfo, DripDraft, SessionLocal
+from sqlalchemy import and_,or_, text
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import json
+from mail_service import mail_service, send_drip_email, send_initial_email
 from zoneinfo import ZoneInfo
-from openai import OpenAI
+from llm_pool import get_openai_client
+from caching import industry_cache, normalize_company_key
+from llm_metrics import llm_metrics
+from sharding import shard_assignment
 import os
+import sys
+import socket
 from datetime import timezone
 from dotenv import load_dotenv
 import logging
@@ -16,6 +23,67 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def to_wall_clock(moment: datetime) -> datetime:
+    """Naive Asia/Kolkata wall-clock time, the form DateTime columns are stored and compared in."""
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(ZoneInfo("Asia/Kolkata")).replace(tzinfo=None)
+
+INDUSTRY_CATEGORIES = [
+    "Technology & Software",
+    "Digital Marketing & Advertising",
+    "E-commerce & Online Retail",
+    "Healthcare & Medical",
+    "Financial Services",
+    "Education & EdTech",
+    "Manufacturing & Industrial",
+    "Real Estate & Property",
+    "Media & Entertainment",
+    "Business Services",
+    "Retail & Consumer Goods",
+    "Travel & Hospitality",
+    "Energy & Utilities",
+    "Telecommunications",
+    "Automotive & Transportation",
+    "Food & Beverage",
+    "Fashion & Apparel",
+    "Insurance",
+    "Legal Services",
+    "IT Services",
+    "Construction",
+    "Pharmaceuticals",
+    "Others",
+]
+
+INDUSTRY_PROMPT_LIST = "\n".join(
+    f"- {name} (ONLY if no other category fits)" if name == "Others" else f"- {name}"
+    for name in INDUSTRY_CATEGORIES
+)
+
+# Mailbox providers whose domain says nothing about the contact's company
+FREE_MAIL_DOMAINS = {
+    "gmail.com", "googlemail.com", "yahoo.com", "yahoo.co.in", "outlook.com", "hotmail.com", "live.com",
+    "icloud.com", "me.com", "aol.com", "proton.me", "protonmail.com", "rediffmail.com", "zoho.com",
+}
+
+def company_website(contact: Contact) -> Optional[str]:
+    """The company URL, or the contact's email domain when no URL was imported and it isn't a free mailbox."""
+    if contact.company_url:
+        return contact.company_url
+    domain = (contact.email or "").rpartition("@")[2].strip().lower()
+    if domain and domain not in FREE_MAIL_DOMAINS:
+        return domain
+    return None
+
 class DripCampaignManager:
     def __init__(self):
         self.drip_intervals = {
@@ -23,16 +91,130 @@ class DripCampaignManager:
             2: 14,
             3: 30  
         }
-        self.openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.openai_client = get_openai_client()
+        self.industry_batch_size = int(os.getenv("INDUSTRY_BATCH_SIZE", "25"))
+        self.chunk_size = int(os.getenv("CONTACT_CHUNK_SIZE", "500"))
+        self.worker_id = (os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}")[:64]
+        self.lease_seconds = int(os.getenv("DRIP_LEASE_SECONDS", "900"))
+        self.claim_batch_size = int(os.getenv("DRIP_CLAIM_BATCH_SIZE", "50"))
+        self.retry_delay = timedelta(minutes=int(os.getenv("DRIP_RETRY_MINUTES", "60")))
+
+    def claim_due_contacts(self, now: datetime, limit: Optional[int] = None) -> List[int]:
+        """
+        Leases up to limit due contacts to this worker and returns their ids.
+        Rows another worker is claiming are skipped (FOR UPDATE SKIP LOCKED),
+        and leases left behind by a crashed worker become claimable once they
+        expire. now only decides which drips are due; leases are stamped and
+        checked against the clock at claim time, since a paced run can outlast
+        DRIP_LEASE_SECONDS many times over.
+        """
+        wall_now = to_wall_clock(datetime.now(ZoneInfo("Asia/Kolkata")))
+        with get_db_session() as db:
+            rows = self.due_contacts(db, now, Contact.id, Contact.lease_owner).filter(
+                or_(Contact.lease_expires_at.is_(None), Contact.lease_expires_at < wall_now)
+            # Most overdue first, so when the send budget runs short it is the newest drips that wait a day
+            ).order_by(Contact.next_drip_at, Contact.id).limit(limit or self.claim_batch_size).with_for_update(skip_locked=True).all()
+            if not rows:
+                return []
+
+            contact_ids = [row.id for row in rows]
+            reclaimed = sum(1 for row in rows if row.lease_owner)
+            if reclaimed:
+                logger.warning(f"Reclaimed {reclaimed} contacts from expired drip leases.")
+            db.query(Contact).filter(Contact.id.in_(contact_ids)).update({
+                Contact.lease_owner: self.worker_id,
+                Contact.lease_expires_at: wall_now + timedelta(seconds=self.lease_seconds)
+            }, synchronize_session=False)
+        return contact_ids
+
+    def claim_initial(self, db: Session, contact_id: int) -> bool:
+        """
+        Leases a contact for its initial email, unless it has already been sent or
+        another node holds a live lease, e.g. while shards are being rebalanced.
+        """
+        wall_now = to_wall_clock(datetime.now(ZoneInfo("Asia/Kolkata")))
+        claimed = db.query(Contact).filter(
+            Contact.id == contact_id,
+            Contact.mail_sent_status.is_(None),
+            or_(Contact.lease_owner.is_(None), Contact.lease_owner == self.worker_id, Contact.lease_expires_at < wall_now)
+        ).update({
+            Contact.lease_owner: self.worker_id,
+            Contact.lease_expires_at: wall_now + timedelta(seconds=self.lease_seconds)
+        }, synchronize_session=False)
+        db.commit()
+        return bool(claimed)
+
+    def renew_lease(self, db: Session, contact_id: int) -> bool:
+        """Extends this worker's lease right before a send; False if another worker has since reclaimed the contact."""
+        renewed = db.query(Contact).filter(
+            Contact.id == contact_id,
+            Contact.lease_owner == self.worker_id
+        ).update({
+            Contact.lease_expires_at: to_wall_clock(datetime.now(ZoneInfo("Asia/Kolkata"))) + timedelta(seconds=self.lease_seconds)
+        }, synchronize_session=False)
+        db.commit()
+        return bool(renewed)
+
+    def release_lease(self, db: Session, contact_id: int, retry_drip: bool = False):
+        """
+        Gives up this worker's lease on a contact it did not send to, so it does not
+        sit out the lease. A failed drip is also pushed back by DRIP_RETRY_MINUTES,
+        which keeps the same run from reclaiming it straight away.
+        """
+        wall_now = to_wall_clock(datetime.now(ZoneInfo("Asia/Kolkata")))
+        values = {Contact.lease_owner: None, Contact.lease_expires_at: None}
+        if retry_drip:
+            values[Contact.next_drip_at] = wall_now + self.retry_delay
+        try:
+            db.query(Contact).filter(
+                Contact.id == contact_id,
+                Contact.lease_owner == self.worker_id
+            ).update(values, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            # The lease still expires on its own
+            logger.warning(f"Could not release lease on contact {contact_id}: {e}")
+            db.rollback()
+
+    def iter_contact_chunks(self, build_query: Callable[[Session], object]) -> Iterator[Tuple[Session, List[Contact]]]:
+        """
+        Keyset-paginates build_query(db) on Contact.id, CONTACT_CHUNK_SIZE rows
+        at a time. Each chunk gets its own session, committed and expunged once
+        the caller is done with it, so memory stays flat and a rollback only
+        touches the current chunk.
+        """
+        last_id, processed = 0, 0
+        while True:
+            with get_db_session() as db:
+                contacts = list(
+                    build_query(db).filter(Contact.id > last_id).order_by(Contact.id)
+                    .limit(self.chunk_size).yield_per(self.chunk_size)
+                )
+                if not contacts:
+                    return
+                last_id, fetched = contacts[-1].id, len(contacts)
+                yield db, contacts
+                db.commit()
+                db.expunge_all()
+                del contacts
+            processed += fetched
+            logger.info(f"Processed {processed} contacts so far (peak RSS {peak_rss_mb()} MB).")
+            if fetched < self.chunk_size:
+                return
     
     def generate_industry_for_contact(self, contact: Contact) -> str:
+        cache_key = normalize_company_key(company_website(contact), contact.company_name)
+        cached_industry = industry_cache.get(cache_key)
+        if cached_industry:
+            return cached_industry
+
         try:
             prompt = f"""
 You are an expert business analyst. Analyze this company's information and determine their primary industry category.
 
 Company Details:
 Company Name: {contact.company_name}
-Website: {contact.company_url}
+Website: {company_website(contact)}
 
 Instructions:
 1. Analyze the company name and website URL for industry indicators
@@ -40,29 +222,7 @@ Instructions:
 3. Return ONLY the industry name from this list:
 
 Primary Industries:
-- Technology & Software
-- Digital Marketing & Advertising
-- E-commerce & Online Retail
-- Healthcare & Medical
-- Financial Services
-- Education & EdTech
-- Manufacturing & Industrial
-- Real Estate & Property
-- Media & Entertainment
-- Business Services
-- Retail & Consumer Goods
-- Travel & Hospitality
-- Energy & Utilities
-- Telecommunications
-- Automotive & Transportation
-- Food & Beverage
-- Fashion & Apparel
-- Insurance
-- Legal Services
-- IT Services
-- Construction
-- Pharmaceuticals
-- Others (ONLY if no other category fits)
+{INDUSTRY_PROMPT_LIST}
 
 Respond with ONLY the industry name, no explanations or additional text.
 Example responses:
@@ -70,9 +230,12 @@ Example responses:
 "Technology & Software"
 "Financial Services"
 """
-            for temp in [0.1, 0.3, 0.5]:
+            for attempt, temp in enumerate([0.1, 0.3, 0.5]):
                 try:
-                    response = self.openai_client.chat.completions.create(
+                    response = llm_metrics.chat_completion(
+                        self.openai_client,
+                        "industry_single",
+                        retries=attempt,
                         model="gpt-4o-mini",
                         messages=[{"role": "user", "content": prompt}],
                         temperature=temp
@@ -80,6 +243,7 @@ Example responses:
                     
                     industry = response.choices[0].message.content.strip().replace('"', '')
                     if industry and 3 <= len(industry) <= 50:
+                        industry_cache.put(cache_key, industry)
                         return industry
                     
                 except Exception as inner_e:
@@ -93,80 +257,259 @@ Example responses:
             return None
     
 
-    def process_initial_emails(self):
+    def classify_industries(self, contacts: List[Contact]) -> Dict[int, str]:
+        """Classifies many companies per request; answers outside INDUSTRY_CATEGORIES are re-queued."""
+        results = {}
+        pending = list(contacts)
+        for attempt, temp in enumerate([0.1, 0.3, 0.5]):
+            if not pending:
+                break
+            failed = []
+            for i in range(0, len(pending), self.industry_batch_size):
+                batch = pending[i:i + self.industry_batch_size]
+                answers = self._classify_industry_batch(batch, temp, attempt)
+                for contact in batch:
+                    industry = answers.get(contact.id)
+                    if industry in INDUSTRY_CATEGORIES:
+                        results[contact.id] = industry
+                    else:
+                        failed.append(contact)
+            if failed:
+                logger.warning(f"{len(failed)} companies got no valid industry at temperature {temp}, re-queueing.")
+            pending = failed
+
+        for contact in pending:
+            logger.error(f"Failed to classify industry for {contact.email}")
+        return results
+
+    def _classify_industry_batch(self, contacts: List[Contact], temperature: float, attempt: int = 0) -> Dict[int, str]:
+        companies = [
+            {"id": c.id, "company_name": c.company_name, "website": company_website(c)}
+            for c in contacts
+        ]
+        prompt = f"""
+You are an expert business analyst. For each company below, analyze its name and website and determine its primary industry category.
+
+Companies:
+{json.dumps(companies, indent=2)}
+
+Instructions:
+1. Analyze each company name and website URL for industry indicators
+2. Select the MOST SPECIFIC category that applies
+3. Use ONLY an industry name from this list, spelled exactly as shown:
+
+Primary Industries:
+{INDUSTRY_PROMPT_LIST}
+
+Respond with a single JSON object and nothing else, with one entry per company id:
+{{"results": [{{"id": 1, "industry": "Technology & Software"}}]}}
+"""
+        try:
+            response = llm_metrics.chat_completion(
+                self.openai_client,
+                "industry_batch",
+                retries=attempt,
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=temperature,
+                response_format={"type": "json_object"}
+            )
+            parsed = json.loads(response.choices[0].message.content)
+            answers = {}
+            for item in parsed.get("results", []):
+                try:
+                    answers[int(item["id"])] = str(item.get("industry", "")).strip().replace('"', '')
+                except (KeyError, TypeError, ValueError):
+                    continue
+            return answers
+        except Exception as e:
+            logger.warning(f"Industry batch of {len(contacts)} failed at temperature {temperature}: {str(e)}")
+            return {}
+
+    def fill_missing_industries(self, contacts: List[Contact]) -> int:
+        # Contacts without a company URL are classified from their name and email domain
+        pending = [c for c in contacts if not c.industry and (c.company_name or company_website(c))]
+        if not pending:
+            return 0
+
+        keys = {c.id: normalize_company_key(company_website(c), c.company_name) for c in pending}
+        known = industry_cache.get_many(key for key in keys.values() if key)
+
+        # Only one contact per unknown company goes to the LLM; colleagues reuse its answer
+        representatives = {}
+        for contact in pending:
+            key = keys[contact.id] or f"contact:{contact.id}"
+            keys[contact.id] = key
+            if key not in known and key not in representatives:
+                representatives[key] = contact
+        if representatives:
+            classified = self.classify_industries(list(representatives.values()))
+            new_entries = {
+                key: classified[contact.id]
+                for key, contact in representatives.items() if contact.id in classified
+            }
+            industry_cache.put_many({key: industry for key, industry in new_entries.items() if not key.startswith("contact:")})
+            known.update(new_entries)
+
+        filled = 0
+        for contact in pending:
+            industry = known.get(keys[contact.id])
+            if industry:
+                contact.industry = industry
+                filled += 1
+        logger.info(f"Filled industry for {filled} of {len(pending)} contacts ({len(representatives)} LLM lookups).")
+        return filled
+
+    def due_contacts(self, db: Session, now: datetime, *columns):
+        """This shard's contacts whose next drip is due by now, selected in SQL through ix_first_next_drip_at_status."""
+        return shard_assignment.apply(db.query(*(columns or (Contact,))).filter(
+            Contact.next_drip_at <= to_wall_clock(now),
+            or_(Contact.status.is_(None), Contact.status != "do_not_contact")
+        ))
+
+    def new_contacts(self, db: Session):
+        """This shard's contacts that have not had an initial email yet."""
+        return shard_assignment.apply(db.query(Contact).filter(Contact.mail_sent_status.is_(None)))
+
+    def get_due_drip_number(self, contact: Contact, now: datetime) -> int:
+        if contact.next_drip_at is None or contact.next_drip_at > to_wall_clock(now):
+            return 0
+        return self.pending_drip_number(contact.mail_sent_status)
+
+    def pending_drip_number(self, mail_sent_status) -> int:
+        """The drip a contact with this mail_sent_status is waiting for, or 0 once the sequence is over."""
+        try:
+            stage = int(mail_sent_status)
+        except (TypeError, ValueError):
+            return 0
+        return stage if stage in self.drip_intervals else 0
+
+    def schedule_next_drip(self, contact: Contact):
+        stage = self.pending_drip_number(contact.mail_sent_status)
+        last_sent = {1: contact.first_mail_date, 2: contact.drip1_date, 3: contact.drip2_date}.get(stage)
+        contact.next_drip_at = to_wall_clock(last_sent) + timedelta(days=self.drip_intervals[stage]) if last_sent else None
+
+    def mark_initial_sent(self, contact: Contact, now: datetime):
+        contact.mail_sent_status = 1
+        contact.first_mail_date = now
+        self.schedule_next_drip(contact)
+        contact.lease_owner = None
+        contact.lease_expires_at = None
+
+    def mark_drip_sent(self, contact: Contact, drip_number: int, now: datetime):
+        if drip_number == 1:
+            contact.drip1_date = now
+            contact.mail_sent_status = 2
+        elif drip_number == 2:
+            contact.drip2_date = now
+            contact.mail_sent_status = 3
+        elif drip_number == 3:
+            contact.drip3_date = now
+            contact.mail_sent_status = 4
+        self.schedule_next_drip(contact)
+        contact.lease_owner = None
+        contact.lease_expires_at = None
+        # A precomputed draft is used up once its drip has gone out
+        db = object_session(contact)
+        if db:
+            db.query(DripDraft).filter(
+                DripDraft.contact_id == contact.id,
+                DripDraft.drip_number == drip_number,
+                DripDraft.status == "ready"
+            ).update({DripDraft.status: "sent"}, synchronize_session=False)
+
+    def backfill_next_drip_at(self):
+        """Derives next_drip_at for contacts that were mid-sequence before the column existed."""
         with get_db_session() as db:
-            contacts = db.query(Contact).filter(Contact.mail_sent_status.is_(None)).all()
-            logger.info(f"Found {len(contacts)} new contacts to process for initial emails.")
+            result = db.execute(text(
+                "UPDATE `first` SET next_drip_at = CASE mail_sent_status "
+                "WHEN '1' THEN first_mail_date + INTERVAL :days1 DAY "
+                "WHEN '2' THEN drip1_date + INTERVAL :days2 DAY "
+                "WHEN '3' THEN drip2_date + INTERVAL :days3 DAY END "
+                "WHERE next_drip_at IS NULL AND mail_sent_status IN ('1', '2', '3')"
+            ), {"days1": self.drip_intervals[1], "days2": self.drip_intervals[2], "days3": self.drip_intervals[3]})
+        logger.info(f"Backfilled next_drip_at for {result.rowcount} contacts")
+
+    @llm_metrics.job("initial_emails")
+    def process_initial_emails(self):
+        for db, contacts in self.iter_contact_chunks(self.new_contacts):
+            # Classify missing industries up front in batches; commit so a later rollback can't discard them
+            if self.fill_missing_industries(contacts):
+                db.commit()
 
             for contact in contacts:
+                sent = False
                 try:
-                    # Generate industry if it's missing
                     if not contact.industry:
-                        if not (contact.company_name and contact.company_url):
+                        if not (contact.company_name or company_website(contact)):
                             logger.warning(f"Skipping {contact.email}: Missing company details to generate industry.")
-                            continue
-                        
-                        industry = self.generate_industry_for_contact(contact)
-                        if industry:
-                            contact.industry = industry
-                            logger.info(f"Generated industry '{industry}' for {contact.email}")
                         else:
                             logger.error(f"Failed to generate industry for {contact.email}, skipping.")
-                            continue
-                    
+                        continue
+
+                    if mail_service.send_budget.remaining() <= 0:
+                        logger.warning("Daily send budget used up; remaining initial emails are deferred to the next run.")
+                        return
+                    if not self.claim_initial(db, contact.id):
+                        logger.info(f"Skipping {contact.email}: initial email already sent or claimed by another node.")
+                        continue
                     if send_initial_email(contact, db):
-                        contact.mail_sent_status = 1
-                        contact.first_mail_date = datetime.now(ZoneInfo("Asia/Kolkata"))
+                        sent = True
+                        self.mark_initial_sent(contact, datetime.now(ZoneInfo("Asia/Kolkata")))
                         db.commit()
                         logger.info(f"Successfully processed and sent initial email to {contact.email}")
                     else:
                         logger.error(f"send_initial_email function failed for {contact.email}, rolling back.")
                         db.rollback()
+                        self.release_lease(db, contact.id)
 
                 except Exception as e:
                     logger.error(f"A critical error occurred while processing contact {contact.email}: {str(e)}")
                     db.rollback()
+                    # Once the email is out, keep the lease so a failed commit does not get it sent twice
+                    if not sent:
+                        self.release_lease(db, contact.id)
 
+    @llm_metrics.job("drips")
     def process_drips(self):
-        with get_db_session() as db:
-            now = datetime.now(ZoneInfo("Asia/Kolkata"))
-            contacts = db.query(Contact).filter(
-                or_(Contact.status.is_(None), Contact.status != "do_not_contact"),
-                Contact.mail_sent_status.in_([1, 2, 3])
-            ).all()
-            logger.info(f"Found {len(contacts)} contacts eligible for drip processing.")
+        now = datetime.now(ZoneInfo("Asia/Kolkata"))
+        # Claim small leased batches until none are left, so several workers can share the run
+        while True:
+            budget = mail_service.send_budget.remaining()
+            if budget <= 0:
+                logger.warning("Daily send budget used up; drips still due carry over to the next run.")
+                break
+            contact_ids = self.claim_due_contacts(now, min(self.claim_batch_size, budget))
+            if not contact_ids:
+                break
+            with get_db_session() as db:
+                for contact in db.query(Contact).filter(Contact.id.in_(contact_ids)).order_by(Contact.id).all():
+                    sent = False
+                    try:
+                        drip_to_send = self.get_due_drip_number(contact, now)
 
-            for contact in contacts:
-                try:
-                    drip_to_send = 0
-                    if contact.mail_sent_status == 1 and (now - contact.first_mail_date).days >= self.drip_intervals[1]:
-                        drip_to_send = 1
-                    elif contact.mail_sent_status == 2 and (now - contact.drip1_date).days >= self.drip_intervals[2]:
-                        drip_to_send = 2
-                    elif contact.mail_sent_status == 3 and (now - contact.drip2_date).days >= self.drip_intervals[3]:
-                        drip_to_send = 3
-
-                    if drip_to_send > 0:
-                        logger.info(f"Attempting to send Drip {drip_to_send} to {contact.email}")
-                        if send_drip_email(contact, drip_to_send, db):
-                            if drip_to_send == 1:
-                                contact.drip1_date = now
-                                contact.mail_sent_status = 2
-                            elif drip_to_send == 2:
-                                contact.drip2_date = now
-                                contact.mail_sent_status = 3
-                            elif drip_to_send == 3:
-                                contact.drip3_date = now
-                                contact.mail_sent_status = 4
-                            
-                            db.commit()
-                            logger.info(f"Successfully sent Drip {drip_to_send} to {contact.email}")
+                        if drip_to_send > 0:
+                            if not self.renew_lease(db, contact.id):
+                                logger.warning(f"Drip lease on {contact.email} was reclaimed by another worker, skipping.")
+                                continue
+                            logger.info(f"Attempting to send Drip {drip_to_send} to {contact.email}")
+                            if send_drip_email(contact, drip_to_send, db):
+                                sent = True
+                                self.mark_drip_sent(contact, drip_to_send, now)
+                                db.commit()
+                                logger.info(f"Successfully sent Drip {drip_to_send} to {contact.email}")
+                            else:
+                                logger.error(f"send_drip_email function failed for Drip {drip_to_send} to {contact.email}")
+                                db.rollback()
+                                self.release_lease(db, contact.id, retry_drip=True)
                         else:
-                            logger.error(f"send_drip_email function failed for Drip {drip_to_send} to {contact.email}")
+                            self.release_lease(db, contact.id)
 
-                except Exception as e:
-                    logger.error(f"A critical error occurred processing drips for {contact.email}: {str(e)}")
-                    db.rollback()
+                    except Exception as e:
+                        logger.error(f"A critical error occurred processing drips for {contact.email}: {str(e)}")
+                        db.rollback()
+                        if not sent:
+                            self.release_lease(db, contact.id, retry_drip=True)
 
 drip_manager = DripCampaignManager()
 
@@ -0,0 +1,149 @@
+import os
+import re
+import time
+import threading
+import logging
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+import pytz
+from sqlalchemy.exc import IntegrityError
+from dotenv import load_dotenv
+from tables import Contact, EmailTemplate, get_db_session
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_PATTERN = re.compile(r"\{(name|first_name|company_name|industry)\}")
+
+def render_template(text: str, contact: Contact) -> str:
+    name = (contact.name or "").strip()
+    values = {
+        "name": name or "there",
+        "first_name": name.split()[0] if name else "there",
+        "company_name": contact.company_name or "your company",
+        "industry": contact.industry or "your industry"
+    }
+    return PLACEHOLDER_PATTERN.sub(lambda match: values[match.group(1)], text)
+
+class EmailTemplateStore:
+    """
+    Generates one email template per (industry, drip_number, variant) per day
+    and renders each contact's copy locally. drip_number 0 is the initial email.
+    EMAIL_TEMPLATE_VARIANTS sets how many variants each slot gets; contacts are
+    spread across them by id, so more variants means more per-contact variety
+    at the cost of more LLM calls. A slot whose generation fails is not retried
+    for EMAIL_TEMPLATE_FAILURE_TTL_SECONDS, so its contacts fall back to
+    individual generation instead of each repeating the failed call.
+    """
+
+    def __init__(self, generate: Callable[[str, str], Optional[str]]):
+        self.generate = generate
+        self.enabled = os.getenv("EMAIL_TEMPLATE_MODE", "false").lower() == "true"
+        self.variants = max(1, int(os.getenv("EMAIL_TEMPLATE_VARIANTS", "1")))
+        self.failure_ttl_seconds = int(os.getenv("EMAIL_TEMPLATE_FAILURE_TTL_SECONDS", "300"))
+        self.timezone = pytz.timezone('Asia/Kolkata')
+        self._templates: Dict[tuple, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+        self._slot_locks: Dict[tuple, threading.Lock] = {}
+        self._failed_at: Dict[tuple, float] = {}
+
+    def render_for_contact(self, contact: Contact, drip_number: int) -> Optional[Tuple[str, str]]:
+        if not contact.industry:
+            return None
+        variant = contact.id % self.variants
+        template = self.get_template(contact.industry, drip_number, variant)
+        if not template:
+            return None
+        subject, body = template
+        return render_template(subject, contact), render_template(body, contact)
+
+    def get_template(self, industry: str, drip_number: int, variant: int = 0) -> Optional[Tuple[str, str]]:
+        today = datetime.now(self.timezone).date()
+        slot = (today, industry, drip_number, variant)
+        if slot in self._templates:
+            return self._templates[slot]
+        if self._recently_failed(slot):
+            return None
+
+        with self._lock:
+            slot_lock = self._slot_locks.setdefault(slot, threading.Lock())
+        # One thread generates a slot; others wait for it instead of making duplicate LLM calls
+        with slot_lock:
+            if slot in self._templates:
+                return self._templates[slot]
+            # Threads that queued behind a failed attempt give up too rather than repeating it
+            if self._recently_failed(slot):
+                return None
+            template = self._load(slot) or self._create(slot)
+            if template:
+                self._templates[slot] = template
+                self._failed_at.pop(slot, None)
+                self._evict_stale(today)
+            else:
+                self._failed_at[slot] = time.monotonic()
+            return template
+
+    def _recently_failed(self, slot: tuple) -> bool:
+        failed_at = self._failed_at.get(slot)
+        return failed_at is not None and time.monotonic() - failed_at < self.failure_ttl_seconds
+
+    def _load(self, slot: tuple) -> Optional[Tuple[str, str]]:
+        template_date, industry, drip_number, variant = slot
+        with get_db_session() as db:
+            row = db.query(EmailTemplate).filter(
+                EmailTemplate.template_date == template_date,
+                EmailTemplate.industry == industry,
+                EmailTemplate.drip_number == drip_number,
+                EmailTemplate.variant == variant
+            ).first()
+            return (row.subject, row.body) if row else None
+
+    def _create(self, slot: tuple) -> Optional[Tuple[str, str]]:
+        template_date, industry, drip_number, variant = slot
+        stage = "initial outreach email" if drip_number == 0 else f"follow-up email {drip_number}"
+        content = self.generate(self._build_prompt(industry, drip_number, variant), f"{industry} {stage}")
+        if not content or '|||' not in content:
+            logger.error(f"Could not generate template for {industry}, drip {drip_number}, variant {variant}")
+            return None
+
+        subject, body = (part.strip() for part in content.split('|||', 1))
+        if not subject or not body:
+            return None
+
+        try:
+            with get_db_session() as db:
+                db.add(EmailTemplate(
+                    industry=industry,
+                    drip_number=drip_number,
+                    variant=variant,
+                    template_date=template_date,
+                    subject=subject,
+                    body=body
+                ))
+        except IntegrityError:
+            # Another worker stored this slot first; use theirs so every contact gets the same copy
+            return self._load(slot)
+        logger.info(f"Generated template for {industry}, drip {drip_number}, variant {variant}")
+        return subject, body
+
+    def _build_prompt(self, industry: str, drip_number: int, variant: int) -> str:
+        stage = "the initial outreach email" if drip_number == 0 else f"follow-up drip email number {drip_number}"
+        return f"""
+Write {stage} for prospects in the {industry} industry.
+This is a reusable template (variant {variant + 1}), so do not invent details about any specific person or company.
+Use these placeholders exactly as written wherever the prospect's details belong: {{name}}, {{first_name}}, {{company_name}}, {{industry}}.
+Do not use any other placeholders or square-bracket fields.
+
+Output Format: Provide your final, complete email in this exact format, using "|||" as a separator. Do not include any other text before or after this structure. Do NOT include the word "Subject:" or any prefixes before the subject line.
+Your Actual Subject Line|||Your Full Email Body Here, Including the Signature
+"""
+
+    def _evict_stale(self, today):
+        with self._lock:
+            for slot in [slot for slot in self._templates if slot[0] != today]:
+                self._templates.pop(slot, None)
+                self._slot_locks.pop(slot, None)
+            for slot in [slot for slot in self._failed_at if slot[0] != today]:
+                self._failed_at.pop(slot, None)
@@ -7,14 +7,11 @@ from sqlalchemy import func
 from pydantic import BaseModel
 from typing import List
 import logging
-import pytz
-from datetime import datetime
 import mail_service
 import drip_logic
 # ✨ CORRECTED IMPORTS: All imports are at the top level for clarity and safety.
-from tables import Contact, get_db, get_db_session, ContentInfo
-from mail_service import send_initial_email # Import the correct function
-from drip_logic import DripCampaignManager
+from tables import Contact, get_db, ContentInfo
+from send_engine import send_engine
 
 email_router = APIRouter()
 logging.basicConfig(level=logging.INFO)
@@ -27,44 +24,8 @@ class SendInitialEmailsRequest(BaseModel):
     contact_ids: List[int]
 
 def process_selected_initial_emails(contact_ids: List[int]):
-    with get_db_session() as db:
-        for contact_id in contact_ids:
-            try:
-                # Lock the row for update
-                contact = db.query(Contact).filter(
-                    Contact.id == contact_id,
-                    Contact.mail_sent_status.is_(None)
-                ).with_for_update().first()
-                
-                if not contact:
-                    continue
-                
-                # Generate industry if needed
-                if not contact.industry:
-                    drip_manager = DripCampaignManager()
-                    industry = drip_manager.generate_industry_for_contact(contact)
-                    if industry:
-                        contact.industry = industry
-                        db.flush()  # Flush the industry update
-                    else:
-                        logger.warning(f"Skipping {contact.email}, failed to generate industry.")
-                        db.rollback()
-                        continue
-                
-                # Use the existing send_initial_email function
-                if send_initial_email(contact, db):
-                    # Update contact
-                    contact.mail_sent_status = "1"
-                    contact.first_mail_date = datetime.now(pytz.timezone('Asia/Kolkata'))
-                    db.commit()  # Commit per contact
-                    logger.info(f"Successfully sent initial email to {contact.email}")
-                else:
-                    logger.error(f"Failed to send email to {contact.email}")
-                    db.rollback()
-                    
-            except Exception as e:
-                logger.error(f"Error processing contact {contact_id}: {e}")
-                db.rollback()
+    # Same concurrent generate-and-send path as the scheduled run, instead of one contact at a time on this thread
+    send_engine.run_selected_initial_emails(contact_ids)
 
 @email_router.get("/email", response_class=HTMLResponse)
 async def email_page(request: Request, db: Session = Depends(get_db)):
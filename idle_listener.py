@@ -0,0 +1,139 @@
+import imaplib
+import os
+import select
+import ssl
+import threading
+import time
+import logging
+from typing import Callable, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class ImapIdleListener:
+    """
+    Long-lived IMAP IDLE worker that triggers reply processing as soon as the
+    server announces new mail. If the server does not advertise IDLE the worker
+    exits and the scheduled reply_checking_job keeps polling.
+    """
+
+    def __init__(self, on_new_mail: Callable[[], int], mailbox: str = 'INBOX'):
+        self.on_new_mail = on_new_mail
+        self.mailbox = mailbox
+        self.imap_server = os.getenv("IMAP_HOST", "imap.gmail.com")
+        self.imap_port = int(os.getenv("IMAP_PORT", "993"))
+        self.email_address = os.getenv("EMAIL_ADDRESS")
+        self.email_password = os.getenv("EMAIL_PASSWORD")
+        # RFC 2177 asks clients to re-issue IDLE at least every 29 minutes
+        self.renew_seconds = int(os.getenv("IMAP_IDLE_RENEW_SECONDS", "1500"))
+        self.max_backoff_seconds = int(os.getenv("IMAP_IDLE_MAX_BACKOFF", "300"))
+        # Bounds every blocking read, e.g. waiting for the tagged reply to DONE on a half-open socket
+        self.socket_timeout = int(os.getenv("IMAP_IDLE_SOCKET_TIMEOUT", "60"))
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.idle_supported: Optional[bool] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="imap-idle-listener", daemon=True)
+        self._thread.start()
+        logger.info("IMAP IDLE listener started")
+
+    def stop(self, timeout: float = 10):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            logger.info("IMAP IDLE listener stopped")
+
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def _run(self):
+        backoff = 1
+        while not self._stop_event.is_set():
+            try:
+                self._listen()
+                if self.idle_supported is False:
+                    return
+                backoff = 1
+            except Exception as e:
+                logger.error(f"IMAP IDLE connection error: {e}. Reconnecting in {backoff}s")
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff_seconds)
+
+    def _listen(self):
+        with imaplib.IMAP4_SSL(self.imap_server, self.imap_port, timeout=self.socket_timeout) as mail:
+            mail.login(self.email_address, self.email_password)
+            if 'IDLE' not in mail.capabilities:
+                self.idle_supported = False
+                logger.warning("IMAP server does not advertise IDLE; falling back to scheduled polling.")
+                return
+            self.idle_supported = True
+            mail.select(self.mailbox)
+
+            # Catch up on anything that arrived while we were disconnected
+            self._dispatch()
+            while not self._stop_event.is_set():
+                if self._idle(mail):
+                    self._dispatch()
+
+    def _dispatch(self):
+        try:
+            reply_count = self.on_new_mail()
+            logger.info(f"IDLE-triggered reply check completed. Found {reply_count} new replies.")
+        except Exception as e:
+            logger.error(f"Error in IDLE-triggered reply check: {e}")
+
+    def _idle(self, mail: imaplib.IMAP4) -> bool:
+        """Runs one IDLE cycle. Returns True when the server reported new messages."""
+        tag = mail._new_tag()
+        mail.send(tag + b' IDLE\r\n')
+        response = mail.readline()
+        if not response.startswith(b'+'):
+            raise imaplib.IMAP4.error(f"IDLE rejected: {response!r}")
+
+        new_mail = False
+        deadline = time.monotonic() + self.renew_seconds
+        while not self._stop_event.is_set() and time.monotonic() < deadline:
+            # Poll in short slices so stop() is honoured promptly
+            if not self._has_buffered_data(mail):
+                readable, _, _ = select.select([mail.sock], [], [], 5)
+                if not readable:
+                    continue
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("Connection closed during IDLE")
+            if line.startswith(b'*') and b'EXISTS' in line:
+                new_mail = True
+                break
+
+        mail.send(b'DONE\r\n')
+        while True:
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("Connection closed while ending IDLE")
+            if line.startswith(tag):
+                break
+        return new_mail
+
+    def _has_buffered_data(self, mail: imaplib.IMAP4) -> bool:
+        """
+        True if a response is already waiting in the TLS layer or in imaplib's read
+        buffer. select() only sees the raw socket, so a line read in the same
+        chunk as the previous one would otherwise wait for the next wakeup.
+        """
+        if mail.sock.pending():
+            return True
+        timeout = mail.sock.gettimeout()
+        mail.sock.setblocking(False)
+        try:
+            return bool(mail.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            mail.sock.settimeout(timeout)
@@ -0,0 +1,146 @@
+import os
+import re
+import json
+import math
+import hashlib
+import zipfile
+import threading
+import logging
+from collections import Counter
+from typing import List, Optional
+from xml.etree import ElementTree
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "in", "is", "it",
+    "its", "of", "on", "or", "that", "the", "this", "to", "was", "we", "with", "you", "your", "our"
+}
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+def extract_docx_paragraphs(path: str) -> List[str]:
+    with zipfile.ZipFile(path) as docx:
+        root = ElementTree.fromstring(docx.read("word/document.xml"))
+    paragraphs = []
+    for paragraph in root.iter(f"{WORD_NAMESPACE}p"):
+        text = "".join(node.text or "" for node in paragraph.iter(f"{WORD_NAMESPACE}t")).strip()
+        if text:
+            paragraphs.append(text)
+    return paragraphs
+
+def chunk_paragraphs(paragraphs: List[str], max_words: int, overlap_words: int) -> List[str]:
+    """Packs whole paragraphs into chunks of about max_words, carrying a tail of overlap_words forward."""
+    chunks = []
+    current: List[str] = []
+    for paragraph in paragraphs:
+        words = paragraph.split()
+        if current and len(current) + len(words) > max_words:
+            chunks.append(" ".join(current))
+            current = current[-overlap_words:] if overlap_words else []
+        current.extend(words)
+        while len(current) > max_words:
+            chunks.append(" ".join(current[:max_words]))
+            current = current[max_words - overlap_words:] if overlap_words else current[max_words:]
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+class KnowledgeIndex:
+    """
+    BM25 index over the company knowledge document. The document is extracted
+    and chunked once, the index is persisted next to it and rebuilt only when
+    the document's content hash changes.
+    """
+
+    def __init__(self, doc_path: Optional[str] = None, index_path: Optional[str] = None,
+                 k1: float = 1.5, b: float = 0.75):
+        self.doc_path = doc_path or os.getenv("KNOWLEDGE_DOC_PATH", "pulp_strategy.docx")
+        self.index_path = index_path or os.getenv("KNOWLEDGE_INDEX_PATH", "knowledge_index.json")
+        self.chunk_words = int(os.getenv("KNOWLEDGE_CHUNK_WORDS", "180"))
+        self.overlap_words = int(os.getenv("KNOWLEDGE_CHUNK_OVERLAP", "30"))
+        self.k1 = k1
+        self.b = b
+        self.chunks: List[str] = []
+        self._term_freqs: List[Counter] = []
+        self._doc_lengths: List[int] = []
+        self._idf = {}
+        self._avg_length = 0.0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            doc_hash = self._hash_document()
+            if not self._load_from_disk(doc_hash):
+                self._build(doc_hash)
+            self._loaded = True
+
+    def search(self, query: str, top_k: int = 4) -> List[str]:
+        self.ensure_loaded()
+        query_terms = set(tokenize(query))
+        if not query_terms or not self.chunks:
+            return []
+
+        scores = []
+        for i, term_freqs in enumerate(self._term_freqs):
+            score = 0.0
+            length_norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[i] / self._avg_length)
+            for term in query_terms:
+                freq = term_freqs.get(term)
+                if freq:
+                    score += self._idf[term] * freq * (self.k1 + 1) / (freq + length_norm)
+            if score > 0:
+                scores.append((score, i))
+        scores.sort(reverse=True)
+        return [self.chunks[i] for _, i in scores[:top_k]]
+
+    def _hash_document(self) -> str:
+        with open(self.doc_path, "rb") as doc:
+            return hashlib.sha256(doc.read()).hexdigest()
+
+    def _load_from_disk(self, doc_hash: str) -> bool:
+        if not os.path.exists(self.index_path):
+            return False
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as index_file:
+                data = json.load(index_file)
+            if data.get("doc_hash") != doc_hash:
+                return False
+            self._index_chunks(data["chunks"])
+            logger.info(f"Loaded knowledge index with {len(self.chunks)} chunks from {self.index_path}")
+            return True
+        except Exception as e:
+            logger.warning(f"Could not load knowledge index from {self.index_path}: {e}")
+            return False
+
+    def _build(self, doc_hash: str):
+        paragraphs = extract_docx_paragraphs(self.doc_path)
+        chunks = chunk_paragraphs(paragraphs, self.chunk_words, self.overlap_words)
+        self._index_chunks(chunks)
+        with open(self.index_path, "w", encoding="utf-8") as index_file:
+            json.dump({"doc_hash": doc_hash, "chunks": chunks}, index_file)
+        logger.info(f"Built knowledge index with {len(chunks)} chunks from {self.doc_path}")
+
+    def _index_chunks(self, chunks: List[str]):
+        self.chunks = chunks
+        self._term_freqs = [Counter(tokenize(chunk)) for chunk in chunks]
+        self._doc_lengths = [sum(freqs.values()) for freqs in self._term_freqs]
+        self._avg_length = (sum(self._doc_lengths) / len(chunks) if chunks else 0.0) or 1.0
+        doc_freqs = Counter(term for freqs in self._term_freqs for term in freqs)
+        total = len(chunks)
+        self._idf = {
+            term: math.log(1 + (total - freq + 0.5) / (freq + 0.5))
+            for term, freq in doc_freqs.items()
+        }
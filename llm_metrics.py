@@ -0,0 +1,242 @@
+import os
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import case, func
+from dotenv import load_dotenv
+from tables import LLMCallMetric, get_db_session
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# USD per million tokens: (input, cached input, output)
+MODEL_PRICING = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+}
+# The SDK retries these statuses on its own, so each one seen is a retry
+RETRYABLE_STATUSES = {408, 409, 429}
+
+_current_job: ContextVar[Optional[str]] = ContextVar("llm_job", default=None)
+_retry_counter = threading.local()
+
+def count_transport_retry(response):
+    """httpx response hook on the shared OpenAI client; counts responses the SDK is about to retry."""
+    if response.status_code in RETRYABLE_STATUSES or response.status_code >= 500:
+        _retry_counter.value = getattr(_retry_counter, "value", 0) + 1
+
+def _price_for(model: Optional[str]):
+    if not model:
+        return None
+    # Dated snapshots (gpt-4o-mini-2024-07-18) share their family's price; longest prefix wins
+    for name in sorted(MODEL_PRICING, key=len, reverse=True):
+        if model.startswith(name):
+            return MODEL_PRICING[name]
+    return None
+
+def estimate_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int, cached_tokens: int) -> Optional[float]:
+    price = _price_for(model)
+    if price is None:
+        return None
+    input_price, cached_price, output_price = price
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    return (uncached * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1_000_000
+
+def usage_counts(usage) -> tuple:
+    """(prompt, completion, cached) tokens from a chat completion, run or Batch API usage block."""
+    if usage is None:
+        return 0, 0, 0
+    if isinstance(usage, dict):
+        details = usage.get("prompt_tokens_details") or {}
+        return usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0, details.get("cached_tokens") or 0
+    details = getattr(usage, "prompt_tokens_details", None) or getattr(usage, "prompt_token_details", None)
+    cached = getattr(details, "cached_tokens", 0) if details is not None else 0
+    return usage.prompt_tokens or 0, usage.completion_tokens or 0, cached or 0
+
+class LLMCallTracker:
+    """Measures one LLM call. Call observe() with the response or run once it is available."""
+
+    def __init__(self, call_site: str, retries: int):
+        self.call_site = call_site
+        self.retries = retries
+        self.model = None
+        self.usage = None
+        self.success = True
+
+    def observe(self, result, success: bool = True):
+        self.model = getattr(result, "model", None) or self.model
+        self.usage = getattr(result, "usage", None)
+        self.success = success
+
+class LLMMetrics:
+    """
+    Records model, tokens, wall time and retries for every chat completion and
+    Assistants run, tagged with the call site and the scheduler job it ran under.
+    Rows are buffered and written to llm_call_metrics in batches.
+    """
+
+    def __init__(self):
+        self.flush_size = int(os.getenv("LLM_METRICS_FLUSH_SIZE", "25"))
+        self.flush_seconds = float(os.getenv("LLM_METRICS_FLUSH_SECONDS", "60"))
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def job(self, name: str):
+        """Tags every LLM call made inside the block, including ones submitted to the LLM pool."""
+        token = _current_job.set(name)
+        try:
+            yield
+        finally:
+            _current_job.reset(token)
+
+    @contextmanager
+    def track(self, call_site: str, model: Optional[str] = None, retries: int = 0):
+        tracker = LLMCallTracker(call_site, retries)
+        tracker.model = model
+        retries_before = getattr(_retry_counter, "value", 0)
+        started = time.perf_counter()
+        try:
+            yield tracker
+        except Exception:
+            tracker.success = False
+            raise
+        finally:
+            prompt_tokens, completion_tokens, cached_tokens = usage_counts(tracker.usage)
+            self.record(
+                call_site,
+                tracker.model,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                cached_tokens=cached_tokens,
+                seconds=time.perf_counter() - started,
+                retries=tracker.retries + getattr(_retry_counter, "value", 0) - retries_before,
+                success=tracker.success
+            )
+
+    def chat_completion(self, client, call_site: str, retries: int = 0, **kwargs):
+        """client.chat.completions.create(**kwargs), recorded under call_site."""
+        with self.track(call_site, model=kwargs.get("model"), retries=retries) as tracker:
+            response = client.chat.completions.create(**kwargs)
+            tracker.observe(response)
+            return response
+
+    def record(self, call_site: str, model: Optional[str], prompt_tokens: int = 0, completion_tokens: int = 0,
+               cached_tokens: int = 0, seconds: float = 0.0, retries: int = 0, success: bool = True):
+        row = LLMCallMetric(
+            call_site=call_site,
+            job=_current_job.get(),
+            model=model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cached_tokens=cached_tokens,
+            seconds=seconds,
+            retries=retries,
+            success=success,
+            created_at=datetime.utcnow()
+        )
+        with self._lock:
+            self._pending.append(row)
+            due = len(self._pending) >= self.flush_size or time.monotonic() - self._last_flush >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+        if not rows:
+            return
+        try:
+            with get_db_session() as db:
+                db.add_all(rows)
+        except Exception as e:
+            logger.warning(f"Could not write {len(rows)} LLM call metrics: {e}")
+
+    def summary(self, hours: int = 24) -> dict:
+        self.flush()
+        since = datetime.utcnow() - timedelta(hours=hours)
+        with get_db_session() as db:
+            rows = db.query(
+                LLMCallMetric.job,
+                LLMCallMetric.call_site,
+                LLMCallMetric.model,
+                func.count(LLMCallMetric.id),
+                func.sum(LLMCallMetric.prompt_tokens),
+                func.sum(LLMCallMetric.completion_tokens),
+                func.sum(LLMCallMetric.cached_tokens),
+                func.sum(LLMCallMetric.seconds),
+                func.max(LLMCallMetric.seconds),
+                func.sum(LLMCallMetric.retries),
+                func.sum(case((LLMCallMetric.success.is_(False), 1), else_=0))
+            ).filter(LLMCallMetric.created_at >= since).group_by(
+                LLMCallMetric.job, LLMCallMetric.call_site, LLMCallMetric.model
+            ).all()
+
+        totals = self._empty_rollup()
+        by_call_site, by_job = {}, {}
+        for job, call_site, model, calls, prompt, completion, cached, seconds, max_seconds, retries, failures in rows:
+            group = {
+                "calls": calls,
+                "prompt_tokens": int(prompt or 0),
+                "completion_tokens": int(completion or 0),
+                "cached_tokens": int(cached or 0),
+                "seconds": float(seconds or 0.0),
+                "max_seconds": float(max_seconds or 0.0),
+                "retries": int(retries or 0),
+                "failures": int(failures or 0),
+                "cost_usd": estimate_cost(model, int(prompt or 0), int(completion or 0), int(cached or 0))
+            }
+            site_rollup = by_call_site.setdefault((call_site, model), self._empty_rollup())
+            for rollup in (totals, site_rollup, by_job.setdefault(job or "unscheduled", self._empty_rollup())):
+                self._add(rollup, group)
+
+        return {
+            "window_hours": hours,
+            "totals": self._finish(totals),
+            "by_call_site": sorted(
+                ({"call_site": call_site, "model": model, **self._finish(rollup)}
+                 for (call_site, model), rollup in by_call_site.items()),
+                key=lambda item: item["cost_usd"] or 0.0, reverse=True
+            ),
+            "by_job": {job: self._finish(rollup) for job, rollup in sorted(by_job.items())}
+        }
+
+    def _empty_rollup(self) -> dict:
+        return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+                "seconds": 0.0, "max_seconds": 0.0, "retries": 0, "failures": 0, "cost_usd": 0.0, "unpriced_calls": 0}
+
+    def _add(self, rollup: dict, group: dict):
+        for key in ("calls", "prompt_tokens", "completion_tokens", "cached_tokens", "seconds", "retries", "failures"):
+            rollup[key] += group[key]
+        rollup["max_seconds"] = max(rollup["max_seconds"], group["max_seconds"])
+        if group["cost_usd"] is None:
+            rollup["unpriced_calls"] += group["calls"]
+        else:
+            rollup["cost_usd"] += group["cost_usd"]
+
+    def _finish(self, rollup: dict) -> dict:
+        calls = rollup["calls"]
+        return {
+            "calls": calls,
+            "prompt_tokens": rollup["prompt_tokens"],
+            "completion_tokens": rollup["completion_tokens"],
+            "cached_tokens": rollup["cached_tokens"],
+            "avg_seconds": round(rollup["seconds"] / calls, 2) if calls else None,
+            "max_seconds": round(rollup["max_seconds"], 2),
+            "retries": rollup["retries"],
+            "failures": rollup["failures"],
+            "cost_usd": round(rollup["cost_usd"], 4),
+            "unpriced_calls": rollup["unpriced_calls"]
+        }
+
+llm_metrics = LLMMetrics()
@@ -0,0 +1,104 @@
+import os
+import contextvars
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+import httpx
+from openai import OpenAI
+from dotenv import load_dotenv
+from llm_metrics import count_transport_retry
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_client_lock = threading.Lock()
+_shared_client: Optional[OpenAI] = None
+
+def get_openai_client() -> OpenAI:
+    """Process-wide OpenAI client so every caller reuses the same keep-alive connection pool."""
+    global _shared_client
+    with _client_lock:
+        if _shared_client is None:
+            max_connections = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+            http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+                timeout=httpx.Timeout(float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))),
+                event_hooks={"response": [count_transport_retry]}
+            )
+            # OPENAI_BASE_URL points every caller at another OpenAI-compatible server, e.g. mock_llm_server.py
+            _shared_client = OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=os.getenv("OPENAI_BASE_URL") or None,
+                http_client=http_client
+            )
+        return _shared_client
+
+def _percentile(values: list, percentile: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+    return round(ordered[index], 3)
+
+class LLMPool:
+    """Concurrency-limited executor for LLM generation jobs with queue and latency metrics."""
+
+    def __init__(self, max_workers: Optional[int] = None, latency_window: int = 500):
+        self.max_workers = max_workers or int(os.getenv("LLM_POOL_MAX_WORKERS", "8"))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="llm-pool")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._latencies = deque(maxlen=latency_window)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        with self._lock:
+            self._queued += 1
+        # Carry the caller's context so LLM metrics stay tagged with the submitting job
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, self._run, fn, *args, **kwargs)
+
+    def _run(self, fn: Callable, *args, **kwargs):
+        with self._lock:
+            self._queued -= 1
+            self._in_flight += 1
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+            with self._lock:
+                self._completed += 1
+            return result
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._in_flight -= 1
+                self._latencies.append(elapsed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = list(self._latencies)
+            return {
+                "max_workers": self.max_workers,
+                "queue_depth": self._queued,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "failed": self._failed,
+                "latency_p50_seconds": _percentile(latencies, 50),
+                "latency_p95_seconds": _percentile(latencies, 95)
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+llm_pool = LLMPool()
@@ -3,6 +3,7 @@ from email.utils import parsedate_to_datetime, parseaddr
 from datetime import datetime, timezone, timedelta
 import os
 import json
+import re
 from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
 import time
@@ -10,16 +11,27 @@ from dotenv import load_dotenv
 import pytz
 import smtplib
 import imaplib
+import threading
+from queue import Queue, Empty, Full
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 from email.header import decode_header
+from email.parser import BytesHeaderParser
 from typing import List, Dict, Any
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.utils import make_msgid, formatdate
 import logging
-from typing import List, Optional, Dict, Any
-from tables import SessionLocal, Contact, ContentInfo, EmailData, get_db_session
-from openai import OpenAI
+from typing import List, Optional, Dict, Any, Tuple
+from tables import SessionLocal, Contact, ContentInfo, EmailData, MailboxSyncState, DripDraft, get_db_session
+from llm_pool import get_openai_client
+from caching import LRUCache, sentiment_cache, reply_body_hash
+from reply_classifier import reply_pre_classifier, bounced_recipients, AUTO_REPLY, BOUNCE
+from email_templates import EmailTemplateStore
+from assistant_threads import AssistantThreadManager
+from knowledge_index import KnowledgeIndex
+from llm_metrics import llm_metrics
+from send_budget import SendBudget, CAMPAIGN, REPLY, is_quota_error
 
 load_dotenv()
 
@@ -39,9 +51,105 @@ def get_body_from_message(msg: email.message.Message) -> str:
         return payload.decode(charset, errors="ignore")
     return ""
 
+RUN_TERMINAL_STATUSES = {"completed", "failed", "cancelled", "expired", "incomplete"}
+RUN_POLL_INITIAL_INTERVAL = 0.25
+RUN_POLL_BACKOFF = 1.5
+RUN_POLL_MAX_INTERVAL = 2.0
+
+REPLY_HEADER_FIELDS = "FROM MESSAGE-ID IN-REPLY-TO REFERENCES X-FAILED-RECIPIENTS"
+
+def compress_uid_set(uids: List[int]) -> str:
+    """Turns [1, 2, 3, 7, 9, 10] into the IMAP sequence set '1:3,7,9:10'."""
+    ranges = []
+    start = prev = None
+    for uid in sorted(uids):
+        if start is None:
+            start = prev = uid
+        elif uid == prev + 1:
+            prev = uid
+        else:
+            ranges.append(f"{start}:{prev}" if start != prev else str(start))
+            start = prev = uid
+    if start is not None:
+        ranges.append(f"{start}:{prev}" if start != prev else str(start))
+    return ",".join(ranges)
+
+def parse_uid_fetch_response(data: list) -> Dict[int, bytes]:
+    results = {}
+    for item in data or []:
+        if not isinstance(item, tuple):
+            continue
+        match = re.search(rb'UID (\d+)', item[0])
+        if match:
+            results[int(match.group(1))] = item[1]
+    return results
+
+class SMTPConnectionPool:
+    """Keeps authenticated SMTP sessions alive so each send skips STARTTLS and LOGIN."""
+
+    def __init__(self, host: str, port: int, username: str, password: str,
+                 max_size: int = 3, max_idle_seconds: int = 240, timeout: int = 30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_size = max_size
+        self.max_idle_seconds = max_idle_seconds
+        self.timeout = timeout
+        self._idle: Queue = Queue(maxsize=max_size)
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        server.starttls()
+        server.login(self.username, self.password)
+        logger.debug(f"Opened new SMTP connection to {self.host}:{self.port}")
+        return server
+
+    def _is_healthy(self, server: smtplib.SMTP) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _close(self, server: smtplib.SMTP) -> None:
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def acquire(self) -> smtplib.SMTP:
+        while True:
+            try:
+                server, last_used = self._idle.get_nowait()
+            except Empty:
+                return self._connect()
+            if time.monotonic() - last_used <= self.max_idle_seconds and self._is_healthy(server):
+                return server
+            self._close(server)
+
+    def release(self, server: smtplib.SMTP) -> None:
+        try:
+            self._idle.put_nowait((server, time.monotonic()))
+        except Full:
+            self._close(server)
+
+    def discard(self, server: smtplib.SMTP) -> None:
+        self._close(server)
+
+    def close_all(self) -> None:
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except Empty:
+                return
+            self._close(server)
+
 class MailService:
     def __init__(self):
-        self.openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.openai_client = get_openai_client()
         self.assistant_id = os.getenv("ASSISTANT_ID")
         self.file_id = os.getenv("FILE_ID")
         self.default_thread_id = os.getenv("THREAD_ID")
@@ -51,68 +159,243 @@ class MailService:
         self.imap_port = int(os.getenv("IMAP_PORT", "993"))
         self.email_address = os.getenv("EMAIL_ADDRESS")
         self.email_password = os.getenv("EMAIL_PASSWORD")
+        self.imap_fetch_batch_size = int(os.getenv("IMAP_FETCH_BATCH_SIZE", "500"))
+        self.run_timeout_seconds = int(os.getenv("ASSISTANT_RUN_TIMEOUT_SECONDS", "120"))
+        self.use_run_streaming = os.getenv("ASSISTANT_RUN_STREAMING", "false").lower() == "true"
+        self.templates = EmailTemplateStore(generate=self._generate_template_text)
+        self.thread_manager = AssistantThreadManager(self.openai_client, self.file_id)
+        self.thread_cache = LRUCache(int(os.getenv("THREAD_CACHE_SIZE", "10000")))
         self.timezone = pytz.timezone('Asia/Kolkata')  
+        self.send_budget = SendBudget(self.email_address)
+        self.smtp_pool = SMTPConnectionPool(
+            self.smtp_server,
+            self.smtp_port,
+            self.email_address,
+            self.email_password,
+            max_size=int(os.getenv("SMTP_POOL_SIZE", "3")),
+            max_idle_seconds=int(os.getenv("SMTP_POOL_MAX_IDLE", "240"))
+        )
+
+        self.retrieval_mode = os.getenv("KNOWLEDGE_RETRIEVAL_MODE", "assistant").lower()
+        self.knowledge_index = KnowledgeIndex() if self.retrieval_mode == "local" else None
+        self.retrieval_top_k = int(os.getenv("KNOWLEDGE_TOP_K", "4"))
+        self.generation_model = os.getenv("GENERATION_MODEL", "gpt-4o-mini")
+        self.assistant_instructions = os.getenv(
+            "ASSISTANT_INSTRUCTIONS", "You are a business development expert for Pulp Strategy..."
+        )
 
-        if not all([self.assistant_id, self.file_id, self.default_thread_id]):
+        if self.retrieval_mode != "local" and not all([self.assistant_id, self.file_id, self.default_thread_id]):
             raise ValueError("ASSISTANT_ID, FILE_ID, or THREAD_ID not found in .env file. Please run setup_assistant.py first.")
         
     
-    def _get_assistant_response(self, prompt: str, thread_id: Optional[str]) -> Optional[str]:
+    def _get_assistant_response(self, prompt: str, thread_id: Optional[str], call_site: str = "assistant",
+                                contact: Optional[Contact] = None, context: Optional[str] = None) -> Optional[str]:
+        """contact and context describe what the prompt is about; local retrieval searches the knowledge index with them."""
+        if self.knowledge_index:
+            return self._get_local_retrieval_response(prompt, call_site, contact, context)
+
         active_thread_id = thread_id or self.default_thread_id
         if not all([self.assistant_id, self.file_id, active_thread_id]):
             logger.error("Assistant, File, or Thread ID not set.")
             return None
 
         try:
-            self.openai_client.beta.threads.messages.create(
-                thread_id=active_thread_id,
-                role="user",
-                content=prompt,
-                attachments=[
-                    {"file_id": self.file_id, "tools": [{"type": "file_search"}]}
-                ]
-            )
-            
-            run = self.openai_client.beta.threads.runs.create(
-                thread_id=active_thread_id,
-                assistant_id=self.assistant_id
-            )
-            while run.status not in ["completed", "failed"]:
-                time.sleep(1)
-                run = self.openai_client.beta.threads.runs.retrieve(
+            requested_thread_id = active_thread_id
+            active_thread_id, attachments, turn_count = self.thread_manager.prepare(active_thread_id)
+            if contact and active_thread_id != requested_thread_id and requested_thread_id != self.default_thread_id:
+                # The thread was compacted; stop handing out the replaced id from the cache
+                self.thread_cache.put(contact.id, active_thread_id)
+                if contact.thread_id == requested_thread_id:
+                    set_committed_value(contact, "thread_id", active_thread_id)
+            message_options = {"attachments": attachments} if attachments else {}
+            with llm_metrics.track(call_site) as tracker:
+                self.openai_client.beta.threads.messages.create(
                     thread_id=active_thread_id,
-                    run_id=run.id
+                    role="user",
+                    content=prompt,
+                    **message_options
                 )
 
-            if run.status == "completed":
-                messages = self.openai_client.beta.threads.messages.list(
-                    thread_id=active_thread_id
-                )
-                return messages.data[0].content[0].text.value
-            else:
-                logger.error(f"Assistant run failed with status: {run.status}")
+                started = time.perf_counter()
+                if self.use_run_streaming:
+                    run, content = self._stream_run(active_thread_id)
+                else:
+                    run = self.openai_client.beta.threads.runs.create(
+                        thread_id=active_thread_id,
+                        assistant_id=self.assistant_id,
+                        **self.thread_manager.run_options()
+                    )
+                    run = self._wait_for_run(active_thread_id, run)
+                    content = None
+                    if run.status == "completed":
+                        messages = self.openai_client.beta.threads.messages.list(
+                            thread_id=active_thread_id,
+                            run_id=run.id,
+                            order="desc",
+                            limit=1
+                        )
+                        content = messages.data[0].content[0].text.value
+                tracker.observe(run, success=run is not None and run.status == "completed")
+
+            if run is None or run.status != "completed":
+                logger.error(f"Assistant run ended with status: {run.status if run else 'unknown'}")
                 return None
+
+            self.thread_manager.record_turn(active_thread_id)
+            if run.usage:
+                self.thread_manager.run_stats.record(
+                    turn_count, run.usage.prompt_tokens, run.usage.completion_tokens, time.perf_counter() - started
+                )
+            return content
         except Exception as e:
             logger.error(f"An error occurred while running the assistant: {e}")
             return None
 
+    def _get_local_retrieval_response(self, prompt: str, call_site: str, contact: Optional[Contact] = None,
+                                      context: Optional[str] = None) -> Optional[str]:
+        """Answers with a plain chat completion, grounded on top-k passages from the local knowledge index."""
+        try:
+            passages = self.knowledge_index.search(self._retrieval_query(prompt, contact, context), top_k=self.retrieval_top_k)
+            knowledge = "\n\n---\n\n".join(passages) if passages else "No relevant passages found."
+            messages = [{
+                "role": "system",
+                "content": f"{self.assistant_instructions}\n\nUse this company knowledge where relevant:\n\n{knowledge}"
+            }]
+            if contact:
+                messages.extend(self._conversation_history(contact.id))
+            messages.append({"role": "user", "content": prompt})
+
+            response = llm_metrics.chat_completion(
+                self.openai_client,
+                call_site,
+                model=self.generation_model,
+                messages=messages,
+                temperature=0.7
+            )
+            return response.choices[0].message.content
+        except Exception as e:
+            logger.error(f"An error occurred while generating with local retrieval: {e}")
+            return None
+
+    def _retrieval_query(self, prompt: str, contact: Optional[Contact], context: Optional[str]) -> str:
+        """
+        What to search the knowledge index for. The prompts are mostly fixed
+        instructions shared by every contact, so searching with them returns the
+        same passages each time. The contact's company and industry plus the
+        call's own context (their questions, the template's industry) are what
+        tell the emails apart.
+        """
+        parts = [context]
+        if contact:
+            parts.extend([contact.company_name, contact.industry])
+        query = " ".join(part for part in parts if part)
+        return query or prompt
+
+    def _conversation_history(self, contact_id: int, limit: int = 4) -> List[dict]:
+        """Recent emails with the contact, standing in for the Assistants thread memory."""
+        with get_db_session() as db:
+            recent = db.query(ContentInfo).filter(
+                ContentInfo.contact_id == contact_id,
+                ContentInfo.body.isnot(None),
+                ContentInfo.email_type.notin_([AUTO_REPLY, BOUNCE])
+            ).order_by(ContentInfo.created_at.desc()).limit(limit).all()
+            return [
+                {
+                    "role": "user" if item.email_type == "reply" else "assistant",
+                    "content": f"Subject: {item.subject}\n\n{item.body}"
+                }
+                for item in reversed(recent)
+            ]
+
+    def _wait_for_run(self, thread_id: str, run):
+        """Polls a run until it reaches a terminal status, starting fast and backing off, within a deadline."""
+        deadline = time.monotonic() + self.run_timeout_seconds
+        interval = RUN_POLL_INITIAL_INTERVAL
+        while run.status not in RUN_TERMINAL_STATUSES:
+            if run.status == "requires_action":
+                # No function tools are registered, so nothing can satisfy the action
+                logger.error(f"Assistant run {run.id} requires action; cancelling.")
+                return self._cancel_run(thread_id, run)
+            if time.monotonic() + interval > deadline:
+                logger.error(f"Assistant run {run.id} exceeded {self.run_timeout_seconds}s deadline; cancelling.")
+                return self._cancel_run(thread_id, run)
+            time.sleep(interval)
+            interval = min(interval * RUN_POLL_BACKOFF, RUN_POLL_MAX_INTERVAL)
+            run = self.openai_client.beta.threads.runs.retrieve(
+                thread_id=thread_id,
+                run_id=run.id
+            )
+        return run
+
+    def _cancel_run(self, thread_id: str, run):
+        try:
+            return self.openai_client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
+        except Exception as e:
+            logger.warning(f"Could not cancel assistant run {run.id}: {e}")
+            return run
+
+    def _stream_run(self, thread_id: str) -> tuple:
+        """Streams a run under the same deadline as polling; a run that needs action, overruns or stalls is cancelled."""
+        deadline = time.monotonic() + self.run_timeout_seconds
+        run = None
+        try:
+            # A read timeout as well, so a stream that stops sending events cannot block past the deadline
+            client = self.openai_client.with_options(timeout=self.run_timeout_seconds)
+            with client.beta.threads.runs.stream(
+                thread_id=thread_id,
+                assistant_id=self.assistant_id,
+                **self.thread_manager.run_options()
+            ) as stream:
+                for event in stream:
+                    run = stream.current_run or run
+                    if event.event == "thread.run.requires_action":
+                        # No function tools are registered, so nothing can satisfy the action
+                        logger.error(f"Assistant run {run.id if run else 'unknown'} requires action; cancelling.")
+                        return (self._cancel_run(thread_id, run) if run else None), None
+                    if time.monotonic() > deadline:
+                        logger.error(f"Assistant run {run.id if run else 'unknown'} exceeded {self.run_timeout_seconds}s deadline; cancelling.")
+                        return (self._cancel_run(thread_id, run) if run else None), None
+                run = stream.current_run or run
+                if run is None or run.status != "completed":
+                    if run is not None and run.status not in RUN_TERMINAL_STATUSES:
+                        return self._cancel_run(thread_id, run), None
+                    return run, None
+                final_messages = stream.get_final_messages()
+        except Exception:
+            if run is not None and run.status not in RUN_TERMINAL_STATUSES:
+                logger.error(f"Streaming assistant run {run.id} broke off; cancelling.")
+                self._cancel_run(thread_id, run)
+            raise
+        if not final_messages:
+            return run, None
+        return run, final_messages[-1].content[0].text.value
+
+    def _generate_template_text(self, prompt: str, context: Optional[str] = None) -> Optional[str]:
+        if self.knowledge_index:
+            return self._get_local_retrieval_response(prompt, "email_template", context=context)
+        # Templates are shared across contacts, so each gets a throwaway thread rather than a contact's
+        try:
+            thread = self.openai_client.beta.threads.create()
+        except Exception as e:
+            logger.error(f"Error creating OpenAI thread for template generation: {e}")
+            return None
+        try:
+            return self._get_assistant_response(prompt, thread.id, call_site="email_template")
+        finally:
+            self._discard_thread(thread.id)
+            self.thread_manager.forget(thread.id)
+
+    def get_or_create_thread_for_contact(self, contact: Contact, db_session: Session = None) -> Optional[str]:
+        if self.knowledge_index:
+            # Local retrieval keeps conversation history in ContentInfo, so no Assistants thread is needed
+            return contact.thread_id
+        cached_thread_id = self.thread_cache.get(contact.id)
+        if cached_thread_id:
+            return cached_thread_id
+        if contact.thread_id:
+            self.thread_cache.put(contact.id, contact.thread_id)
+            return contact.thread_id
 
-    def get_or_create_thread_for_contact(self, contact: Contact, db_session: Session = None) -> str:
-        # Helper function to check for existing thread
-        def check_existing_thread(db):
-            return db.query(ContentInfo).filter(
-                ContentInfo.contact_id == contact.id,
-                ContentInfo.thread_id.isnot(None)
-            ).first()
-        if db_session:
-            existing_content = check_existing_thread(db_session)
-        else:
-            with get_db_session() as db:
-                existing_content = check_existing_thread(db)
-        
-        if existing_content and existing_content.thread_id:
-            logger.info(f"Using existing thread {existing_content.thread_id} for contact {contact.email}")
-            return existing_content.thread_id
         try:
             thread = self.openai_client.beta.threads.create()
             new_thread_id = thread.id
@@ -120,53 +403,72 @@ class MailService:
         except Exception as e:
             logger.error(f"Error creating OpenAI thread for contact {contact.email}: {e}")
             return self.default_thread_id
-        
-        # Store thread in database
+
         try:
             if db_session:
-                existing = check_existing_thread(db_session)
-                if existing:
-                    logger.info(f"Thread already exists for contact {contact.email}, using {existing.thread_id}")
-                    return existing.thread_id
-                
-                new_content = ContentInfo(
-                    contact_id=contact.id,
-                    client_email=contact.email,
-                    thread_id=new_thread_id,
-                    email_type="thread_created",
-                    subject="Thread Created",
-                    body="Thread created for contact communication"
-                )
-                db_session.add(new_content)
+                thread_id = self._claim_thread_for_contact(db_session, contact, new_thread_id)
                 db_session.flush()  # Flush but don't commit - let caller handle commit
-                logger.info(f"Stored thread {new_thread_id} in database for contact {contact.email}")
-                return new_thread_id
             else:
                 with get_db_session() as db:
-                    existing = check_existing_thread(db)
-                    if existing:
-                        logger.info(f"Thread already exists for contact {contact.email}, using {existing.thread_id}")
-                        return existing.thread_id
-                    
-                    new_content = ContentInfo(
-                        contact_id=contact.id,
-                        client_email=contact.email,
-                        thread_id=new_thread_id,
-                        email_type="thread_created",
-                        subject="Thread Created",
-                        body="Thread created for contact communication"
-                    )
-                    db.add(new_content)
-                    db.commit()
-                    logger.info(f"Stored thread {new_thread_id} in database for contact {contact.email}")
-                    return new_thread_id
-                
+                    thread_id = self._claim_thread_for_contact(db, contact, new_thread_id)
         except Exception as e:
             logger.error(f"Error storing thread in database for contact {contact.email}: {e}")
             # Return the OpenAI thread ID anyway since it was created successfully
             return new_thread_id
 
+        if thread_id != new_thread_id:
+            logger.info(f"Thread already exists for contact {contact.email}, using {thread_id}")
+            self._discard_thread(new_thread_id)
+        else:
+            logger.info(f"Stored thread {new_thread_id} in database for contact {contact.email}")
+        set_committed_value(contact, "thread_id", thread_id)
+        self.thread_cache.put(contact.id, thread_id)
+        return thread_id
+
+    def _claim_thread_for_contact(self, db: Session, contact: Contact, new_thread_id: str) -> str:
+        # Conditional update: when two workers race, only the first write wins and the other adopts it
+        claimed = db.query(Contact).filter(
+            Contact.id == contact.id,
+            Contact.thread_id.is_(None)
+        ).update({Contact.thread_id: new_thread_id}, synchronize_session=False)
+        if claimed:
+            return new_thread_id
+        return db.query(Contact.thread_id).filter(Contact.id == contact.id).scalar() or new_thread_id
+
+    def _discard_thread(self, thread_id: str):
+        try:
+            self.openai_client.beta.threads.delete(thread_id)
+        except Exception as e:
+            logger.warning(f"Could not delete unused OpenAI thread {thread_id}: {e}")
+
+    def _add_to_contact_thread(self, contact: Contact, subject: str, body: str, db_session: Session = None):
+        """
+        Appends an email written outside the contact's thread (a template or a
+        batch draft) as an assistant message, so later runs on the thread know
+        it was sent. Local retrieval already reads history from ContentInfo.
+        """
+        if self.knowledge_index:
+            return
+        thread_id = self.get_or_create_thread_for_contact(contact, db_session)
+        if not thread_id or thread_id == self.default_thread_id:
+            return
+        try:
+            self.openai_client.beta.threads.messages.create(
+                thread_id=thread_id,
+                role="assistant",
+                content=f"Subject: {subject}\n\n{body}"
+            )
+        except Exception as e:
+            logger.warning(f"Could not add the email for {contact.email} to thread {thread_id}: {e}")
+
     def generate_initial_email_content(self, contact: Contact, db_session: Session = None) -> tuple[str, str]:
+        if self.templates.enabled:
+            rendered = self.templates.render_for_contact(contact, 0)
+            if rendered:
+                self._add_to_contact_thread(contact, *rendered, db_session)
+                return rendered
+            logger.warning(f"No template available for {contact.email}, generating individually")
+
         thread_id = self.get_or_create_thread_for_contact(contact, db_session)
         prompt = f"""
 Write the prompt for initial mail in your own way.
@@ -177,7 +479,7 @@ Your Actual Subject Line|||Your Full Email Body Here, Including the Signature
 """
     
         try:
-            content = self._get_assistant_response(prompt,thread_id)
+            content = self._get_assistant_response(prompt, thread_id, call_site="initial_email", contact=contact, context="initial outreach email")
             logger.debug(f"Raw AI response for {contact.email}: {content}")
         
             if not content:
@@ -212,13 +514,43 @@ Your Actual Subject Line|||Your Full Email Body Here, Including the Signature
                 f"Partnership opportunity for {contact.company_name}",
                 f"Hi {contact.name},\n\nI hope this email finds you well.\n\nBest regards,\n\nLokesh Garg\nBusiness Development Partner\nPulp Strategy\n+91 45289157"
             )
+    def _get_ready_drip_draft(self, contact: Contact, drip_number: int, db_session: Session = None) -> Optional[tuple[str, str]]:
+        def find_draft(db):
+            draft = db.query(DripDraft).filter(
+                DripDraft.contact_id == contact.id,
+                DripDraft.drip_number == drip_number,
+                DripDraft.status == "ready"
+            ).first()
+            return (draft.subject, draft.body) if draft else None
+        try:
+            if db_session:
+                return find_draft(db_session)
+            with get_db_session() as db:
+                return find_draft(db)
+        except Exception as e:
+            logger.error(f"Error looking up drip draft for {contact.email}: {e}")
+            return None
+
     def generate_drip_content(self, contact: Contact, drip_number: int, db_session: Session = None) -> tuple[str, str]:
+        draft = self._get_ready_drip_draft(contact, drip_number, db_session)
+        if draft:
+            logger.info(f"Using precomputed Drip {drip_number} draft for {contact.email}")
+            self._add_to_contact_thread(contact, *draft, db_session)
+            return draft
+
+        if self.templates.enabled:
+            rendered = self.templates.render_for_contact(contact, drip_number)
+            if rendered:
+                self._add_to_contact_thread(contact, *rendered, db_session)
+                return rendered
+            logger.warning(f"No drip {drip_number} template available for {contact.email}, generating individually")
+
         thread_id = self.get_or_create_thread_for_contact(contact, db_session)
         prompt = f"""
 Write the prompt for initial mail in your own way.
 Output Format:Provide your final, complete email output in this exact format, using "|||" as a separator. Do not include any other text before or after this structure. Do NOT include the word "Subject:" or any prefixes before the subject line.
     """
-        content = self._get_assistant_response(prompt,thread_id)
+        content = self._get_assistant_response(prompt, thread_id, call_site="drip_email", contact=contact, context=f"follow-up email {drip_number}")
         if not content:
             return "Failed to generate drip content", ""
 
@@ -317,7 +649,17 @@ Output Format:Provide your final, complete email output in this exact format, us
                in_reply_to: Optional[str] = None, 
                references: Optional[str] = None, 
                max_retries: int = 3) -> Optional[str]: # Return the new Message-ID
-    
+        # Replies may dip into the reserve that campaign sends leave free
+        kind = REPLY if in_reply_to else CAMPAIGN
+        try:
+            budget_slot = self.send_budget.reserve(kind)
+        except Exception as e:
+            logger.warning(f"Could not check send budget, sending anyway: {e}")
+            budget_slot = -1
+        if budget_slot is None:
+            logger.warning(f"Daily send budget for {self.email_address} is used up; not sending to {to_email}.")
+            return None
+
         for attempt in range(max_retries):
             try:
                 msg = MIMEMultipart('alternative')
@@ -348,62 +690,224 @@ Output Format:Provide your final, complete email output in this exact format, us
                 if html_content:
                     msg.attach(MIMEText(html_content, 'html'))
             
-                with smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=30) as server:
-                    server.starttls()
-                    server.login(self.email_address, self.email_password)
+                server = self.smtp_pool.acquire()
+                try:
                     server.send_message(msg)
+                except Exception:
+                    # Drop the session so the retry gets a fresh, re-authenticated connection
+                    self.smtp_pool.discard(server)
+                    raise
+                self.smtp_pool.release(server)
             
                 logger.info(f"Email sent successfully to {to_email}")
                 return new_message_id 
 
             except Exception as e:
                 logger.error(f"Failed to send email to {to_email} on attempt {attempt+1}: {str(e)}")
+                if is_quota_error(e):
+                    # Retrying cannot help until the provider's window rolls over
+                    self.send_budget.mark_exhausted()
+                    break
                 if attempt < max_retries - 1:
                     time.sleep(5 * (attempt + 1)) 
+        if budget_slot != -1:
+            self.send_budget.release(budget_slot)
         return None
 
-    def agent_3_reply_checking(self) -> List[email.message.Message]:
-        emails_to_process = []
+    def _get_sync_state(self, db: Session, mailbox: str) -> Optional[MailboxSyncState]:
+        return db.query(MailboxSyncState).filter(
+            MailboxSyncState.account == self.email_address,
+            MailboxSyncState.mailbox == mailbox
+        ).first()
+
+    def _save_sync_state(self, db: Session, mailbox: str, uidvalidity: int, last_uid: int) -> None:
+        state = self._get_sync_state(db, mailbox)
+        if state:
+            state.uidvalidity = uidvalidity
+            state.last_uid = last_uid
+        else:
+            db.add(MailboxSyncState(
+                account=self.email_address,
+                mailbox=mailbox,
+                uidvalidity=uidvalidity,
+                last_uid=last_uid
+            ))
+        db.flush()
+
+    def _search_new_uids(self, mail: imaplib.IMAP4, state: Optional[MailboxSyncState], uidvalidity: int) -> List[int]:
+        if state and state.uidvalidity == uidvalidity:
+            status, data = mail.uid('search', None, f'UID {state.last_uid + 1}:*')
+        else:
+            if state:
+                logger.warning(f"UIDVALIDITY changed ({state.uidvalidity} -> {uidvalidity}), running full resync.")
+            since_date = (datetime.now(self.timezone) - timedelta(days=1)).strftime("%d-%b-%Y")
+            status, data = mail.uid('search', None, f'(SINCE "{since_date}")')
+
+        if status != 'OK' or not data or not data[0]:
+            return []
+        uids = [int(uid) for uid in data[0].split()]
+        # "UID n:*" always matches the newest message, even when its UID is below n
+        if state and state.uidvalidity == uidvalidity:
+            uids = [uid for uid in uids if uid > state.last_uid]
+        return sorted(uids)
+
+    def _find_known_message_ids(self, db: Session, message_ids: set) -> set:
+        if not message_ids:
+            return set()
+        rows = db.query(ContentInfo.message_id).filter(ContentInfo.message_id.in_(message_ids)).all()
+        return {row[0] for row in rows}
+
+    def _find_contact_emails(self, db: Session, sender_emails: set) -> set:
+        if not sender_emails:
+            return set()
+        rows = db.query(Contact.email).filter(
+            Contact.mail_sent_status.isnot(None),
+            Contact.email.in_(sender_emails)
+        ).all()
+        return {row[0].lower().strip() for row in rows}
+
+    def _select_reply_candidates(self, mail: imaplib.IMAP4, uids: List[int], db: Session) -> Tuple[List[int], List[int]]:
+        """
+        Phase one: fetch only threading headers and keep UIDs from a contact or on one of our threads.
+        Returns the candidates and the UIDs whose headers could not be fetched.
+        """
+        header_parser = BytesHeaderParser()
+        candidates = []
+        unscanned = []
+        for i in range(0, len(uids), self.imap_fetch_batch_size):
+            batch = uids[i:i + self.imap_fetch_batch_size]
+            status, data = mail.uid('fetch', compress_uid_set(batch), f'(UID BODY.PEEK[HEADER.FIELDS ({REPLY_HEADER_FIELDS})])')
+            if status != 'OK':
+                logger.warning(f"Header fetch failed for UID batch starting at {batch[0]}")
+                unscanned.extend(batch)
+                continue
+
+            fetched = parse_uid_fetch_response(data)
+            unscanned.extend(uid for uid in batch if uid not in fetched)
+            batch_headers = {}
+            for uid, raw_headers in fetched.items():
+                headers = header_parser.parsebytes(raw_headers)
+                # Bounces come from the mailer daemon, so also match on the recipients they report as failed
+                batch_headers[uid] = (
+                    headers.get('Message-ID'),
+                    {parseaddr(headers.get('From', ''))[1].lower().strip()} | set(bounced_recipients(headers)),
+                    f"{headers.get('In-Reply-To', '')} {headers.get('References', '')}".split()
+                )
+
+            # Look up only the IDs and senders seen in this batch, so cost tracks the window, not history
+            lookup_ids = set()
+            for message_id, _, thread_ids in batch_headers.values():
+                if message_id:
+                    lookup_ids.add(message_id)
+                lookup_ids.update(thread_ids)
+            known_ids = self._find_known_message_ids(db, lookup_ids)
+            contact_emails = self._find_contact_emails(db, {address for _, addresses, _ in batch_headers.values() for address in addresses if address})
+
+            for uid, (message_id, addresses, thread_ids) in batch_headers.items():
+                if message_id in known_ids:
+                    continue
+                if addresses & contact_emails or any(ref in known_ids for ref in thread_ids):
+                    candidates.append(uid)
+
+        logger.info(f"Header scan kept {len(candidates)} of {len(uids)} messages for full fetch.")
+        return sorted(candidates), unscanned
+
+    def _fetch_full_messages(self, mail: imaplib.IMAP4, uids: List[int]) -> Dict[int, email.message.Message]:
+        """Phase two: download complete messages for the selected UIDs, one round trip per batch."""
+        messages = {}
+        for i in range(0, len(uids), self.imap_fetch_batch_size):
+            batch = uids[i:i + self.imap_fetch_batch_size]
+            status, data = mail.uid('fetch', compress_uid_set(batch), '(UID RFC822)')
+            if status != 'OK':
+                logger.warning(f"Body fetch failed for UID batch starting at {batch[0]}")
+                continue
+            fetched = parse_uid_fetch_response(data)
+            messages.update((uid, email.message_from_bytes(fetched[uid])) for uid in sorted(fetched))
+        return messages
+
+    def agent_3_reply_checking(self, mailbox: str = 'INBOX') -> Tuple[Dict[int, email.message.Message], Optional[Tuple[str, int, int]]]:
+        """
+        Returns the new replies keyed by UID and the (mailbox, uidvalidity, last_uid)
+        checkpoint they lead to. The checkpoint is not saved here; call
+        save_sync_checkpoint once the replies have been processed.
+        """
+        emails_to_process = {}
+        checkpoint = None
         with get_db_session() as db:
             try:
-                contacts_with_emails = db.query(Contact).filter(Contact.mail_sent_status.isnot(None)).all()
-                if not contacts_with_emails:
+                has_active_contacts = db.query(Contact.id).filter(Contact.mail_sent_status.isnot(None)).first()
+                if not has_active_contacts:
                     logger.info("No active contacts to check for replies.")
-                    return []
-                
-                contact_emails = {c.email.lower().strip() for c in contacts_with_emails}
-                processed_ids_query = db.query(ContentInfo.message_id).filter(ContentInfo.message_id.isnot(None)).all()
-                processed_ids = {pid[0] for pid in processed_ids_query}
+                    return {}, None
 
-                since_date = (datetime.now(self.timezone) - timedelta(days=1)).strftime("%d-%b-%Y")
-                
                 with imaplib.IMAP4_SSL(self.imap_server, self.imap_port) as mail:
                     mail.login(self.email_address, self.email_password)
-                    mail.select('INBOX')
-                    
-                    status, messages = mail.search(None, f'(SINCE "{since_date}")')
-                    if status != 'OK' or not messages[0]:
-                        logger.info(f"No new messages found since {since_date}.")
-                        return []
-
-                    for email_id in messages[0].split():
-                        _, msg_data = mail.fetch(email_id, '(RFC822)')
-                        email_message = email.message_from_bytes(msg_data[0][1])
-                        
+                    mail.select(mailbox)
+                    _, uidvalidity_data = mail.response('UIDVALIDITY')
+                    uidvalidity = int(uidvalidity_data[0])
+
+                    state = self._get_sync_state(db, mailbox)
+                    uids = self._search_new_uids(mail, state, uidvalidity)
+                    if not uids:
+                        logger.info(f"No new messages in {mailbox} since last sync.")
+                        return {}, None
+
+                    candidate_uids, unscanned = self._select_reply_candidates(mail, uids, db)
+                    for uid, email_message in self._fetch_full_messages(mail, candidate_uids).items():
                         sender_email = parseaddr(email_message['From'])[1].lower().strip()
                         message_id = email_message.get('Message-ID')
-
-                        if sender_email in contact_emails and message_id not in processed_ids:
-                            emails_to_process.append(email_message)
-                            logger.info(f"Found new reply from {sender_email} (ID: {message_id})")
+                        emails_to_process[uid] = email_message
+                        logger.info(f"Found new reply from {sender_email} (ID: {message_id})")
+
+                    # A failed header or body batch caps the checkpoint below it, so those messages are fetched again
+                    unfetched = unscanned + [uid for uid in candidate_uids if uid not in emails_to_process]
+                    last_uid = min(unfetched) - 1 if unfetched else uids[-1]
+                    if unfetched:
+                        logger.warning(f"{len(unfetched)} messages in {mailbox} could not be fetched; they will be retried.")
+                    last_uid = max(last_uid, state.last_uid if state and state.uidvalidity == uidvalidity else 0)
+                    checkpoint = (mailbox, uidvalidity, last_uid)
+                    logger.info(f"Fetched {len(uids)} new messages from {mailbox}, checkpoint pending at UID {last_uid}.")
 
             except Exception as e:
                 logger.error(f"Error in agent_3_reply_checking: {str(e)}")
         
-        return emails_to_process
+        return emails_to_process, checkpoint
+
+    def save_sync_checkpoint(self, checkpoint: Optional[Tuple[str, int, int]], failed_uids: Optional[set] = None):
+        """Moves the UID checkpoint forward, stopping short of the lowest UID that failed to process so it is fetched again."""
+        if not checkpoint:
+            return
+        mailbox, uidvalidity, last_uid = checkpoint
+        if failed_uids:
+            last_uid = min(last_uid, min(failed_uids) - 1)
+            logger.warning(f"{len(failed_uids)} replies failed to process; holding the {mailbox} checkpoint at UID {last_uid}.")
+        with get_db_session() as db:
+            state = self._get_sync_state(db, mailbox)
+            if state and state.uidvalidity == uidvalidity and state.last_uid >= last_uid:
+                return
+            self._save_sync_state(db, mailbox, uidvalidity, last_uid)
+        logger.info(f"Synced {mailbox}, checkpoint at UID {last_uid}.")
     
     
     def analyze_reply_sentiment(self, reply_body: str) -> tuple[str, dict]:
+        body_hash = reply_body_hash(reply_body)
+        cached = sentiment_cache.get(body_hash)
+        if cached:
+            logger.info("Reply sentiment served from cache")
+            return cached
+
+        try:
+            started = time.perf_counter()
+            sentiment, analysis = self._classify_reply_sentiment(reply_body)
+            sentiment_cache.record_llm_call(time.perf_counter() - started)
+        except Exception as e:
+            logger.error(f"Error analyzing sentiment and queries: {e}")
+            return "NEUTRAL", {'has_query': False, 'queries': None, 'stop_contact': False}
+
+        sentiment_cache.put(body_hash, sentiment, analysis)
+        return sentiment, analysis
+
+    def _classify_reply_sentiment(self, reply_body: str) -> tuple[str, dict]:
         prompt = f"""
 ## ROLE & GOAL
 You are an expert B2B communication analysis AI named 'The Classifier'. Your sole mission is to analyze an incoming email reply, classify its intent with extreme precision, and return a single, valid JSON object.
@@ -456,30 +960,30 @@ Your response MUST be a single, valid JSON object and nothing else. Adhere stric
 }}
 """
     
-        try:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini", 
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.2, 
-                response_format={"type": "json_object"}  
-            )
-        
-            analysis = json.loads(response.choices[0].message.content)
-            sentiment = analysis.get('sentiment', 'NEUTRAL')
-
-            return sentiment, {
-                'has_query': analysis.get('hasQuery', False),
-                'queries': analysis.get('queries') if analysis.get('queries') != 'none' else None,
-                'stop_contact': analysis.get('stopContact', False)
-            }
-        except Exception as e:
-            logger.error(f"Error analyzing sentiment and queries: {e}")
-            return "NEUTRAL", {'has_query': False, 'queries': None, 'stop_contact': False}
+        response = llm_metrics.chat_completion(
+            self.openai_client,
+            "reply_sentiment",
+            model="gpt-4o-mini", 
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.2, 
+            response_format={"type": "json_object"}  
+        )
+    
+        analysis = json.loads(response.choices[0].message.content)
+        sentiment = analysis.get('sentiment', 'NEUTRAL')
+
+        return sentiment, {
+            'has_query': analysis.get('hasQuery', False),
+            'queries': analysis.get('queries') if analysis.get('queries') != 'none' else None,
+            'stop_contact': analysis.get('stopContact', False)
+        }
 
     
-    def update_reply_status_and_check_sentiment(self, email_messages: List[email.message.Message]):
+    def update_reply_status_and_check_sentiment(self, email_messages: List[email.message.Message]) -> List[email.message.Message]:
+        """Processes each reply and returns the ones that failed, so the caller can fetch them again."""
+        failed = []
         if not email_messages:
-            return
+            return failed
 
         with get_db_session() as db:
             for msg in email_messages:
@@ -490,12 +994,32 @@ Your response MUST be a single, valid JSON object and nothing else. Adhere stric
                     
                     # Continue with normal reply processing
                     sender_email = parseaddr(msg['From'])[1].lower().strip()
-                    contact = db.query(Contact).filter(Contact.email == sender_email).first()
+                    clean_body = self._extract_main_reply(get_body_from_message(msg))
+                    # Classify first: a bounce comes from the mailer daemon, and belongs to the contact it failed to reach
+                    pre_classification = reply_pre_classifier.classify(msg, clean_body)
+                    if pre_classification and pre_classification.category == BOUNCE:
+                        recipients = bounced_recipients(msg)
+                        contact = db.query(Contact).filter(Contact.email.in_(recipients)).first() if recipients else None
+                    else:
+                        contact = db.query(Contact).filter(Contact.email == sender_email).first()
                     if not contact:
                         continue
 
-                    clean_body = self._extract_main_reply(get_body_from_message(msg))
-                    sentiment, analysis = self.analyze_reply_sentiment(clean_body)
+                    if pre_classification and pre_classification.category in (AUTO_REPLY, BOUNCE):
+                        # Record it so it is not fetched again, but leave the campaign state untouched
+                        db.add(ContentInfo(
+                        contact_id=contact.id, client_email=contact.email, email_type=pre_classification.category,
+                        subject=msg.get("Subject",""), body=clean_body, message_id=msg.get("Message-ID"), sentiment=pre_classification.sentiment
+                        ))
+                        db.commit()
+                        logger.info(f"Message from {sender_email} classified locally as {pre_classification.category}, no response sent.")
+                        continue
+
+                    if pre_classification:
+                        logger.info(f"Reply from {sender_email} classified locally: {pre_classification.reason}")
+                        sentiment, analysis = pre_classification.sentiment, pre_classification.analysis
+                    else:
+                        sentiment, analysis = self.analyze_reply_sentiment(clean_body)
 
                     db.add(ContentInfo(
                     contact_id=contact.id, client_email=contact.email, email_type="reply",
@@ -504,6 +1028,7 @@ Your response MUST be a single, valid JSON object and nothing else. Adhere stric
                     db.commit()
                     contact.status = "replied"
                     contact.mail_sent_status = 5
+                    contact.next_drip_at = None
                     
                     if analysis.get('stop_contact'):
                         contact.status = "do_not_contact"
@@ -537,8 +1062,10 @@ Your response MUST be a single, valid JSON object and nothing else. Adhere stric
                 except Exception as e:
                     logger.error(f"Error processing reply from {sender_email}: {str(e)}")
                     db.rollback()
+                    failed.append(msg)
         
             db.commit()
+        return failed
                 
     
     def generate_negative_response_with_query(self, contact: Contact, reply_body: str, queries: str) -> str:
@@ -582,7 +1109,7 @@ Your response MUST be a single, valid JSON object and nothing else. Adhere stric
 Write only the email body content. Do not include a subject line or a greeting. I will add those separately.
 """
         
-        response = self._get_assistant_response(prompt, thread_id)
+        response = self._get_assistant_response(prompt, thread_id, call_site="negative_reply", contact=contact, context=f"{queries} {reply_body}")
         if response:
             return response
         else:
@@ -631,7 +1158,7 @@ I appreciate your professionalism and wish you continued success with {contact.c
 Write only the email body content, no subject line needed. Don't include greeting, I will add it.
 """
         
-        response = self._get_assistant_response(prompt, thread_id)
+        response = self._get_assistant_response(prompt, thread_id, call_site="neutral_reply", contact=contact, context=queries)
         if response:
             return response
         else:
@@ -803,7 +1330,7 @@ Don't add anything regarding booking a call or meeting in the mail
 
 Write a reply for just these queries dont't send me the whole mail content. I will integrate this content in my mail body.
 """
-        response = self._get_assistant_response(prompt,thread_id)
+        response = self._get_assistant_response(prompt, thread_id, call_site="query_reply", contact=contact, context=queries)
         if response:
             return response
         else:
@@ -876,7 +1403,9 @@ Provide your response as a single string in this exact format: Subject Line|||Em
 """
         ai_response = None
         try:
-            response = self.openai_client.chat.completions.create(
+            response = llm_metrics.chat_completion(
+                self.openai_client,
+                "meeting_booking",
                 model="gpt-4o-mini",
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.3  
@@ -1053,9 +1582,18 @@ def send_drip_email(contact: Contact, drip_number: int, db: Session) -> bool:
         logger.error(f"Error in send_drip_email for {contact.email}: {e}")
     return False
 
+_reply_check_lock = threading.Lock()
+
+@llm_metrics.job("reply_checking")
 def check_and_update_replies():
-    new_email_messages = mail_service.agent_3_reply_checking()
-    if new_email_messages:
-        mail_service.update_reply_status_and_check_sentiment(new_email_messages)
-    return len(new_email_messages)
-     
+    # The IDLE listener and the polling job can fire together; serialise them on the sync checkpoint
+    with _reply_check_lock:
+        new_email_messages, checkpoint = mail_service.agent_3_reply_checking()
+        failed = mail_service.update_reply_status_and_check_sentiment(list(new_email_messages.values()))
+        failed_ids = {id(msg) for msg in failed}
+        # Only move past replies that were processed; anything that failed is fetched again next time
+        mail_service.save_sync_checkpoint(checkpoint, {uid for uid, msg in new_email_messages.items() if id(msg) in failed_ids})
+        return len(new_email_messages)
+
+def close_smtp_connections():
+    mail_service.smtp_pool.close_all()
@@ -0,0 +1,424 @@
+import os
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import hashlib
+import logging
+from collections import Counter
+from typing import Optional
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+COMPANY_ID_PATTERN = re.compile(r'"id":\s*(\d+)')
+SUBJECTS = [
+    "Quick idea for {topic}",
+    "A thought on growing {topic}",
+    "Following up on {topic}",
+    "Worth a short conversation?",
+]
+BODIES = [
+    "Hi there,\n\nI came across your team and had a few ideas on how we could help with {topic}. "
+    "Would you be open to a 15-minute call next week?\n\nBest regards,\nLokesh Garg",
+    "Hi there,\n\nWe have helped similar companies get more out of {topic} without adding headcount. "
+    "Happy to share a short case study if useful.\n\nBest regards,\nLokesh Garg",
+    "Hi there,\n\nJust following up on my earlier note about {topic}. "
+    "If the timing is not right, no worries at all.\n\nBest regards,\nLokesh Garg",
+]
+SENTIMENTS = ["POSITIVE", "NEUTRAL", "NEGATIVE"]
+
+def parse_latency_spec(spec: str):
+    """'fixed:0.5', 'uniform:0.2,1.5', 'normal:0.8,0.3' or 'lognormal:0.8,0.5' (median, sigma), in seconds."""
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",") if value.strip()]
+    kind = kind.strip().lower()
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda rng: rng.lognormvariate(0.0, sigma) * median
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+def stable_index(text: str, size: int, salt: str = "") -> int:
+    digest = hashlib.sha256(f"{salt}{text}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") % size
+
+class MockLLM:
+    """
+    OpenAI-compatible stand-in for load tests. Answers are keyed on a hash of
+    the prompt, so the same prompt always gets the same Subject|||Body, industry
+    or sentiment JSON; latency and injected failures come from a seeded RNG.
+    """
+
+    def __init__(self):
+        self.rng = random.Random(int(os.getenv("MOCK_LLM_SEED", "42")))
+        self.chat_latency = parse_latency_spec(os.getenv("MOCK_LLM_LATENCY", "lognormal:0.8,0.5"))
+        self.run_latency = parse_latency_spec(os.getenv("MOCK_LLM_RUN_LATENCY", "lognormal:4.0,0.5"))
+        self.batch_latency = parse_latency_spec(os.getenv("MOCK_LLM_BATCH_LATENCY", "fixed:5"))
+        self.error_rate = float(os.getenv("MOCK_LLM_ERROR_RATE", "0"))
+        self.rate_limit_rate = float(os.getenv("MOCK_LLM_RATE_LIMIT_RATE", "0"))
+        self.run_failure_rate = float(os.getenv("MOCK_LLM_RUN_FAILURE_RATE", "0"))
+        self.retry_after_ms = int(os.getenv("MOCK_LLM_RETRY_AFTER_MS", "500"))
+        self.model = os.getenv("MOCK_LLM_MODEL", "gpt-4o-mini")
+        self.counters = Counter()
+
+    def sample_chat_latency(self) -> float:
+        return self.chat_latency(self.rng)
+
+    def sample_run_latency(self) -> float:
+        return self.run_latency(self.rng)
+
+    def sample_batch_latency(self) -> float:
+        return self.batch_latency(self.rng)
+
+    def injected_error(self) -> Optional[JSONResponse]:
+        roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            self.counters["rate_limited"] += 1
+            return JSONResponse(
+                status_code=429,
+                headers={"retry-after-ms": str(self.retry_after_ms)},
+                content={"error": {"message": "Rate limit reached (injected)", "type": "requests", "code": "rate_limit_exceeded"}}
+            )
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.counters["server_errors"] += 1
+            return JSONResponse(
+                status_code=500,
+                content={"error": {"message": "Internal server error (injected)", "type": "server_error", "code": None}}
+            )
+        return None
+
+    def run_fails(self) -> bool:
+        return self.rng.random() < self.run_failure_rate
+
+    def answer(self, prompt: str, json_mode: bool = False) -> str:
+        if json_mode:
+            if "sentiment" in prompt.lower():
+                return self._sentiment(prompt)
+            company_ids = COMPANY_ID_PATTERN.findall(prompt)
+            industries = self._industry_options(prompt)
+            if company_ids and industries:
+                return json.dumps({"results": [
+                    {"id": int(company_id), "industry": industries[stable_index(company_id, len(industries), "industry")]}
+                    for company_id in company_ids
+                ]})
+            return "{}"
+
+        industries = self._industry_options(prompt)
+        if industries:
+            return industries[stable_index(prompt, len(industries))]
+        if "|||" in prompt:
+            topic = "your marketing"
+            subject = SUBJECTS[stable_index(prompt, len(SUBJECTS), "subject")].format(topic=topic)
+            body = BODIES[stable_index(prompt, len(BODIES), "body")].format(topic=topic)
+            return f"{subject}|||{body}"
+        return "The prospect received our initial outreach and one follow-up, and has not asked any questions yet."
+
+    def _industry_options(self, prompt: str) -> list:
+        if "Primary Industries:" not in prompt:
+            return []
+        listed = prompt.split("Primary Industries:", 1)[1]
+        options = []
+        for line in listed.splitlines():
+            line = line.strip()
+            if line.startswith("- "):
+                options.append(line[2:].split(" (")[0].strip())
+            elif options:
+                break
+        return [option for option in options if option != "Others"] or options
+
+    def _sentiment(self, prompt: str) -> str:
+        sentiment = SENTIMENTS[stable_index(prompt, len(SENTIMENTS), "sentiment")]
+        has_query = stable_index(prompt, 3, "query") == 0
+        return json.dumps({
+            "sentiment": sentiment,
+            "reasoning": f"Mock classification as {sentiment.lower()}.",
+            "hasQuery": has_query,
+            "queries": "What does your pricing look like?" if has_query else "none",
+            "stopContact": sentiment == "NEGATIVE" and stable_index(prompt, 4, "stop") == 0
+        })
+
+mock = MockLLM()
+app = FastAPI(title="Mock OpenAI API")
+threads = {}
+runs = {}
+files = {}
+batches = {}
+
+def _message_text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return "\n".join(part.get("text", "") for part in content or [] if isinstance(part, dict))
+
+def _usage(prompt: str, completion: str) -> dict:
+    prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(completion)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": 0}
+    }
+
+def _thread(thread_id: str) -> dict:
+    # Unknown ids (e.g. THREAD_ID from .env) are created on first use
+    return threads.setdefault(thread_id, {"id": thread_id, "created_at": int(time.time()), "messages": []})
+
+def _message(thread_id: str, role: str, text: str, run_id: Optional[str] = None) -> dict:
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "object": "thread.message",
+        "created_at": int(time.time()),
+        "thread_id": thread_id,
+        "role": role,
+        "run_id": run_id,
+        "assistant_id": None,
+        "attachments": [],
+        "metadata": {},
+        "content": [{"type": "text", "text": {"value": text, "annotations": []}}]
+    }
+
+def _run_view(run: dict) -> dict:
+    _advance_run(run)
+    return {key: value for key, value in run.items() if not key.startswith("_")}
+
+def _advance_run(run: dict):
+    if run["status"] not in ("queued", "in_progress"):
+        return
+    if time.monotonic() < run["_complete_at"]:
+        run["status"] = "in_progress"
+        return
+
+    thread = _thread(run["thread_id"])
+    if mock.run_fails():
+        mock.counters["runs_failed"] += 1
+        run["status"] = "failed"
+        run["failed_at"] = int(time.time())
+        run["last_error"] = {"code": "server_error", "message": "Run failed (injected)"}
+        return
+
+    prompt = next((m["content"][0]["text"]["value"] for m in reversed(thread["messages"]) if m["role"] == "user"), "")
+    context = "\n".join(m["content"][0]["text"]["value"] for m in thread["messages"])
+    answer = mock.answer(prompt)
+    thread["messages"].append(_message(run["thread_id"], "assistant", answer, run["id"]))
+    run["status"] = "completed"
+    run["completed_at"] = int(time.time())
+    run["usage"] = _usage(context, answer)
+    mock.counters["runs_completed"] += 1
+
+def _chat_completion(payload: dict) -> dict:
+    prompt = "\n".join(_message_text(message.get("content")) for message in payload.get("messages", []))
+    json_mode = (payload.get("response_format") or {}).get("type") == "json_object"
+    answer = mock.answer(prompt, json_mode=json_mode)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model") or mock.model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+        "usage": _usage(prompt, answer)
+    }
+
+def _file(content: bytes, filename: str, purpose: str) -> dict:
+    file_id = f"file-{uuid.uuid4().hex[:24]}"
+    files[file_id] = {
+        "id": file_id,
+        "object": "file",
+        "bytes": len(content),
+        "created_at": int(time.time()),
+        "filename": filename,
+        "purpose": purpose,
+        "status": "processed",
+        "_content": content
+    }
+    return files[file_id]
+
+def _batch_view(batch: dict) -> dict:
+    _advance_batch(batch)
+    return {key: value for key, value in batch.items() if not key.startswith("_")}
+
+def _advance_batch(batch: dict):
+    """Answers every request line of the input file once the sampled batch latency has passed."""
+    if batch["status"] not in ("validating", "in_progress"):
+        return
+    if time.monotonic() < batch["_complete_at"]:
+        batch["status"] = "in_progress"
+        return
+
+    output, failed = [], 0
+    for line in files[batch["input_file_id"]]["_content"].decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        if mock.rng.random() < mock.error_rate:
+            failed += 1
+            response = {"status_code": 500, "request_id": uuid.uuid4().hex, "body": {"error": {"message": "Internal server error (injected)"}}}
+        else:
+            response = {"status_code": 200, "request_id": uuid.uuid4().hex, "body": _chat_completion(request.get("body") or {})}
+        output.append(json.dumps({"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": request.get("custom_id"), "response": response, "error": None}))
+    batch["output_file_id"] = _file("\n".join(output).encode("utf-8"), "batch_output.jsonl", "batch_output")["id"]
+    batch["status"] = "completed"
+    batch["completed_at"] = int(time.time())
+    batch["request_counts"] = {"total": len(output), "completed": len(output) - failed, "failed": failed}
+    mock.counters["batch_requests"] += len(output)
+    mock.counters["batches_completed"] += 1
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    mock.counters["chat_completions"] += 1
+    await asyncio.sleep(mock.sample_chat_latency())
+    error = mock.injected_error()
+    if error:
+        return error
+    return _chat_completion(payload)
+
+@app.post("/v1/files")
+async def upload_file(request: Request):
+    form = await request.form()
+    upload = form["file"]
+    created = _file(await upload.read(), upload.filename or "upload.jsonl", form.get("purpose", "batch"))
+    return {key: value for key, value in created.items() if not key.startswith("_")}
+
+@app.get("/v1/files/{file_id}/content")
+async def file_content(file_id: str):
+    stored = files.get(file_id)
+    if not stored:
+        return JSONResponse(status_code=404, content={"error": {"message": f"No such File object: {file_id}", "type": "invalid_request_error", "code": None}})
+    return Response(content=stored["_content"], media_type="application/octet-stream")
+
+@app.post("/v1/batches")
+async def create_batch(request: Request):
+    payload = await request.json()
+    if payload.get("input_file_id") not in files:
+        return JSONResponse(status_code=400, content={"error": {"message": "Unknown input_file_id", "type": "invalid_request_error", "code": None}})
+    batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+    batches[batch_id] = {
+        "id": batch_id,
+        "object": "batch",
+        "endpoint": payload.get("endpoint"),
+        "input_file_id": payload["input_file_id"],
+        "completion_window": payload.get("completion_window", "24h"),
+        "status": "validating",
+        "created_at": int(time.time()),
+        "output_file_id": None,
+        "error_file_id": None,
+        "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        "metadata": payload.get("metadata"),
+        "_complete_at": time.monotonic() + mock.sample_batch_latency()
+    }
+    mock.counters["batches_created"] += 1
+    return _batch_view(batches[batch_id])
+
+@app.get("/v1/batches/{batch_id}")
+async def retrieve_batch(batch_id: str):
+    batch = batches.get(batch_id)
+    if not batch:
+        return JSONResponse(status_code=404, content={"error": {"message": f"No batch found with id '{batch_id}'", "type": "invalid_request_error", "code": None}})
+    return _batch_view(batch)
+
+@app.post("/v1/threads")
+async def create_thread(request: Request):
+    payload = await request.json() if await request.body() else {}
+    thread_id = f"thread_{uuid.uuid4().hex[:24]}"
+    thread = _thread(thread_id)
+    for message in payload.get("messages", []):
+        thread["messages"].append(_message(thread_id, message.get("role", "user"), _message_text(message.get("content"))))
+    return {"id": thread_id, "object": "thread", "created_at": thread["created_at"], "metadata": {}, "tool_resources": {}}
+
+@app.delete("/v1/threads/{thread_id}")
+async def delete_thread(thread_id: str):
+    threads.pop(thread_id, None)
+    return {"id": thread_id, "object": "thread.deleted", "deleted": True}
+
+@app.post("/v1/threads/{thread_id}/messages")
+async def create_message(thread_id: str, request: Request):
+    payload = await request.json()
+    message = _message(thread_id, payload.get("role", "user"), _message_text(payload.get("content")))
+    _thread(thread_id)["messages"].append(message)
+    return message
+
+@app.get("/v1/threads/{thread_id}/messages")
+async def list_messages(thread_id: str, order: str = "desc", limit: int = 20, run_id: Optional[str] = None):
+    messages = [m for m in _thread(thread_id)["messages"] if run_id is None or m["run_id"] == run_id]
+    if order == "desc":
+        messages = list(reversed(messages))
+    messages = messages[:limit]
+    return {
+        "object": "list",
+        "data": messages,
+        "first_id": messages[0]["id"] if messages else None,
+        "last_id": messages[-1]["id"] if messages else None,
+        "has_more": False
+    }
+
+@app.post("/v1/threads/{thread_id}/runs")
+async def create_run(thread_id: str, request: Request):
+    payload = await request.json()
+    if payload.get("stream"):
+        return JSONResponse(status_code=400, content={"error": {
+            "message": "The mock server does not stream runs; set ASSISTANT_RUN_STREAMING=false", "type": "invalid_request_error", "code": None
+        }})
+    error = mock.injected_error()
+    if error:
+        return error
+
+    _thread(thread_id)
+    run_id = f"run_{uuid.uuid4().hex[:24]}"
+    runs[run_id] = {
+        "id": run_id,
+        "object": "thread.run",
+        "created_at": int(time.time()),
+        "thread_id": thread_id,
+        "assistant_id": payload.get("assistant_id"),
+        "status": "queued",
+        "model": payload.get("model") or mock.model,
+        "instructions": "",
+        "tools": [],
+        "usage": None,
+        "last_error": None,
+        "truncation_strategy": payload.get("truncation_strategy"),
+        "max_prompt_tokens": payload.get("max_prompt_tokens"),
+        "_complete_at": time.monotonic() + mock.sample_run_latency()
+    }
+    mock.counters["runs_created"] += 1
+    return _run_view(runs[run_id])
+
+@app.get("/v1/threads/{thread_id}/runs/{run_id}")
+async def retrieve_run(thread_id: str, run_id: str):
+    run = runs.get(run_id)
+    if not run:
+        return JSONResponse(status_code=404, content={"error": {"message": f"No run found with id '{run_id}'", "type": "invalid_request_error", "code": None}})
+    return _run_view(run)
+
+@app.post("/v1/threads/{thread_id}/runs/{run_id}/cancel")
+async def cancel_run(thread_id: str, run_id: str):
+    run = runs.get(run_id)
+    if not run:
+        return JSONResponse(status_code=404, content={"error": {"message": f"No run found with id '{run_id}'", "type": "invalid_request_error", "code": None}})
+    if run["status"] in ("queued", "in_progress"):
+        run["status"] = "cancelled"
+        run["cancelled_at"] = int(time.time())
+    return _run_view(run)
+
+@app.get("/mock/stats")
+async def mock_stats():
+    return {"counters": dict(mock.counters), "threads": len(threads), "runs": len(runs), "batches": len(batches)}
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=os.getenv("MOCK_LLM_HOST", "127.0.0.1"), port=int(os.getenv("MOCK_LLM_PORT", "8100")))
@@ -0,0 +1,150 @@
+import re
+import email.message
+import logging
+from dataclasses import dataclass, field
+from email.utils import getaddresses, parseaddr
+from typing import List, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+AUTO_REPLY = "auto_reply"
+BOUNCE = "bounce"
+UNSUBSCRIBE = "unsubscribe"
+
+# Replies longer than this, or containing a question, go to the LLM even if a pattern matches
+MAX_CONFIDENT_BODY_LENGTH = 400
+
+BOUNCE_SENDER_PATTERN = re.compile(r"^(mailer-daemon|postmaster)@", re.IGNORECASE)
+BOUNCE_SUBJECT_PATTERN = re.compile(
+    r"delivery status notification|undeliverable|undelivered mail|mail delivery (failed|failure|subsystem)|returned mail|delivery failure",
+    re.IGNORECASE
+)
+AUTO_REPLY_SUBJECT_PATTERN = re.compile(
+    r"^\s*(automatic reply|auto[- ]?reply|autoreply|out of (the )?office|ooo\b|away from (the )?office|on vacation|on leave)",
+    re.IGNORECASE
+)
+AUTO_REPLY_BODY_PATTERN = re.compile(
+    r"\b(i am|i'm|i will be) (currently )?(out of (the )?office|away|on (annual |parental |maternity |paternity )?leave|on vacation|travell?ing)\b"
+    r"|\bwith limited access to (my )?e-?mail\b"
+    r"|\bthis is an automated (reply|response|message)\b",
+    re.IGNORECASE
+)
+# "remove me" and "take me off" only count when the object is our list or emails, not "the cc list"
+UNSUBSCRIBE_PATTERN = re.compile(
+    r"\bunsubscribe\b"
+    r"|\b(remove|take) (me|us) (off|from) (your|this|the) ((mailing|email|e-mail|contact|distribution) )?(list|database|emails|mailings)\b"
+    r"|\b(stop|quit|cease) (emailing|e-mailing|contacting|messaging|sending (me|us))\b"
+    r"|\b(do not|don't|dont|never) (email|e-mail|contact|message) (me|us)\b"
+    r"|\bopt(ing)? (me |us )?out\b",
+    re.IGNORECASE
+)
+# Negations in the same clause flip a stop phrase ("please don't unsubscribe me"); hedges anywhere in the
+# sentence make it conditional or about something else ("if you'd rather, I can unsubscribe")
+UNSUBSCRIBE_NEGATION_PATTERN = re.compile(
+    r"\b(not|no|don't|dont|do not|never|won't|wouldn't|shouldn't|didn't)\b",
+    re.IGNORECASE
+)
+UNSUBSCRIBE_HEDGE_PATTERN = re.compile(
+    r"\b(if|whether|rather|instead|unless|cc|loop|thread|invite)\b",
+    re.IGNORECASE
+)
+CLAUSE_BREAK_PATTERN = re.compile(r"[.,!\n;]")
+SENTENCE_BREAK_PATTERN = re.compile(r"[.!\n;]")
+
+@dataclass
+class PreClassification:
+    category: str
+    sentiment: str
+    analysis: dict = field(default_factory=lambda: {'has_query': False, 'queries': None, 'stop_contact': False})
+    reason: str = ""
+
+class ReplyPreClassifier:
+    """
+    Cheap local first pass over incoming replies. Bounces, auto-replies and
+    plain unsubscribe requests are decided from headers and compiled patterns;
+    anything it is not confident about returns None and goes to the LLM.
+
+    People write "I'm away this week, but yes" too, so subject and body
+    patterns only mark an auto-reply when the headers also say it was
+    generated. Stop phrases that are negated or qualified in their sentence
+    are left to the LLM.
+    """
+
+    def classify(self, msg: email.message.Message, clean_body: str) -> Optional[PreClassification]:
+        if self._is_bounce(msg):
+            return PreClassification(BOUNCE, "BOUNCE", reason="delivery status notification")
+
+        body = (clean_body or "").strip()
+        if self._has_auto_reply_headers(msg):
+            return PreClassification(AUTO_REPLY, "AUTO_REPLY", reason="auto-reply headers")
+        if self._has_bulk_headers(msg) and (
+            AUTO_REPLY_SUBJECT_PATTERN.search(msg.get("Subject", "") or "") or AUTO_REPLY_BODY_PATTERN.search(body)
+        ):
+            return PreClassification(AUTO_REPLY, "AUTO_REPLY", reason="bulk precedence with auto-reply text")
+
+        if not body or len(body) > MAX_CONFIDENT_BODY_LENGTH or "?" in body:
+            return None
+
+        if self._is_plain_stop_request(body):
+            return PreClassification(
+                UNSUBSCRIBE,
+                "NEGATIVE",
+                analysis={'has_query': False, 'queries': None, 'stop_contact': True},
+                reason="explicit stop request"
+            )
+
+        return None
+
+    def _is_plain_stop_request(self, body: str) -> bool:
+        matches = list(UNSUBSCRIBE_PATTERN.finditer(body))
+        if not matches:
+            return False
+        for match in matches:
+            clause = self._surrounding(body, match, CLAUSE_BREAK_PATTERN)
+            sentence = self._surrounding(body, match, SENTENCE_BREAK_PATTERN)
+            if UNSUBSCRIBE_NEGATION_PATTERN.search(clause) or UNSUBSCRIBE_HEDGE_PATTERN.search(sentence):
+                return False
+        return True
+
+    def _surrounding(self, body: str, match: re.Match, breaks: re.Pattern) -> str:
+        """The text around a match up to the nearest breaks, with the match itself blanked out."""
+        start = max((m.end() for m in breaks.finditer(body, 0, match.start())), default=0)
+        end = breaks.search(body, match.end())
+        return body[start:match.start()] + " " + body[match.end():end.start() if end else len(body)]
+
+    def _is_bounce(self, msg: email.message.Message) -> bool:
+        if msg.get_content_type() == "multipart/report":
+            return True
+        sender = parseaddr(msg.get("From", ""))[1]
+        if BOUNCE_SENDER_PATTERN.match(sender or ""):
+            return True
+        return bool(BOUNCE_SUBJECT_PATTERN.search(msg.get("Subject", "") or ""))
+
+    def _has_auto_reply_headers(self, msg: email.message.Message) -> bool:
+        auto_submitted = (msg.get("Auto-Submitted") or "").strip().lower()
+        if auto_submitted and auto_submitted != "no":
+            return True
+        if msg.get("X-Autoreply") or msg.get("X-Autorespond"):
+            return True
+        return (msg.get("Precedence") or "").strip().lower() == "auto_reply"
+
+    def _has_bulk_headers(self, msg: email.message.Message) -> bool:
+        # Mailing-list software sets these too, so they only count together with auto-reply text
+        return (msg.get("Precedence") or "").strip().lower() in ("bulk", "junk") or bool(msg.get("X-Auto-Response-Suppress"))
+
+def bounced_recipients(msg: email.message.Message) -> List[str]:
+    """Addresses a delivery status notification reports as failed, from X-Failed-Recipients or the message/delivery-status part."""
+    recipients = [address for _, address in getaddresses(msg.get_all("X-Failed-Recipients", []))]
+    for part in msg.walk():
+        if part.get_content_type() != "message/delivery-status":
+            continue
+        # The payload is a list of header blocks: one per message, then one per recipient
+        for block in part.get_payload() or []:
+            for header in ("Final-Recipient", "Original-Recipient"):
+                value = block.get(header, "") if hasattr(block, "get") else ""
+                if ";" in value:
+                    recipients.append(value.split(";", 1)[1].strip())
+    return sorted({address.lower().strip().strip("<>") for address in recipients if address and "@" in address})
+
+reply_pre_classifier = ReplyPreClassifier()
@@ -0,0 +1,148 @@
+import os
+import re
+import threading
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from dotenv import load_dotenv
+from tables import SendLogEntry, SendQuotaState, get_db_session
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WINDOW = timedelta(hours=24)
+CAMPAIGN = "campaign"
+REPLY = "reply"
+# e.g. Gmail's "550 5.4.5 Daily user sending limit exceeded"
+QUOTA_ERROR_PATTERN = re.compile(r"5\.4\.5|daily (user )?sending (quota|limit)|sending (quota|limit) exceeded", re.IGNORECASE)
+
+def is_quota_error(error: Exception) -> bool:
+    return bool(QUOTA_ERROR_PATTERN.search(str(error)))
+
+class SendBudget:
+    """
+    Rolling 24h send budget for one mailbox, persisted in send_log so every
+    worker sending as the account shares it. Campaign sends stop
+    REPLY_SEND_RESERVE short of DAILY_SEND_LIMIT, which keeps room to answer
+    replies. A send reserves its slot before going out and gives it back if
+    it fails. When the provider itself refuses a send for quota, the pause is
+    stored in send_quota_state, so it holds for every worker and across
+    restarts.
+    """
+
+    def __init__(self, account: Optional[str]):
+        self.account = account or ""
+        self.daily_limit = int(os.getenv("DAILY_SEND_LIMIT", "500"))
+        self.reply_reserve = int(os.getenv("REPLY_SEND_RESERVE", "25"))
+        self._exhausted_until: Optional[datetime] = None
+        self._lock = threading.Lock()
+
+    def limit_for(self, kind: str) -> int:
+        return self.daily_limit if kind == REPLY else max(self.daily_limit - self.reply_reserve, 0)
+
+    def remaining(self, kind: str = CAMPAIGN) -> int:
+        with get_db_session() as db:
+            if self._provider_exhausted(db):
+                return 0
+            used = self._used(db, datetime.utcnow())
+        return max(self.limit_for(kind) - used, 0)
+
+    def reserve(self, kind: str = CAMPAIGN) -> Optional[int]:
+        """Records a send slot and returns its id, or None if the budget for this kind is used up."""
+        now = datetime.utcnow()
+        with get_db_session() as db:
+            if self._provider_exhausted(db):
+                return None
+            entry = SendLogEntry(account=self.account, kind=kind, sent_at=now)
+            db.add(entry)
+            db.flush()
+            entry_id = entry.id
+            db.commit()
+            # Count only slots reserved before ours, so concurrent workers agree on who is over the limit
+            position = db.query(func.count(SendLogEntry.id)).filter(
+                SendLogEntry.account == self.account,
+                SendLogEntry.sent_at > now - WINDOW,
+                SendLogEntry.id <= entry_id
+            ).scalar()
+            if position > self.limit_for(kind):
+                db.query(SendLogEntry).filter(SendLogEntry.id == entry_id).delete(synchronize_session=False)
+                return None
+            return entry_id
+
+    def release(self, entry_id: int):
+        """Gives back a reserved slot whose send failed."""
+        try:
+            with get_db_session() as db:
+                db.query(SendLogEntry).filter(SendLogEntry.id == entry_id).delete(synchronize_session=False)
+        except Exception as e:
+            logger.warning(f"Could not release send budget slot {entry_id}: {e}")
+
+    def mark_exhausted(self):
+        """The provider refused a send for quota; hold off until the oldest send in the window ages out."""
+        now = datetime.utcnow()
+        with get_db_session() as db:
+            oldest = db.query(func.min(SendLogEntry.sent_at)).filter(
+                SendLogEntry.account == self.account,
+                SendLogEntry.sent_at > now - WINDOW
+            ).scalar()
+        until = (oldest or now) + WINDOW
+        with self._lock:
+            self._exhausted_until = until
+        try:
+            with get_db_session() as db:
+                state = db.query(SendQuotaState).filter(SendQuotaState.account == self.account).first()
+                if not state:
+                    state = SendQuotaState(account=self.account)
+                    db.add(state)
+                    try:
+                        db.flush()
+                    except IntegrityError:
+                        db.rollback()
+                        state = db.query(SendQuotaState).filter(SendQuotaState.account == self.account).first()
+                state.exhausted_until = max(until, state.exhausted_until or until)
+        except Exception as e:
+            logger.warning(f"Could not store the exhausted quota for {self.account}; only this process will pause: {e}")
+        logger.error(f"Provider reports the sending quota for {self.account} is exhausted; pausing sends until {until} UTC.")
+
+    def prune(self):
+        with get_db_session() as db:
+            db.query(SendLogEntry).filter(
+                SendLogEntry.sent_at < datetime.utcnow() - 2 * WINDOW
+            ).delete(synchronize_session=False)
+
+    def status(self) -> dict:
+        with get_db_session() as db:
+            used = self._used(db, datetime.utcnow())
+            exhausted = self._provider_exhausted(db)
+        return {
+            "account": self.account,
+            "daily_limit": self.daily_limit,
+            "reply_reserve": self.reply_reserve,
+            "used_last_24h": used,
+            "campaign_remaining": self.remaining(CAMPAIGN),
+            "reply_remaining": self.remaining(REPLY),
+            "provider_exhausted_until": self._exhausted_until.isoformat() if exhausted else None
+        }
+
+    def _used(self, db, now: datetime) -> int:
+        return db.query(func.count(SendLogEntry.id)).filter(
+            SendLogEntry.account == self.account,
+            SendLogEntry.sent_at > now - WINDOW
+        ).scalar() or 0
+
+    def _provider_exhausted(self, db) -> bool:
+        """Checks the stored pause, which another worker may have set, and caches it in this process."""
+        now = datetime.utcnow()
+        with self._lock:
+            if self._exhausted_until is not None and now < self._exhausted_until:
+                return True
+        until = db.query(SendQuotaState.exhausted_until).filter(SendQuotaState.account == self.account).scalar()
+        if until is None or now >= until:
+            return False
+        with self._lock:
+            self._exhausted_until = until
+        return True
@@ -0,0 +1,228 @@
+import asyncio
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from typing import Awaitable, Callable, Optional, Tuple
+from sqlalchemy import func
+from dotenv import load_dotenv
+from tables import Contact, ContentInfo, get_db_session
+from drip_logic import company_website, drip_manager
+from mail_service import mail_service
+from llm_pool import llm_pool
+from llm_metrics import llm_metrics
+from send_scheduler import send_rate_scheduler
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class SendEngine:
+    """
+    Runs the daily campaigns with bounded concurrency.
+
+    Each contact is handled by one coroutine that generates, sends and records
+    in order, so a contact never has two emails in flight. Generation is
+    submitted to the shared LLM pool; SMTP sends run on a local thread pool
+    gated by a semaphore.
+    """
+
+    def __init__(self, max_smtp_sends: Optional[int] = None):
+        self.max_smtp_sends = max_smtp_sends or int(os.getenv("SEND_ENGINE_SMTP_CONCURRENCY", "3"))
+
+    @llm_metrics.job("initial_emails")
+    def run_initial_emails(self) -> dict:
+        summary = {"total": 0, "sent": 0, "failed": 0}
+        # Send and finish each chunk before fetching the next page, so memory tracks the chunk size, not the backlog
+        for db, contacts in drip_manager.iter_contact_chunks(drip_manager.new_contacts):
+            budget = mail_service.send_budget.remaining()
+            if budget <= 0:
+                logger.warning("Daily send budget used up; remaining initial emails are deferred to the next run.")
+                break
+            drip_manager.fill_missing_industries(contacts)
+            contact_ids = [contact.id for contact in contacts]
+            # Commit the classified industries so the generating sessions see them
+            db.commit()
+            if len(contact_ids) > budget:
+                logger.warning(f"Daily send budget allows {budget} more sends; deferring {len(contact_ids) - budget} initial emails.")
+                contact_ids = contact_ids[:budget]
+            chunk_summary = asyncio.run(self._run([(contact_id, 0) for contact_id in contact_ids]))
+            for key in summary:
+                summary[key] += chunk_summary[key]
+        logger.info(f"Initial email run finished: {summary}")
+        return summary
+
+    @llm_metrics.job("selected_initial_emails")
+    def run_selected_initial_emails(self, contact_ids: list) -> dict:
+        """Initial emails for contacts picked in the UI, generated and sent like the scheduled run."""
+        with get_db_session() as db:
+            # Classify missing industries in batches before generating
+            unclassified = db.query(Contact).filter(
+                Contact.id.in_(contact_ids),
+                Contact.mail_sent_status.is_(None),
+                Contact.industry.is_(None)
+            ).all()
+            if drip_manager.fill_missing_industries(unclassified):
+                db.commit()
+        budget = mail_service.send_budget.remaining()
+        if len(contact_ids) > budget:
+            logger.warning(f"Daily send budget allows {budget} more sends; deferring {len(contact_ids) - budget} selected initial emails.")
+            contact_ids = contact_ids[:max(budget, 0)]
+        summary = asyncio.run(self._run([(contact_id, 0) for contact_id in contact_ids]))
+        logger.info(f"Selected initial emails finished: {summary}")
+        return summary
+
+    @llm_metrics.job("drips")
+    def run_drips(self) -> dict:
+        now = datetime.now(ZoneInfo("Asia/Kolkata"))
+        summary = {"total": 0, "sent": 0, "failed": 0}
+        with get_db_session() as db:
+            due = drip_manager.due_contacts(db, now, func.count(Contact.id)).scalar() or 0
+        mail_service.send_budget.prune()
+        budget = mail_service.send_budget.remaining()
+        if due > budget:
+            logger.warning(f"{due} drips are due but the daily send budget allows {budget}; deferring {due - budget} to the next run.")
+        # Pace only what the budget lets through, so the rate is not planned for sends that will never happen
+        bucket = send_rate_scheduler.plan(min(due, budget), now)
+        pace = bucket.acquire if bucket else None
+
+        # Each round claims a leased batch, so concurrent workers never pick up the same contact
+        while True:
+            if send_rate_scheduler.window_closed(datetime.now(ZoneInfo("Asia/Kolkata"))):
+                logger.warning("Send window closed; drips still due carry over to the next run.")
+                break
+            budget = mail_service.send_budget.remaining()
+            if budget <= 0:
+                logger.warning("Daily send budget used up; drips still due carry over to the next run.")
+                break
+            limit = min(send_rate_scheduler.claim_limit(drip_manager.claim_batch_size, drip_manager.lease_seconds), budget)
+            contact_ids = drip_manager.claim_due_contacts(now, limit)
+            if not contact_ids:
+                break
+            with get_db_session() as db:
+                statuses = db.query(Contact.id, Contact.mail_sent_status).filter(Contact.id.in_(contact_ids)).all()
+            jobs = [
+                (contact_id, drip_manager.pending_drip_number(mail_sent_status))
+                for contact_id, mail_sent_status in statuses
+                if drip_manager.pending_drip_number(mail_sent_status) > 0
+            ]
+            skipped = set(contact_ids) - {contact_id for contact_id, _ in jobs}
+            if skipped:
+                with get_db_session() as db:
+                    for contact_id in skipped:
+                        drip_manager.release_lease(db, contact_id)
+            batch_summary = asyncio.run(self._run(jobs, pace))
+            for key in summary:
+                summary[key] += batch_summary[key]
+            send_rate_scheduler.record_progress(len(contact_ids), batch_summary["failed"])
+        logger.info(f"Drip run finished: {summary}")
+        return summary
+
+    async def _run(self, jobs: list, pace: Optional[Callable[[], Awaitable[None]]] = None) -> dict:
+        summary = {"total": len(jobs), "sent": 0, "failed": 0}
+        if not jobs:
+            return summary
+
+        loop = asyncio.get_running_loop()
+        smtp_slots = asyncio.Semaphore(self.max_smtp_sends)
+
+        with ThreadPoolExecutor(max_workers=self.max_smtp_sends + 1) as executor:
+            async def attempt(contact_id: int, drip_number: int) -> Optional[bool]:
+                """True once sent and recorded, False if nothing went out, None if sent but not recorded."""
+                try:
+                    # Pace before generating so the LLM calls are spread out along with the sends
+                    if pace:
+                        await pace()
+                    generated = await asyncio.wrap_future(llm_pool.submit(self._generate, contact_id, drip_number))
+                    if not generated:
+                        return False
+                    to_email, subject, content = generated
+
+                    async with smtp_slots:
+                        message_id = await loop.run_in_executor(
+                            executor, lambda: mail_service.send_email(to_email=to_email, subject=subject, content=content)
+                        )
+                    if not message_id:
+                        logger.error(f"Failed to send {self._label(drip_number)} to {to_email}")
+                        return False
+
+                    try:
+                        return await loop.run_in_executor(
+                            executor, self._record, contact_id, drip_number, subject, content, message_id
+                        )
+                    except Exception as e:
+                        logger.error(f"{self._label(drip_number)} to {to_email} was sent but not recorded: {str(e)}")
+                        return None
+                except Exception as e:
+                    logger.error(f"A critical error occurred while processing contact {contact_id}: {str(e)}")
+                    return False
+
+            async def process(contact_id: int, drip_number: int) -> bool:
+                sent = await attempt(contact_id, drip_number)
+                if sent is False:
+                    # Hand the contact back now instead of leaving it leased until the lease runs out.
+                    # A send that went out but was not recorded keeps its lease, so it is not retried sooner.
+                    await loop.run_in_executor(executor, self._release, contact_id, drip_number)
+                return bool(sent)
+
+            results = await asyncio.gather(*(process(contact_id, drip_number) for contact_id, drip_number in jobs))
+
+        summary["sent"] = sum(1 for sent in results if sent)
+        summary["failed"] = summary["total"] - summary["sent"]
+        return summary
+
+    def _label(self, drip_number: int) -> str:
+        return "initial email" if drip_number == 0 else f"Drip {drip_number}"
+
+    def _generate(self, contact_id: int, drip_number: int) -> Optional[Tuple[str, str, str]]:
+        with get_db_session() as db:
+            if drip_number > 0 and not drip_manager.renew_lease(db, contact_id):
+                logger.warning(f"Drip lease on contact {contact_id} was reclaimed by another worker, skipping.")
+                return None
+            contact = db.query(Contact).filter(Contact.id == contact_id).first()
+            if not contact:
+                return None
+
+            if drip_number == 0:
+                if not contact.industry:
+                    if not (contact.company_name or company_website(contact)):
+                        logger.warning(f"Skipping {contact.email}: Missing company details to generate industry.")
+                    else:
+                        logger.error(f"Failed to generate industry for {contact.email}, skipping.")
+                    return None
+                if not drip_manager.claim_initial(db, contact_id):
+                    logger.info(f"Skipping {contact.email}: initial email already sent or claimed by another node.")
+                    return None
+                subject, content = mail_service.generate_initial_email_content(contact, db)
+            else:
+                subject, content = mail_service.generate_drip_content(contact, drip_number, db)
+
+            return contact.email, subject, content
+
+    def _release(self, contact_id: int, drip_number: int):
+        with get_db_session() as db:
+            drip_manager.release_lease(db, contact_id, retry_drip=drip_number > 0)
+
+    def _record(self, contact_id: int, drip_number: int, subject: str, content: str, message_id: str) -> bool:
+        now = datetime.now(ZoneInfo("Asia/Kolkata"))
+        with get_db_session() as db:
+            contact = db.query(Contact).filter(Contact.id == contact_id).with_for_update().first()
+            to_email = contact.email
+            db.add(ContentInfo(
+                contact_id=contact.id,
+                client_email=contact.email,
+                email_type="initial" if drip_number == 0 else f"drip_{drip_number}",
+                subject=subject,
+                body=content,
+                message_id=message_id
+            ))
+            if drip_number == 0:
+                drip_manager.mark_initial_sent(contact, now)
+            else:
+                drip_manager.mark_drip_sent(contact, drip_number, now)
+        logger.info(f"Successfully sent {self._label(drip_number)} to {to_email}")
+        return True
+
+send_engine = SendEngine()
@@ -0,0 +1,140 @@
+import os
+import time
+import asyncio
+import threading
+import logging
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from typing import Optional
+from dotenv import load_dotenv
+from sharding import shard_assignment
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _parse_clock(value: str) -> tuple:
+    hour, minute = value.split(":")
+    return int(hour), int(minute)
+
+class TokenBucket:
+    """Token bucket that hands out reservations: each acquire waits until its token would be available."""
+
+    def __init__(self, rate_per_second: float, capacity: int):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Takes a token, possibly on credit, and returns how many seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class SendRateScheduler:
+    """
+    Spreads the day's due drips evenly across a send window instead of firing
+    them all at once. At the start of a run the rate is set so the due count
+    finishes by SEND_WINDOW_END. It is capped so that no hour exceeds
+    SMTP_HOURLY_QUOTA, which is split across shards. Whatever is still due when
+    the window closes carries over to the next run.
+
+    Off by default. When on, a node sends at most (SMTP_HOURLY_QUOTA / shards
+    - SEND_BURST) drips per window hour, about 776 a day with the defaults,
+    and the paced run holds a scheduler thread until the window closes.
+    """
+
+    def __init__(self):
+        self.timezone = ZoneInfo("Asia/Kolkata")
+        self.enabled = os.getenv("SEND_SMOOTHING_ENABLED", "false").lower() == "true"
+        self.window_start = _parse_clock(os.getenv("SEND_WINDOW_START", "10:00"))
+        self.window_end = _parse_clock(os.getenv("SEND_WINDOW_END", "18:00"))
+        self.hourly_quota = int(os.getenv("SMTP_HOURLY_QUOTA", "100"))
+        self.burst = max(1, int(os.getenv("SEND_BURST", "3")))
+        self._lock = threading.Lock()
+        self._plan = None
+
+    def plan(self, due: int, now: datetime) -> Optional[TokenBucket]:
+        if not self.enabled or due <= 0:
+            with self._lock:
+                self._plan = None
+            return None
+
+        max_rate = self.max_rate_per_second()
+        window_seconds = max((self.window_closes_at(now) - now).total_seconds(), 0)
+        needed_rate = due / window_seconds if window_seconds else max_rate
+        rate = min(needed_rate, max_rate)
+        with self._lock:
+            self._plan = {"started_at": now, "due": due, "processed": 0, "failed": 0, "rate_per_second": rate}
+        projected = self.projected_completion()
+        if projected and projected > self.window_closes_at(now):
+            logger.warning(f"{due} due drips exceed the hourly quota before the window closes; the rest carries over.")
+        logger.info(f"Pacing {due} drips at {rate * 3600:.0f}/hour, projected to finish at {projected}.")
+        return TokenBucket(rate, min(self.burst, max(1, due)))
+
+    def max_rate_per_second(self) -> float:
+        # Bucket capacity can add a burst on top of the steady rate, so leave room for it inside the hour
+        per_node_quota = self.hourly_quota / max(1, shard_assignment.shard_count())
+        return max(per_node_quota - self.burst, 1) / 3600
+
+    def window_closes_at(self, now: datetime) -> datetime:
+        local_now = now.astimezone(self.timezone)
+        hour, minute = self.window_end
+        return local_now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+    def window_closed(self, now: datetime) -> bool:
+        return self.enabled and now.astimezone(self.timezone) >= self.window_closes_at(now)
+
+    def claim_limit(self, default: int, lease_seconds: int) -> int:
+        """Claims no more than can be sent within half a lease at the current rate, so leases do not lapse while queued."""
+        with self._lock:
+            if not self._plan:
+                return default
+            paced = int(self._plan["rate_per_second"] * lease_seconds / 2)
+        return max(1, min(default, paced))
+
+    def record_progress(self, processed: int, failed: int):
+        with self._lock:
+            if self._plan:
+                self._plan["processed"] += processed
+                self._plan["failed"] += failed
+
+    def projected_completion(self) -> Optional[datetime]:
+        with self._lock:
+            if not self._plan:
+                return None
+            remaining = max(self._plan["due"] - self._plan["processed"], 0)
+            rate = self._plan["rate_per_second"]
+        return datetime.now(self.timezone) + timedelta(seconds=remaining / rate)
+
+    def status(self) -> dict:
+        projected = self.projected_completion()
+        with self._lock:
+            plan = dict(self._plan) if self._plan else None
+        return {
+            "enabled": self.enabled,
+            "window": f"{self.window_start[0]:02d}:{self.window_start[1]:02d}-{self.window_end[0]:02d}:{self.window_end[1]:02d} Asia/Kolkata",
+            "hourly_quota": self.hourly_quota,
+            "max_rate_per_hour": round(self.max_rate_per_second() * 3600),
+            "current_run": {
+                "started_at": plan["started_at"].isoformat(),
+                "due": plan["due"],
+                "processed": plan["processed"],
+                "failed": plan["failed"],
+                "rate_per_hour": round(plan["rate_per_second"] * 3600, 1),
+                "projected_completion": projected.isoformat() if projected else None
+            } if plan else None
+        }
+
+send_rate_scheduler = SendRateScheduler()
@@ -0,0 +1,105 @@
+import os
+import time
+import threading
+import logging
+from sqlalchemy import false, func, or_
+from dotenv import load_dotenv
+from tables import Contact, ShardConfig, get_db_session
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SHARD_KEYS = ("id", "domain")
+
+class ShardAssignment:
+    """
+    Splits contacts across campaign nodes by Contact.id or by email domain
+    (CRC32 of the domain, computed from Contact.email in the query so raw
+    inserts and edited emails can't leave a stale hash), filtered in SQL so
+    nodes never talk to each other while sending. SHARD_INDEX is this node's shard; the shard count lives in
+    shard_config so it can be changed for every node at once.
+
+    Rebalancing: call rebalance(new_count), then start nodes for any new
+    indexes. Nodes pick up the new count at the start of their next run.
+    While old and new counts overlap, a contact can fall in two nodes' shards.
+    The drip lease and the initial-email claim still let only one of them send.
+    Contacts that fall in nobody's shard for a run are picked up on the next one.
+    """
+
+    def __init__(self):
+        self.key = os.getenv("SHARD_KEY", "id").lower()
+        if self.key not in SHARD_KEYS:
+            raise ValueError(f"SHARD_KEY must be one of {SHARD_KEYS}, got {self.key!r}")
+        self.index = int(os.getenv("SHARD_INDEX", "0"))
+        self.default_count = int(os.getenv("SHARD_COUNT", "1"))
+        self.refresh_seconds = int(os.getenv("SHARD_CONFIG_REFRESH_SECONDS", "60"))
+        self._count = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def shard_count(self) -> int:
+        with self._lock:
+            if self._count is None or time.monotonic() - self._loaded_at >= self.refresh_seconds:
+                self._count = self._load_count()
+                self._loaded_at = time.monotonic()
+            return self._count
+
+    def apply(self, query):
+        """Restricts a Contact query to this node's shard."""
+        count = self.shard_count()
+        if count <= 1:
+            return query
+        if self.index >= count:
+            logger.warning(f"SHARD_INDEX {self.index} is outside shard count {count}; this node has no contacts.")
+            return query.filter(false())
+        return query.filter(self._shard_expression(count) == self.index)
+
+    def rebalance(self, new_count: int) -> dict:
+        if new_count < 1:
+            raise ValueError("Shard count must be at least 1")
+        with get_db_session() as db:
+            config = db.query(ShardConfig).order_by(ShardConfig.id).first()
+            previous = config.shard_count if config else self.default_count
+            if config:
+                config.shard_count = new_count
+            else:
+                db.add(ShardConfig(shard_count=new_count))
+        with self._lock:
+            self._count = new_count
+            self._loaded_at = time.monotonic()
+        logger.info(f"Shard count changed from {previous} to {new_count}.")
+        return {"previous_shard_count": previous, "shard_count": new_count, "distribution": self.distribution()}
+
+    def distribution(self) -> dict:
+        """Contacts still in a campaign per shard under the current count."""
+        count = self.shard_count()
+        with get_db_session() as db:
+            rows = db.query(self._shard_expression(count), func.count(Contact.id)).filter(
+                or_(Contact.mail_sent_status.is_(None), Contact.next_drip_at.isnot(None))
+            ).group_by(self._shard_expression(count)).all()
+        return {
+            "shard_key": self.key,
+            "shard_count": count,
+            "this_node": self.index,
+            "active_contacts_by_shard": {int(shard): contacts for shard, contacts in rows if shard is not None}
+        }
+
+    def _shard_expression(self, count: int):
+        if self.key == "id":
+            return Contact.id % count
+        # A contact without an email has a NULL hash; it goes to shard 0 rather than to no shard
+        domain_hash = func.crc32(func.lower(func.trim(func.substring_index(Contact.email, "@", -1))))
+        return func.coalesce(domain_hash % count, 0)
+
+    def _load_count(self) -> int:
+        try:
+            with get_db_session() as db:
+                count = db.query(ShardConfig.shard_count).order_by(ShardConfig.id).limit(1).scalar()
+            return count or self.default_count
+        except Exception as e:
+            logger.warning(f"Could not read shard config, using SHARD_COUNT={self.default_count}: {e}")
+            return self.default_count
+
+shard_assignment = ShardAssignment()
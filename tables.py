@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import create_engine, inspect, text, Column, Integer, BigInteger, Boolean, Float, String, Text, Date, DateTime, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -32,6 +32,7 @@ class EmailData(Base):
 
 class Contact(Base):
     __tablename__ = "first"
+    __table_args__ = (Index("ix_first_next_drip_at_status", "next_drip_at", "status"),)
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False)
@@ -47,6 +48,10 @@ class Contact(Base):
     drip3_date = Column(DateTime)
     mail_sent_status = Column(String(50)) 
     first_mail_date = Column(DateTime)  
+    thread_id = Column(String(255), nullable=True)
+    next_drip_at = Column(DateTime, nullable=True)
+    lease_owner = Column(String(64), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     content_info = relationship("ContentInfo", back_populates="contact", cascade="all, delete-orphan")
@@ -61,7 +66,7 @@ class ContentInfo(Base):
     subject = Column(Text)
     body = Column(Text(6000))
     thread_id = Column(String(255))
-    message_id = Column(String(255), nullable=True)
+    message_id = Column(String(255), nullable=True, unique=True, index=True)
     reference = Column(Text, nullable=True)
     in_reply_to = Column(String(255), nullable=True)
     sentiment = Column(String(255), nullable=True)
@@ -70,6 +75,116 @@ class ContentInfo(Base):
     
     contact = relationship("Contact", back_populates="content_info")
 
+class IndustryCacheEntry(Base):
+    __tablename__ = "industry_cache"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    cache_key = Column(String(255), nullable=False, unique=True, index=True)
+    industry = Column(String(255), nullable=False)
+    classified_at = Column(DateTime, default=datetime.utcnow)
+    hit_count = Column(Integer, default=0)
+
+class SentimentCacheEntry(Base):
+    __tablename__ = "sentiment_cache"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    body_hash = Column(String(64), nullable=False, unique=True, index=True)
+    sentiment = Column(String(50), nullable=False)
+    has_query = Column(Boolean, default=False)
+    queries = Column(Text, nullable=True)
+    stop_contact = Column(Boolean, default=False)
+    hit_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class EmailTemplate(Base):
+    __tablename__ = "email_templates"
+    __table_args__ = (UniqueConstraint("industry", "drip_number", "variant", "template_date", name="uq_email_template_slot"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    industry = Column(String(255), nullable=False)
+    drip_number = Column(Integer, nullable=False)
+    variant = Column(Integer, nullable=False, default=0)
+    template_date = Column(Date, nullable=False)
+    subject = Column(Text, nullable=False)
+    body = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class DripDraft(Base):
+    __tablename__ = "drip_drafts"
+    __table_args__ = (UniqueConstraint("contact_id", "drip_number", name="uq_drip_draft_contact_drip"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    contact_id = Column(Integer, ForeignKey("first.id", ondelete="CASCADE"), nullable=False)
+    drip_number = Column(Integer, nullable=False)
+    status = Column(String(20), nullable=False, default="pending")
+    batch_id = Column(String(255), nullable=True, index=True)
+    subject = Column(Text, nullable=True)
+    body = Column(Text, nullable=True)
+    scheduled_for = Column(Date, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class AssistantThread(Base):
+    __tablename__ = "assistant_threads"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    thread_id = Column(String(255), nullable=False, unique=True, index=True)
+    turn_count = Column(Integer, nullable=False, default=0)
+    file_attached = Column(Boolean, nullable=False, default=False)
+    replaced_by = Column(String(255), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class LLMCallMetric(Base):
+    __tablename__ = "llm_call_metrics"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    call_site = Column(String(100), nullable=False)
+    job = Column(String(100), nullable=True)
+    model = Column(String(100), nullable=True)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    cached_tokens = Column(Integer, nullable=False, default=0)
+    seconds = Column(Float, nullable=False, default=0.0)
+    retries = Column(Integer, nullable=False, default=0)
+    success = Column(Boolean, nullable=False, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class SendLogEntry(Base):
+    __tablename__ = "send_log"
+    __table_args__ = (Index("ix_send_log_account_sent_at", "account", "sent_at"),)
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    account = Column(String(255), nullable=False)
+    kind = Column(String(20), nullable=False, default="campaign")
+    sent_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class SendQuotaState(Base):
+    __tablename__ = "send_quota_state"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    account = Column(String(255), nullable=False, unique=True)
+    exhausted_until = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ShardConfig(Base):
+    __tablename__ = "shard_config"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    shard_count = Column(Integer, nullable=False, default=1)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class MailboxSyncState(Base):
+    __tablename__ = "mailbox_sync_state"
+    __table_args__ = (UniqueConstraint("account", "mailbox", name="uq_mailbox_sync_account_mailbox"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    account = Column(String(255), nullable=False)
+    mailbox = Column(String(255), nullable=False)
+    uidvalidity = Column(BigInteger, nullable=False)
+    last_uid = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 # --- Database configuration and session management ---
 
 DB_CONFIG = {
@@ -125,9 +240,60 @@ def get_db_session():
     finally:
         db.close()
 
-def create_tables():
+def upgrade_schema() -> set:
+    """
+    Adds columns and indexes that create_all() will not retrofit onto tables
+    that already exist. Returns the (table, column) pairs it added.
+    """
+    inspector = inspect(engine)
+    added_columns = set()
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing_columns = {col["name"] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE `{table.name}` ADD COLUMN `{column.name}` {column_type} NULL"))
+                added_columns.add((table.name, column.name))
+                logger.info(f"Added column {column.name} to {table.name}")
+            except Exception as e:
+                logger.error(f"Could not add column {column.name} to {table.name}: {e}")
+
+        existing_indexes = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            try:
+                index.create(bind=engine)
+                logger.info(f"Created index {index.name} on {table.name}")
+            except Exception as e:
+                logger.error(f"Could not create index {index.name} on {table.name}: {e}")
+    return added_columns
+
+def backfill_contact_thread_ids():
+    """Copies each contact's OpenAI thread from its legacy thread_created content row."""
+    with engine.begin() as conn:
+        result = conn.execute(text(
+            "UPDATE `first` SET thread_id = ("
+            "SELECT MIN(c.thread_id) FROM `content` c WHERE c.contact_id = `first`.id AND c.thread_id IS NOT NULL"
+            ") WHERE thread_id IS NULL"
+        ))
+    logger.info(f"Backfilled thread_id for {result.rowcount} contacts")
+
+def create_tables() -> set:
+    """Creates and upgrades the schema; returns the (table, column) pairs added to existing tables."""
     if DATABASE_AVAILABLE and engine:
         Base.metadata.create_all(bind=engine)
+        added_columns = upgrade_schema()
+        if ("first", "thread_id") in added_columns:
+            backfill_contact_thread_ids()
         logger.info("Database tables checked/created successfully")
+        return added_columns
     else:
         logger.warning("Database not available, skipping table creation")
+        return set()